@@ -0,0 +1,93 @@
+# -*- coding: utf8 -*-
+'''
+Backend "nulo", que não abre nenhuma janela nem lê nenhum dispositivo de
+entrada.
+
+Utilizado para rodar simulações em servidores, testes e benchmarks em
+máquinas sem display. Deve ser selecionado explicitamente antes da
+inicialização:
+
+>>> from FGAme import conf
+>>> conf.set_backend('null')                                # doctest: +SKIP
+
+Por padrão, o loop principal não espera pelo tempo real: cada frame executa
+exatamente um passo de física e o loop roda o mais rápido possível. Os
+eventos de entrada podem ser simulados chamando diretamente os métodos
+process_* do objeto de input (veja conf.get_input()).
+'''
+
+from FGAme.core import Canvas, Input, MainLoop
+from FGAme.core.mainloop import MAX_STEPS
+
+
+class NullCanvas(Canvas):
+
+    '''Canvas que ignora todas as operações de pintura'''
+
+    __slots__ = []
+
+    def show(self):
+        pass
+
+    def flip(self):
+        pass
+
+    def paint_pixel(self, pos, color='black'):
+        pass
+
+    def paint_circle(self, radius, pos, color='black', solid=True):
+        pass
+
+    def paint_poly(self, L_points, color='black', solid=True):
+        pass
+
+    def paint_aabb(self, xmin, xmax, ymin, ymax, color='black', solid=True):
+        pass
+
+    def paint_rect(self, rect, color='black', solid=True):
+        pass
+
+    def paint_line(self, pt1, pt2, color='black', solid=True):
+        pass
+
+    def paint_image(self, pos, texture):
+        pass
+
+    def clear_background(self, color=None):
+        pass
+
+
+class NullInput(Input):
+
+    '''Input sem nenhum dispositivo associado.
+
+    Nenhum evento é gerado pelo backend, mas os callbacks de long-press
+    continuam sendo executados para as teclas e botões pressionados
+    programaticamente com process_key_down() e
+    process_mouse_button_down().'''
+
+    def query(self):
+        self.process_long_press()
+        self.process_mouse_longpress()
+
+
+class NullMainLoop(MainLoop):
+
+    '''Loop principal sem renderização.
+
+    Se wait=False (padrão), cada frame executa um único passo de física e o
+    loop roda o mais rápido possível. Com wait=True, o loop acompanha o tempo
+    real como nos outros backends. Em ambos os casos, a etapa de desenho é
+    omitida.
+    '''
+
+    def __init__(self, fps=None, physics_fps=None, max_steps=MAX_STEPS,
+                 interpolate=False):
+        super(NullMainLoop, self).__init__(fps, physics_fps, max_steps,
+                                           interpolate)
+
+    def run(self, state, timeout=None, maxiter=None, wait=False):
+        super(NullMainLoop, self).run(state, timeout, maxiter, wait)
+
+    def draw(self, state, screen, alpha=None):
+        pass
@@ -0,0 +1,4 @@
+mainloop = 'NullMainLoop'
+screen = 'NullCanvas'
+input = 'NullInput'
+imports = []
\ No newline at end of file
@@ -27,10 +27,14 @@ def all(size=None):
         t0 = time.time()
         text = func.__doc__
         func_name = func.__name__
-        func()
+        rate = func()
         t1 = time.time()
         print('%s: (%s) %.3f sec' % (func_name, text, t1 - t0))
 
+        # Algumas funções também retornam o número de iterações por segundo
+        if rate:
+            print('    %.1f iter/sec' % rate)
+
 #===============================================================================
 # Vetores
 #===============================================================================
@@ -65,5 +69,60 @@ def vtuple():
         v2 += (1, 1)
         v += (1, 1)
 
+#===============================================================================
+# Solver de contatos
+#===============================================================================
+
+
+def solver_contacts(num_circles=150, frames=120):
+    '''Retorna os contatos de uma pilha de círculos em repouso dentro de uma
+    caixa, já inicializados e prontos para as iterações do solver'''
+
+    import random
+    from FGAme.physics import Simulation, Circle, AABB
+
+    random.seed(1)
+    sim = Simulation(gravity=500, dfriction=0.3, restitution=0.0,
+                     sleep_time=None)
+    for bbox in [(-10000, 10000, -10000, 0), (-10000, -200, 0, 10000),
+                 (200, 10000, 0, 10000)]:
+        sim.add(AABB(bbox=bbox, mass='inf'))
+    for _ in range(num_circles):
+        pos = (random.uniform(-190, 190), random.uniform(10, 1200))
+        sim.add(Circle(10, pos=pos))
+    for _ in range(frames):
+        sim.update(1 / 60.)
+
+    contacts = sim.narrow_phase(sim.broad_phase(sim._objects))
+    for col in contacts:
+        col.init()
+    return contacts
+
+
+@bench
+def solver_vec2():
+    '''Iterações do solver padrão (Collision.step())'''
+
+    contacts = solver_contacts()
+    niter = BASE_SIZE // 10
+    t0 = time.time()
+    for _ in range(niter):
+        for col in contacts:
+            col.step()
+    return niter / (time.time() - t0)
+
+
+@bench
+def solver_scalar():
+    '''Iterações do ScalarContactSolver'''
+
+    from FGAme.physics import ScalarContactSolver
+
+    contacts = solver_contacts()
+    niter = BASE_SIZE // 10
+    t0 = time.time()
+    ScalarContactSolver().solve(contacts, niter)
+    return niter / (time.time() - t0)
+
 if __name__ == '__main__':
     all()
\ No newline at end of file
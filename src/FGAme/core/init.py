@@ -107,6 +107,7 @@ class Control(object):
                         '\nSupported backends are:'
                         '\n    * pygame'
                         '\n    * sdl2'
+                        '\n    * null (headless)'
                         # '\n    * kivy'
                     )
                 raise RuntimeError(msg)
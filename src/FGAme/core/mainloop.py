@@ -7,6 +7,12 @@ import gc
 # gc.enable()
 
 
+# Número máximo de passos de física executados por frame. Quando a física não
+# consegue acompanhar o tempo real, o tempo excedente é descartado e o evento
+# 'frame-skip' é emitido com o número de passos perdidos.
+MAX_STEPS = 5
+
+
 class MainLoop(object):
 
     '''Implementa o loop principal de jogo.
@@ -19,16 +25,36 @@ class MainLoop(object):
         * Gerenciar os estados de jogo (ex., coordenar entre estados de menu,
           jogo, configuração, etc)
 
+    A física avança em passos de tamanho fixo dt = 1 / physics_fps,
+    independentemente da taxa de renderização. O tempo real decorrido é
+    acumulado e cada frame executa zero ou mais passos de física (no máximo
+    max_steps) para consumi-lo. A fração de passo que sobra no acumulador é
+    utilizada para desenhar os objetos em posições interpoladas entre os dois
+    últimos estados da física, caso o estado implemente os métodos
+    save_state(), interpolate(alpha) e restore_state(saved) (veja World).
+
     Parameters
     ----------
         fps : float
-            Número de quadros por segundo que a simulação de física deve
-            tentar rodar
+            Número de quadros por segundo que a renderização deve tentar
+            manter (o padrão é env.screen_fps)
+        physics_fps : float
+            Número de passos de física por segundo de tempo real (o padrão é
+            env.physics_fps)
+        max_steps : int
+            Número máximo de passos de física por frame renderizado
+        interpolate : bool
+            Se falso, desenha sempre o último estado da física
     '''
 
-    def __init__(self, fps=60):
-        self.fps = fps
-        self.dt = 1.0 / self.fps
+    def __init__(self, fps=None, physics_fps=None, max_steps=MAX_STEPS,
+                 interpolate=True):
+        self.fps = fps or env.screen_fps
+        self.physics_fps = physics_fps or env.physics_fps
+        self.dt = 1.0 / self.physics_fps
+        self.render_dt = 1.0 / self.fps
+        self.max_steps = max_steps
+        self.interpolate = interpolate
 
     def init(self):
         '''Ações adicionais que devem ser feitas entre a alocação e execução
@@ -37,44 +63,65 @@ class MainLoop(object):
         pass
 
     def run(self, state, timeout=None, maxiter=None, wait=True):
+        '''Executa o loop principal com o estado fornecido.
+
+        O loop termina após timeout segundos, maxiter frames ou uma chamada a
+        stop(). Se wait for falso, cada frame executa exatamente um passo de
+        física e o loop roda o mais rápido possível, sem esperar pelo tempo
+        real.'''
+
         # Assegura que o motor de jogos foi inicializado
-        from FGAme.core import init
+        from FGAme.core import init, conf
         init()
 
         # Prepara o loop principal
         self._running = True
         sleep = time.sleep
         gettime = time.time
-        input_ = env.input_object
-        screen = env.canvas_object
-        sim_start = gettime()
+        input_ = conf.get_input()
+        screen = conf.get_canvas()
+        dt = self.dt
+        max_steps = self.max_steps
+        interpolate = self.interpolate and hasattr(state, 'interpolate')
+        sim_start = last = gettime()
         screen.show()
-        n_skip = 0
+        accumulator = dt
         n_iter = 0
 
         while self._running:
             n_iter += 1
             t0 = gettime()
+            if wait:
+                accumulator += t0 - last
+            else:
+                accumulator = dt
+            last = t0
 
-            # Captura entrada do usuário e atualiza o estado (e física) de
-            # acordo
+            # Captura entrada do usuário e executa os passos de física
+            # acumulados
             input_.query()
-            state.update(self.dt)
+            n_steps = 0
+            while accumulator >= dt and n_steps < max_steps:
+                if interpolate:
+                    state.save_state()
+                state.update(dt)
+                accumulator -= dt
+                n_steps += 1
+
+            # Descarta o tempo que a física não conseguiu acompanhar
+            if accumulator >= dt:
+                n_skip = int(accumulator / dt)
+                accumulator -= n_skip * dt
+                state.trigger('frame-skip', n_skip)
 
             # Desenha os objetos na tela
-            screen.clear_background(state.background)
-            state.get_render_tree().paint(screen)
-            screen.flip()
+            self.draw(state, screen, accumulator / dt if interpolate else None)
 
             # Espera até completar o frame
             t = gettime()
-            wait_time = self.dt - (t - t0)
-            if wait_time > 0 and wait:
-                sleep(max(0, wait_time))
-            else:
-                n_skip += 1
-                state.trigger('frame-skip', -wait)
-            t0 = t
+            wait_time = self.render_dt - (t - t0)
+            if wait and wait_time > 0:
+                sleep(wait_time)
 
             # Verifica que já ultrapassou o tempo de simulação
             if timeout is not None and t - sim_start >= timeout:
@@ -82,6 +129,22 @@ class MainLoop(object):
             if maxiter is not None and n_iter >= maxiter:
                 break
 
+    def draw(self, state, screen, alpha=None):
+        '''Desenha o estado na tela.
+
+        Se alpha não for None, os objetos são desenhados na posição
+        interpolada por esta fração de passo entre os dois últimos estados da
+        física.'''
+
+        saved = None
+        if alpha is not None:
+            saved = state.interpolate(alpha)
+        screen.clear_background(state.background)
+        state.get_render_tree().paint(screen)
+        screen.flip()
+        if saved is not None:
+            state.restore_state(saved)
+
     def stop(self):
         '''Finaliza o jogo'''
 
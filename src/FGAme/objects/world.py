@@ -48,6 +48,25 @@ class World(EventDispatcher):
     adamping = delegate_to('_simulation.adamping')
     time = delegate_to('_simulation.time', read_only=True)
 
+    # Interpolação dos estados da física na renderização (veja MainLoop)
+    save_state = delegate_to('_simulation.save_state', read_only=True)
+    interpolate = delegate_to('_simulation.interpolate', read_only=True)
+    restore_state = delegate_to('_simulation.restore_state', read_only=True)
+
+    def get_col_layer(self, name):
+        '''Retorna o número do layer de colisão associado ao nome fornecido.
+
+        Objetos podem ser criados com ``col_layer='nome'``: o mundo atribui
+        um número (e portanto um bit na palavra de filtro de colisão) para
+        cada nome novo.
+
+        >>> world = World()
+        >>> world.get_col_layer('bullets')
+        1
+        '''
+
+        return self._simulation.get_col_layer(name)
+
     # Gerenciamento de objetos ################################################
     def add(self, obj, layer=0):
         '''Adiciona um novo objeto ao mundo.
@@ -31,11 +31,19 @@ from FGAme.physics.particle import Particle
 from FGAme.physics.aabb import AABB
 from FGAme.physics.circle import Circle
 from FGAme.physics.poly import Poly, RegularPoly, Rectangle
-from FGAme.physics.collision import Collision, CBBContact, AABBContact
+from FGAme.physics.collision import (Collision, CBBContact, AABBContact,
+                                     ContactCache, ContactManifold,
+                                     ManifoldCollision)
 from FGAme.physics.collision_pairs import (get_collision,
                                            get_collision_generic,
-                                           CollisionError)
+                                           CollisionError, collision_pair,
+                                           register_shape)
 from FGAme.physics import collision_pairs as collision
+from FGAme.physics.body_arrays import BodyArrays
+from FGAme.physics.integrator import (Integrator, SemiImplicitEuler,
+                                      VelocityVerlet, RungeKutta4)
+from FGAme.physics.contact_solver import (ScalarContactSolver,
+                                          ArrayContactSolver)
 from FGAme.physics.forces import *
 from FGAme.physics.simulation import *
 
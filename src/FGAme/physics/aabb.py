@@ -1,7 +1,8 @@
 # -*- coding: utf8 -*-
 
 from FGAme.physics import LinearRigidBody
-from FGAme.mathutils import aabb_bbox, sqrt, AABB as _AABB
+from FGAme.physics.flags import BodyFlags as flags
+from FGAme.mathutils import aabb_bbox, sqrt, Vec2, AABB as _AABB
 
 __all__ = ['AABB']
 
@@ -52,6 +53,7 @@ class AABB(LinearRigidBody):
     '''
 
     __slots__ = []
+    _shape_id = 2
 
     def __init__(self, xmin=None, xmax=None, ymin=None, ymax=None,
                  pos=None, vel=(0, 0), mass=None, density=None,
@@ -79,6 +81,19 @@ class AABB(LinearRigidBody):
         data = ', '.join('%.1f' % x for x in self.bbox)
         return '%s(bbox=[%s], vel=(%s))' % (tname, data, vel)
 
+    def support(self, direction):
+        '''Retorna o vértice da caixa mais distante na direção fornecida
+        (ponto de suporte).
+
+        >>> AABB(shape=(4, 2)).support((-1, 1))
+        Vec2(-2, 1)
+        '''
+
+        ux, uy = direction
+        x, y = self._pos
+        return Vec2(x + self._delta_x if ux >= 0 else x - self._delta_x,
+                    y + self._delta_y if uy >= 0 else y - self._delta_y)
+
     # Torna as os limites da AABB modificáveis ################################
     @property
     def xmin(self):
@@ -90,6 +105,7 @@ class AABB(LinearRigidBody):
         xmax = self.xmax
         self._pos.x = (xmax + xmin) / 2
         self._delta_x = (xmax - xmin) / 2
+        self.flags |= flags.dirty_bbox
 
     @property
     def xmax(self):
@@ -101,6 +117,7 @@ class AABB(LinearRigidBody):
         xmax = float(value)
         self._pos.x = (xmax + xmin) / 2
         self._delta_x = (xmax - xmin) / 2
+        self.flags |= flags.dirty_bbox
 
     @property
     def ymin(self):
@@ -112,6 +129,7 @@ class AABB(LinearRigidBody):
         ymax = self.ymax
         self._pos.y = (ymax + ymin) / 2
         self._delta_y = (ymax - ymin) / 2
+        self.flags |= flags.dirty_bbox
 
     @property
     def ymax(self):
@@ -123,6 +141,7 @@ class AABB(LinearRigidBody):
         ymax = float(value)
         self._pos.y = (ymax + ymin) / 2
         self._delta_y = (ymax - ymin) / 2
+        self.flags |= flags.dirty_bbox
 
     # Propriedades geométricas ################################################
     def area(self):
@@ -0,0 +1,266 @@
+# -*- coding: utf8 -*-
+'''
+Armazenamento em estrutura de arrays (SoA) para a integração dos objetos.
+
+No modo padrão, a simulação percorre a lista de objetos três vezes por frame
+(accumulate_accelerations, resolve_velocities e resolve_positions) chamando
+init_accel(), boost(), aboost(), move() e rotate() em cada objeto, o que cria
+vários Vec2 temporários por objeto.
+
+A classe BodyArrays mantém arrays contíguos com as posições, velocidades,
+ângulos, velocidades angulares, massas e momentos de inércia inversos,
+gravidade e amortecimentos de todos os objetos da simulação. Cada passo de
+integração carrega o estado dos objetos nestes arrays, resolve todos os
+objetos com algumas expressões do NumPy e escreve de volta apenas os valores
+que mudaram.
+
+Os objetos continuam sendo a referência para o restante da simulação (broad
+e narrow phase, solver de contatos, etc), que pode modificar as velocidades e
+posições entre os passos de integração. Por isto, os arrays são recarregados
+no início de cada passo e refletem o estado da simulação no final do último
+passo. As posições e ângulos só são carregados no passo de integração das
+posições.
+
+Este módulo requer o NumPy.
+'''
+
+from itertools import chain, compress
+from FGAme.mathutils import Vec2, nullvec2
+from FGAme.physics.flags import BodyFlags
+from FGAme.physics.dynamic_object import Body
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+__all__ = ['BodyArrays', 'has_custom_forces']
+
+IS_SLEEP = BodyFlags.is_sleeping
+DIRTY_ANY = BodyFlags.dirty_any
+
+
+def has_custom_forces(obj):
+    '''Verdadeiro se o objeto define uma força ou um torque externo (seja por
+    uma subclasse ou por "monkey patching")'''
+
+    cls = type(obj)
+    if cls.force is not Body.force or cls.torque is not Body.torque:
+        return True
+    ns = getattr(obj, '__dict__', None)
+    return bool(ns) and ('force' in ns or 'torque' in ns)
+
+
+class BodyArrays(object):
+
+    '''Estado dos objetos de uma simulação em arrays contíguos.
+
+    Os arrays pos, vel e gravity possuem forma (N, 2) e os arrays theta,
+    omega, invmass, invinertia, damping e adamping possuem forma (N,), em que N
+    é o número de objetos da simulação.
+
+    Example
+    -------
+
+    >>> from FGAme.physics import Simulation, Circle
+    >>> sim = Simulation(gravity=10, soa=True)
+    >>> sim.add(Circle(1, vel=(1, 0)))
+    >>> sim.update(0.5)
+    >>> sim.arrays.vel.tolist(), sim.arrays.pos.tolist()
+    ([[1.0, -5.0]], [[0.5, -2.5]])
+    '''
+
+    __slots__ = ['objects', 'pos', 'vel', 'theta', 'omega', 'invmass',
+                 'invinertia', 'gravity', 'damping', 'adamping', 'awake',
+                 'linear', 'angular', 'forced']
+
+    def __init__(self):
+        if np is None:
+            raise RuntimeError('BodyArrays requires numpy')
+        self.objects = []
+        self.pos = self.vel = self.gravity = np.zeros((0, 2))
+        self.theta = self.omega = self.invmass = self.invinertia = \
+            self.damping = self.adamping = np.zeros(0)
+        self.awake = self.linear = self.angular = np.zeros(0, dtype=bool)
+        self.forced = []
+
+    def __len__(self):
+        return len(self.objects)
+
+    ###########################################################################
+    #                       Carregamento e escrita
+    ###########################################################################
+    def load_velocities(self, objects):
+        '''Carrega as velocidades e os parâmetros físicos dos objetos.
+
+        Os objetos acordados são marcados na máscara awake e os que também
+        possuem massa (momento de inércia) finita na máscara linear (angular).
+        Os índices dos objetos que
+        definem forças ou torques externos são guardados em forced.'''
+
+        self.objects = objects
+        data = _load(objects, [
+            (o._vel.x, o._vel.y, o._omega, o._invmass, o._invinertia,
+             o._gravity.x, o._gravity.y, o._damping, o._adamping,
+             o.flags & IS_SLEEP)
+            for o in objects])
+        self.vel = data[:, 0:2]
+        self.omega = data[:, 2]
+        self.invmass = data[:, 3]
+        self.invinertia = data[:, 4]
+        self.gravity = data[:, 5:7]
+        self.damping = data[:, 7]
+        self.adamping = data[:, 8]
+        self.awake = awake = data[:, 9] == 0
+        self.linear = awake & (self.invmass != 0)
+        self.angular = awake & (self.invinertia != 0)
+        self.forced = [i for i, obj in enumerate(objects)
+                       if has_custom_forces(obj) and
+                       not obj.flags & IS_SLEEP]
+
+    def load_positions(self, objects):
+        '''Carrega as posições, ângulos e velocidades dos objetos.
+
+        Retorna uma tupla com os arrays das velocidades linear e angular de
+        estabilização (atributos _e_vel e _e_omega dos objetos).'''
+
+        self.objects = objects
+        data = _load(objects, [
+            (o._pos.x, o._pos.y, o._vel.x, o._vel.y, o._e_vel.x, o._e_vel.y,
+             o._theta, o._omega, o._e_omega, o._invmass, o._invinertia,
+             o.flags & IS_SLEEP)
+            for o in objects])
+        self.pos = data[:, 0:2]
+        self.vel = data[:, 2:4]
+        self.theta = data[:, 6]
+        self.omega = data[:, 7]
+        self.invmass = data[:, 9]
+        self.invinertia = data[:, 10]
+        self.awake = awake = data[:, 11] == 0
+        self.linear = awake & (self.invmass != 0)
+        self.angular = awake & (self.invinertia != 0)
+        return data[:, 4:6], data[:, 8]
+
+    def store_velocities(self):
+        '''Escreve as velocidades dos objetos acordados de volta nos objetos
+        e zera as velocidades de estabilização'''
+
+        objects, linear, angular = self.objects, self.linear, self.angular
+        new = self.vel[linear]
+        for obj, x, y in zip(compress(objects, linear.tolist()),
+                             new[:, 0].tolist(), new[:, 1].tolist()):
+            obj._vel = Vec2(x, y)
+        for obj, w in zip(compress(objects, angular.tolist()),
+                          self.omega[angular].tolist()):
+            obj._omega = w
+        for obj in compress(objects, self.awake.tolist()):
+            obj._e_vel = nullvec2
+            obj._e_omega = 0.0
+
+    def store_positions(self, delta, dtheta):
+        '''Desloca as posições e ângulos dos objetos acordados e escreve os
+        valores que mudaram de volta nos objetos'''
+
+        objects = self.objects
+        asleep = ~self.awake
+        delta[asleep] = 0.0
+        dtheta[asleep] = 0.0
+        self.pos += delta
+        self.theta += dtheta
+
+        # Deslocamentos nulos não sujam a caixa de contorno (veja Body.move)
+        moved = (delta[:, 0] != 0) | (delta[:, 1] != 0)
+        rotated = dtheta != 0
+        new = self.pos[moved]
+        for obj, x, y in zip(compress(objects, moved.tolist()),
+                             new[:, 0].tolist(), new[:, 1].tolist()):
+            obj._pos = Vec2(x, y)
+            obj.flags |= DIRTY_ANY
+        for obj, value in zip(compress(objects, rotated.tolist()),
+                              self.theta[rotated].tolist()):
+            obj._theta = value
+            obj.flags |= DIRTY_ANY
+
+    def set_state(self, pos, vel, theta, omega):
+        '''Escreve um estado provisório nos objetos dinâmicos acordados sem
+        sujar as caixas de contorno.
+
+        Utilizado para avaliar forças externas em estados intermediários de
+        um passo de integração. O estado original deve ser restaurado
+        chamando set_state() novamente.'''
+
+        objects, linear, angular = self.objects, self.linear, self.angular
+        pos, vel = pos[linear], vel[linear]
+        for obj, x, y, vx, vy in zip(compress(objects, linear.tolist()),
+                                     pos[:, 0].tolist(), pos[:, 1].tolist(),
+                                     vel[:, 0].tolist(), vel[:, 1].tolist()):
+            obj._pos = Vec2(x, y)
+            obj._vel = Vec2(vx, vy)
+        for obj, value, w in zip(compress(objects, angular.tolist()),
+                                 theta[angular].tolist(),
+                                 omega[angular].tolist()):
+            obj._theta = value
+            obj._omega = w
+
+    ###########################################################################
+    #                             Integração
+    ###########################################################################
+    def accelerations(self, t, vel=None, omega=None):
+        '''Retorna os arrays com as acelerações lineares e angulares de cada
+        objeto no instante t.
+
+        As acelerações devidas aos amortecimentos são calculadas a partir de
+        vel e omega (por padrão, as velocidades carregadas). As forças e
+        torques externos são avaliados com o estado atual dos objetos. Objetos
+        dormindo ou com massa infinita possuem aceleração nula.'''
+
+        if vel is None:
+            vel = self.vel
+        if omega is None:
+            omega = self.omega
+        accel = self.gravity - self.damping[:, None] * vel
+        alpha = -self.adamping * omega
+
+        # Forças e torques externos são avaliados apenas para os objetos que
+        # os definem
+        objects = self.objects
+        for i in self.forced:
+            obj = objects[i]
+            if obj._invmass:
+                accel[i] += tuple(obj.force(t) * obj._invmass)
+            if obj._invinertia:
+                alpha[i] += obj.torque(t) * obj._invinertia
+
+        accel[~self.linear] = 0.0
+        alpha[~self.angular] = 0.0
+        return accel, alpha
+
+    def integrate_velocities(self, objects, t, dt):
+        '''Atualiza as velocidades dos objetos acordados a partir da
+        gravidade, dos amortecimentos e das forças e torques externos.
+
+        Equivale a Simulation.accumulate_accelerations() seguido de
+        Simulation.resolve_velocities() no modo padrão.'''
+
+        self.load_velocities(objects)
+        accel, alpha = self.accelerations(t)
+        self.vel += accel * dt
+        self.omega += alpha * dt
+        self.store_velocities()
+
+    def integrate_positions(self, objects, dt):
+        '''Atualiza as posições e ângulos dos objetos acordados a partir das
+        velocidades (incluindo as velocidades de estabilização calculadas
+        pelo solver de contatos).
+
+        Equivale a Simulation.resolve_positions() no modo padrão.'''
+
+        e_vel, e_omega = self.load_positions(objects)
+        self.store_positions((self.vel + e_vel) * dt,
+                             (self.omega + e_omega) * dt)
+
+
+def _load(objects, rows):
+    # Empacota uma lista de tuplas de mesmo tamanho em um array (N, k)
+    k = len(rows[0]) if rows else 1
+    data = np.fromiter(chain.from_iterable(rows), float, len(rows) * k)
+    return data.reshape(len(objects), k)
@@ -1,10 +1,24 @@
 # -*- coding: utf8 -*-
 
-from mathtools import shadow_y
+import itertools
+from array import array
+from math import floor
+from mathtools import shadow_x, shadow_y
 from collections import MutableSequence
-from FGAme.physics import CBBContact, AABBContact
-from FGAme.physics import get_collision, get_collision_generic, CollisionError
-from FGAme.physics.flags import BodyFlags
+from FGAme.physics import CBBContact, AABBContact, ContactCache
+from FGAme.physics.collision_pairs import (COLLISION_TABLE, SHAPE_ID_BITS,
+                                           forget_separating_axes)
+from FGAme.physics.gjk import forget_simplices
+from FGAme.physics.flags import BodyFlags, CollisionFilter
+try:
+    import numpy as np
+    from FGAme.physics.collision_batch import batch_collisions, BATCH_MIN_PAIRS
+except ImportError:
+    np = None
+try:
+    from time import perf_counter as clock
+except ImportError:
+    from time import time as clock
 
 
 class AbstractCollisionPhase(MutableSequence):
@@ -92,13 +106,72 @@ class BroadPhase(AbstractCollisionPhase):
         bf.update(L) -> executa algoritmo em lista de objetos L
         iter(bf)     -> itera sobre todos os pares gerados no passo anterior
 
+    Broad-phases que mantêm estruturas persistentes entre frames também
+    recebem notificações da simulação quando objetos são adicionados ou
+    removidos:
+
+        bf.add_object(obj)    -> objeto foi adicionado à simulação
+        bf.remove_object(obj) -> objeto foi removido da simulação
+
+    Para evitar a criação de um objeto por par, as broad-phases podem
+    registrar o resultado como um buffer plano do tipo array('i') com os
+    índices dos objetos na lista passada para update() (normalmente a lista de
+    objetos da simulação) utilizando o método set_buffer(). Neste caso,
+    bf.buffer guarda os índices [i0, j0, i1, j1, ...] e bf.table a lista de
+    objetos. Os pares (do tipo dado pelo atributo pair_class) só são criados
+    caso o usuário acesse os pares da broad-phase, o que invalida o buffer.
     '''
 
-    __slots__ = []
+    __slots__ = ['buffer', 'table', '_pair_list']
+
+    pair_class = AABBContact
+
+    def __init__(self, data=[], world=None):
+        self.buffer = None
+        self.table = None
+        super(BroadPhase, self).__init__(data, world)
+
+    @property
+    def _data(self):
+        if self._pair_list is None:
+            table = self.table
+            buffer = self.buffer
+            pair = self.pair_class
+            self._pair_list = [pair(table[buffer[k]], table[buffer[k + 1]])
+                               for k in range(0, len(buffer), 2)]
+            self.buffer = None
+        return self._pair_list
+
+    @_data.setter
+    def _data(self, value):
+        self._pair_list = value
+        self.buffer = None
+
+    def set_buffer(self, table, buffer):
+        '''Define o resultado da broad-phase a partir de um buffer de índices
+        [i0, j0, i1, j1, ...] que se referem aos objetos da lista table'''
+
+        self.table = table
+        self.buffer = buffer
+        self._pair_list = None
+
+    def add_object(self, obj):
+        '''Notifica a broad-phase que um objeto foi adicionado à simulação.
+
+        A implementação padrão não faz nada.'''
+
+    def remove_object(self, obj):
+        '''Notifica a broad-phase que um objeto foi removido da simulação.
+
+        A implementação padrão não faz nada.'''
 
     def get_collide_filter(self):
         '''Retorna uma função que aceita ou rejeita colisões entre dois objetos
-        baseada na máscara de bits de ambos'''
+        baseada na máscara de bits de ambos.
+
+        As broad-phases embutidas não chamam esta função para cada par: elas
+        testam diretamente as palavras de filtro pré-compiladas de cada objeto
+        (``A._col_filter & B._col_mask``, veja CollisionFilter).'''
 
         try:
             return self.world.can_collide
@@ -121,32 +194,28 @@ class BroadPhaseAABB(BroadPhase):
     __slots__ = []
 
     def update(self, L):
-        IS_SLEEP = BodyFlags.is_sleeping
-        can_collide = self.get_collide_filter()
         col_idx = 0
-        objects = sorted(L, key=lambda obj: obj.xmin)
-        self._data[:] = []
+        order = sorted(range(len(L)), key=lambda idx: L[idx].xmin)
+        buffer = array('i')
 
         # Os objetos estão ordenados. Este loop detecta as colisões da CBB e
-        # salva o resultado na lista broad collisions
-        for i, A in enumerate(objects):
+        # salva o resultado no buffer de índices
+        for i, a in enumerate(order):
+            A = L[a]
             A_right = A.xmax
-            A_dynamic = A.is_dynamic()
+            A_filter = A._col_filter
 
-            for j in range(i + 1, len(objects)):
-                B = objects[j]
-                if not can_collide(A, B):
-                    continue
+            for j in range(i + 1, len(order)):
+                b = order[j]
+                B = L[b]
 
                 # Procura na lista enquanto xmin de B for menor que xmax de A
                 B_left = B.xmin
                 if B_left > A_right:
                     break
 
-                # Não detecta colisão entre dois objetos estáticos/cinemáticos
-                if not A_dynamic and not B.is_dynamic():
-                    continue
-                if A.flags & B.flags & IS_SLEEP:
+                # Filtros de layer, grupo e objetos estáticos/dormindo
+                if A_filter & B._col_mask:
                     continue
 
                 # Testa a colisão entre as AABBs
@@ -155,31 +224,56 @@ class BroadPhaseAABB(BroadPhase):
 
                 # Adiciona à lista de colisões grosseiras
                 col_idx += 1
-                self._data.append(AABBContact(A, B))
+                buffer.append(a)
+                buffer.append(b)
+
+        self.set_buffer(L, buffer)
 
 
 class BroadPhaseCBB(BroadPhase):
 
     '''Implementa a broad-phase detectando todos os pares de CBBs que estão
-    em contato no frame'''
+    em contato no frame.
+
+    O resultado é registrado como um buffer de índices (veja BroadPhase), de
+    modo que a NarrowPhase pode testar os pares de círculos e AABBs com o
+    kernel vetorizado.
+
+    Example
+    -------
+
+    >>> from FGAme.physics import Circle
+    >>> A, B, C = Circle(10, (0, 0)), Circle(10, (15, 0)), Circle(10, (50, 0))
+    >>> bf = BroadPhaseCBB()
+    >>> bf.update([A, B, C])
+    >>> bf.buffer.tolist()
+    [0, 1]
+    >>> [(p.A, p.B) for p in bf] == [(A, B)]
+    True
+    '''
 
     __slots__ = []
 
+    pair_class = CBBContact
+
     def update(self, L):
-        can_collide = self.get_collide_filter()
-        L = sorted(L, key=lambda obj: obj.pos.x - obj.cbb_radius)
-        N = len(L)
-        self._data[:] = []
+        order = sorted(range(len(L)),
+                       key=lambda idx: L[idx]._pos.x - L[idx].cbb_radius)
+        N = len(order)
+        buffer = array('i')
 
         # Os objetos estão ordenados. Este loop detecta as colisões da CBB e
-        # salva o resultado na lista broad collisions
-        for i, A in enumerate(L):
+        # salva o resultado no buffer de índices
+        for i, a in enumerate(order):
+            A = L[a]
             rA = A.cbb_radius
-            Amax = A.pos.x + rA
+            Amax = A._pos.x + rA
+            A_filter = A._col_filter
 
             for j in range(i + 1, N):
-                B = L[j]
-                if not can_collide(A, B):
+                b = order[j]
+                B = L[b]
+                if A_filter & B._col_mask:
                     continue
                 rB = B.cbb_radius
 
@@ -188,11 +282,14 @@ class BroadPhaseCBB(BroadPhase):
                     break
 
                 # Testa a colisão entre os círculos de contorno
-                if (A.pos - B.pos).norm() > rA + rB:
+                if (A._pos - B._pos).norm() > rA + rB:
                     continue
 
                 # Adiciona à lista de colisões grosseiras
-                self._data.append(CBBContact(A, B))
+                buffer.append(a)
+                buffer.append(b)
+
+        self.set_buffer(L, buffer)
 
 
 class BroadPhaseMixed(BroadPhase):
@@ -203,8 +300,6 @@ class BroadPhaseMixed(BroadPhase):
     __slots__ = []
 
     def update(self, L):
-        IS_SLEEP = BodyFlags.is_sleeping
-        can_collide = self.get_collide_filter()
         col_idx = 0
         objects = sorted(L, key=lambda obj: obj.pos.x - obj.cbb_radius)
         self._data[:] = []
@@ -214,11 +309,11 @@ class BroadPhaseMixed(BroadPhase):
         for i, A in enumerate(objects):
             A_radius = A.cbb_radius
             A_right = A.pos.x + A_radius
-            A_dynamic = A.is_dynamic()
+            A_filter = A._col_filter
 
             for j in range(i + 1, len(objects)):
                 B = objects[j]
-                if not can_collide(A, B):
+                if A_filter & B._col_mask:
                     continue
 
                 B_radius = B.cbb_radius
@@ -228,30 +323,1359 @@ class BroadPhaseMixed(BroadPhase):
                 if B_left > A_right:
                     break
 
-                # Não detecta colisão entre dois objetos estáticos/cinemáticos
-                if not A_dynamic and not B.is_dynamic():
-                    continue
-                if A.flags & B.flags & IS_SLEEP:
-                    continue
-
                 # Testa a colisão entre os círculos de contorno
                 if (A.pos - B.pos).norm() > A_radius + B_radius:
                     continue
 
                 # Adiciona à lista de colisões grosseiras
                 col_idx += 1
-                if has_overlap(A.aabb, B.aabb):
+                if shadow_x(A, B) > 0 and shadow_y(A, B) > 0:
                     self._data.append(AABBContact(A, B))
 
 
+class BroadPhaseGrid(BroadPhase):
+
+    '''Implementa a broad-phase utilizando uma grade uniforme indexada por uma
+    tabela de dispersão (spatial hash).
+
+    Cada objeto é inserido em todas as células tocadas pela sua AABB e apenas
+    os objetos que compartilham alguma célula são comparados. Ao contrário das
+    broad-phases baseadas em ordenação, o custo não explode quando muitos
+    objetos compartilham a mesma faixa de x (ex.: pilhas altas).
+
+    Parameters
+    ----------
+
+    cell_size : float
+        Lado de cada célula da grade. Caso não seja fornecido, utiliza o
+        dobro da mediana dos valores de cbb_radius dos objetos.
+    max_cells : int
+        Objetos que ocupam mais que este número de células (ex.: paredes e
+        chão criados por World.add_bounds) não são inseridos na grade e são
+        testados diretamente contra os outros objetos.
+
+    Example
+    -------
+
+    >>> from FGAme.physics import Circle
+    >>> A, B, C = Circle(10, (0, 0)), Circle(10, (15, 0)), Circle(10, (50, 0))
+    >>> bf = BroadPhaseGrid(cell_size=20)
+    >>> [(p.A, p.B) for p in bf([A, B, C])] == [(A, B)]
+    True
+    '''
+
+    __slots__ = ['cell_size', 'max_cells', '_inferred_size', '_inferred_len']
+
+    def __init__(self, data=[], world=None, cell_size=None, max_cells=64):
+        super(BroadPhaseGrid, self).__init__(data, world)
+        self.cell_size = cell_size
+        self.max_cells = max_cells
+        self._inferred_size = None
+        self._inferred_len = -1
+
+    def get_cell_size(self, L):
+        '''Retorna o lado das células da grade para a lista de objetos L.
+
+        Caso cell_size não tenha sido definido explicitamente, o valor é
+        inferido a partir da mediana dos cbb_radius e só é recalculado quando
+        o número de objetos muda.'''
+
+        if self.cell_size is not None:
+            return self.cell_size
+
+        if self._inferred_len != len(L):
+            radii = sorted(obj.cbb_radius for obj in L)
+            size = 2 * radii[len(radii) // 2] if radii else 0.0
+            self._inferred_size = size or 1.0
+            self._inferred_len = len(L)
+        return self._inferred_size
+
+    def update(self, L):
+        inv_size = 1.0 / self.get_cell_size(L)
+        max_cells = self.max_cells
+        buffer = array('i')
+        append = buffer.append
+
+        # Distribui os objetos nas células. Cada entrada guarda a caixa de
+        # contorno para evitar recalcular as propriedades xmin, xmax, etc.
+        grid = {}
+        small = []
+        large = []
+        for a, A in enumerate(L):
+            xmin, xmax, ymin, ymax = A.xmin, A.xmax, A.ymin, A.ymax
+            i0, i1 = int(floor(xmin * inv_size)), int(floor(xmax * inv_size))
+            j0, j1 = int(floor(ymin * inv_size)), int(floor(ymax * inv_size))
+            entry = (a, A, xmin, xmax, ymin, ymax,
+                     A._col_filter, A._col_mask)
+
+            if (i1 - i0 + 1) * (j1 - j0 + 1) > max_cells:
+                large.append(entry)
+                continue
+
+            small.append(entry)
+            for i in range(i0, i1 + 1):
+                for j in range(j0, j1 + 1):
+                    try:
+                        grid[i, j].append(entry)
+                    except KeyError:
+                        grid[i, j] = [entry]
+
+        # Testa os pares dentro de cada célula. Um par que compartilha várias
+        # células é registrado somente na célula que contém o canto inferior
+        # esquerdo da intersecção entre as duas caixas de contorno.
+        for (i, j), cell in grid.items():
+            N = len(cell)
+            if N < 2:
+                continue
+
+            for k in range(N - 1):
+                a, A, Axmin, Axmax, Aymin, Aymax, A_filter, _ = cell[k]
+
+                for idx in range(k + 1, N):
+                    b, B, Bxmin, Bxmax, Bymin, Bymax, _, B_mask = cell[idx]
+
+                    # Testa a colisão entre as AABBs
+                    if Bxmin > Axmax or Axmin > Bxmax:
+                        continue
+                    if Bymin > Aymax or Aymin > Bymax:
+                        continue
+
+                    # Elimina os pares repetidos em outras células
+                    x = Axmin if Axmin > Bxmin else Bxmin
+                    y = Aymin if Aymin > Bymin else Bymin
+                    if (int(floor(x * inv_size)) != i or
+                            int(floor(y * inv_size)) != j):
+                        continue
+
+                    # Filtros de layer, grupo e objetos estáticos/dormindo
+                    if A_filter & B_mask:
+                        continue
+
+                    append(a)
+                    append(b)
+
+        # Objetos grandes são testados contra todos os outros objetos
+        for k, (a, A, Axmin, Axmax, Aymin, Aymax, A_filter, _) in \
+                enumerate(large):
+            for b, B, Bxmin, Bxmax, Bymin, Bymax, _, B_mask in \
+                    itertools.chain(large[k + 1:], small):
+
+                if A_filter & B_mask:
+                    continue
+                if Bxmin > Axmax or Axmin > Bxmax:
+                    continue
+                if Bymin > Aymax or Aymin > Bymax:
+                    continue
+
+                append(a)
+                append(b)
+
+        self.set_buffer(L, buffer)
+
+
+class _BVHNode(object):
+
+    '''Nó da árvore de volumes envolventes utilizada em BroadPhaseBVH.
+
+    Os limites xmin, xmax, ymin, ymax guardam a caixa de contorno "gorda" nas
+    folhas e a união das caixas dos filhos nos nós internos. As folhas também
+    guardam a caixa justa do objeto em bbox e o conjunto de folhas cujas
+    caixas gordas se sobrepõem em pairs.'''
+
+    __slots__ = ['xmin', 'xmax', 'ymin', 'ymax', 'parent', 'left', 'right',
+                 'height', 'obj', 'index', 'bbox', 'pairs']
+
+    def __init__(self, obj=None, index=0):
+        self.obj = obj
+        self.index = index
+        self.parent = self.left = self.right = None
+        self.height = 0
+        self.xmin = self.xmax = self.ymin = self.ymax = 0.0
+        self.bbox = None
+        self.pairs = set() if obj is not None else None
+
+    def set_union(self, A, B):
+        '''Define a caixa de contorno como a união das caixas de A e B'''
+
+        self.xmin = A.xmin if A.xmin < B.xmin else B.xmin
+        self.xmax = A.xmax if A.xmax > B.xmax else B.xmax
+        self.ymin = A.ymin if A.ymin < B.ymin else B.ymin
+        self.ymax = A.ymax if A.ymax > B.ymax else B.ymax
+
+    def perimeter(self):
+        '''Semi-perímetro da caixa de contorno'''
+
+        return self.xmax - self.xmin + self.ymax - self.ymin
+
+    def union_perimeter(self, other):
+        '''Semi-perímetro da união entre as caixas de contorno'''
+
+        return ((max(self.xmax, other.xmax) - min(self.xmin, other.xmin)) +
+                (max(self.ymax, other.ymax) - min(self.ymin, other.ymin)))
+
+    def has_overlap(self, other):
+        '''Retorna True se as caixas de contorno se sobrepõem'''
+
+        return not (other.xmin > self.xmax or self.xmin > other.xmax or
+                    other.ymin > self.ymax or self.ymin > other.ymax)
+
+    def query(self, xmin, xmax, ymin, ymax):
+        '''Itera sobre todas as folhas da sub-árvore que interceptam a caixa
+        de contorno dada'''
+
+        stack = [self]
+        pop = stack.pop
+        push = stack.append
+        while stack:
+            node = pop()
+            if (xmin > node.xmax or node.xmin > xmax or
+                    ymin > node.ymax or node.ymin > ymax):
+                continue
+            if node.left is None:
+                yield node
+            else:
+                push(node.left)
+                push(node.right)
+
+
+class BroadPhaseBVH(BroadPhase):
+
+    '''Implementa a broad-phase utilizando uma árvore dinâmica de volumes
+    envolventes (BVH) que persiste entre frames.
+
+    Cada objeto ocupa uma folha da árvore associada a uma caixa de contorno
+    alargada ("gorda") por uma margem. Um objeto só é reinserido na árvore
+    quando sua caixa justa deixa a caixa gorda, o que é verificado apenas para
+    os objetos que possuem a flag dirty_broadphase ligada. Ao contrário de
+    dirty_aabb, esta flag não é desligada pela leitura de obj.aabb. Os pares
+    de caixas gordas que se sobrepõem também são persistentes e só são
+    recalculados para os objetos reinseridos. Deste modo, objetos parados não
+    custam nada além de um teste de flags por frame.
+
+    Parameters
+    ----------
+
+    margin : float
+        Margem adicionada a cada lado da caixa justa para formar a caixa
+        gorda. Margens maiores reduzem o número de reinserções mas aumentam o
+        número de pares que precisam ser testados em cada frame.
+
+    Example
+    -------
+
+    >>> from FGAme.physics import Circle
+    >>> A, B, C = Circle(10, (0, 0)), Circle(10, (15, 0)), Circle(10, (50, 0))
+    >>> bf = BroadPhaseBVH(margin=5)
+    >>> [(p.A, p.B) for p in bf([A, B, C])] == [(A, B)]
+    True
+
+    Caso os objetos se movam, apenas os que deixaram as caixas gordas são
+    atualizados na árvore
+
+    >>> C.move(-25, 0)
+    >>> len(bf([A, B, C]))
+    2
+
+    A leitura de obj.aabb entre dois frames não esconde o movimento
+
+    >>> C.move(25, 0)
+    >>> C.aabb.xmin
+    40.0
+    >>> len(bf([A, B, C]))
+    1
+    '''
+
+    __slots__ = ['margin', '_root', '_leaves', '_counter']
+
+    def __init__(self, data=[], world=None, margin=10.0):
+        super(BroadPhaseBVH, self).__init__(data, world)
+        self.margin = float(margin)
+        self._root = None
+        self._leaves = {}
+        self._counter = itertools.count()
+
+    def add_object(self, obj):
+        if obj in self._leaves:
+            return
+
+        leaf = _BVHNode(obj, next(self._counter))
+        self._leaves[obj] = leaf
+        self._set_fat_box(leaf)
+        self._insert_leaf(leaf)
+        self._update_pairs(leaf)
+
+    def remove_object(self, obj):
+        leaf = self._leaves.pop(obj, None)
+        if leaf is not None:
+            self._remove_leaf(leaf)
+            for other in leaf.pairs:
+                other.pairs.discard(leaf)
+            leaf.pairs.clear()
+
+    def update(self, L):
+        DIRTY = BodyFlags.dirty_broadphase
+        NOT_DIRTY = BodyFlags.not_dirty_broadphase
+        leaves = self._leaves
+        self._data[:] = []
+        data = self._data
+
+        # Sincroniza caso a lista de objetos tenha sido modificada sem passar
+        # por add_object()/remove_object()
+        if len(L) != len(leaves):
+            self._sync(L)
+
+        # Apenas os objetos com a AABB modificada são testados e somente os
+        # que saíram da caixa gorda são reinseridos
+        moved = []
+        for obj in L:
+            if obj.flags & DIRTY:
+                obj.flags &= NOT_DIRTY
+                leaf = leaves[obj]
+                aabb = obj.aabb
+                xmin, xmax, ymin, ymax = leaf.bbox = (
+                    aabb.xmin, aabb.xmax, aabb.ymin, aabb.ymax)
+                if (xmin < leaf.xmin or xmax > leaf.xmax or
+                        ymin < leaf.ymin or ymax > leaf.ymax):
+                    self._remove_leaf(leaf)
+                    self._set_fat_box(leaf, refresh=False)
+                    self._insert_leaf(leaf)
+                    moved.append(leaf)
+
+        for leaf in moved:
+            self._update_pairs(leaf)
+
+        # Testa as caixas justas de todos os pares de caixas gordas
+        for leaf in leaves.values():
+            if not leaf.pairs:
+                continue
+
+            A = leaf.obj
+            Axmin, Axmax, Aymin, Aymax = leaf.bbox
+            A_filter = A._col_filter
+
+            for other in leaf.pairs:
+                if other.index < leaf.index:
+                    continue
+
+                B = other.obj
+                Bxmin, Bxmax, Bymin, Bymax = other.bbox
+                if Bxmin > Axmax or Axmin > Bxmax:
+                    continue
+                if Bymin > Aymax or Aymin > Bymax:
+                    continue
+
+                # Filtros de layer, grupo e objetos estáticos/dormindo
+                if A_filter & B._col_mask:
+                    continue
+
+                data.append(AABBContact(A, B))
+
+    def query(self, xmin, xmax, ymin, ymax):
+        '''Retorna a lista de objetos cujas caixas gordas interceptam a caixa
+        de contorno fornecida'''
+
+        if self._root is None:
+            return []
+        leaves = self._root.query(xmin, xmax, ymin, ymax)
+        return [leaf.obj for leaf in leaves]
+
+    def height(self):
+        '''Retorna a altura da árvore'''
+
+        return -1 if self._root is None else self._root.height
+
+    # Manipulação da árvore ###################################################
+    def _sync(self, L):
+        '''Sincroniza as folhas da árvore com a lista de objetos L'''
+
+        present = set(L)
+        for obj in list(self._leaves):
+            if obj not in present:
+                self.remove_object(obj)
+        for obj in L:
+            if obj not in self._leaves:
+                self.add_object(obj)
+
+    def _set_fat_box(self, leaf, refresh=True):
+        '''Atualiza a caixa justa da folha (caso refresh=True) e recalcula a
+        caixa gorda a partir dela'''
+
+        if refresh:
+            aabb = leaf.obj.aabb
+            leaf.bbox = (aabb.xmin, aabb.xmax, aabb.ymin, aabb.ymax)
+
+        margin = self.margin
+        xmin, xmax, ymin, ymax = leaf.bbox
+        leaf.xmin = xmin - margin
+        leaf.xmax = xmax + margin
+        leaf.ymin = ymin - margin
+        leaf.ymax = ymax + margin
+
+    def _update_pairs(self, leaf):
+        '''Recalcula a lista de pares de uma folha que foi reinserida'''
+
+        pairs = leaf.pairs
+        for other in list(pairs):
+            if not leaf.has_overlap(other):
+                pairs.discard(other)
+                other.pairs.discard(leaf)
+
+        for other in self._root.query(leaf.xmin, leaf.xmax,
+                                      leaf.ymin, leaf.ymax):
+            if other is not leaf:
+                pairs.add(other)
+                other.pairs.add(leaf)
+
+    def _insert_leaf(self, leaf):
+        '''Insere uma folha na árvore utilizando a heurística de perímetro
+        para escolher o nó irmão'''
+
+        if self._root is None:
+            self._root = leaf
+            leaf.parent = None
+            return
+
+        # Desce na árvore escolhendo o ramo que produz o menor custo
+        node = self._root
+        while node.left is not None:
+            left, right = node.left, node.right
+            combined = node.union_perimeter(leaf)
+            cost = 2 * combined
+            inheritance = 2 * (combined - node.perimeter())
+
+            cost_left = left.union_perimeter(leaf) + inheritance
+            if left.left is not None:
+                cost_left -= left.perimeter()
+            cost_right = right.union_perimeter(leaf) + inheritance
+            if right.left is not None:
+                cost_right -= right.perimeter()
+
+            if cost < cost_left and cost < cost_right:
+                break
+            node = left if cost_left < cost_right else right
+
+        # Cria um novo nó interno com a folha e o irmão como filhos
+        sibling = node
+        old_parent = sibling.parent
+        parent = _BVHNode()
+        parent.parent = old_parent
+        parent.set_union(leaf, sibling)
+        parent.height = sibling.height + 1
+        parent.left = sibling
+        parent.right = leaf
+        sibling.parent = leaf.parent = parent
+
+        if old_parent is None:
+            self._root = parent
+        elif old_parent.left is sibling:
+            old_parent.left = parent
+        else:
+            old_parent.right = parent
+
+        self._refit(parent.parent)
+
+    def _remove_leaf(self, leaf):
+        '''Remove uma folha da árvore'''
+
+        if leaf is self._root:
+            self._root = None
+            return
+
+        parent = leaf.parent
+        grandparent = parent.parent
+        sibling = parent.left if parent.right is leaf else parent.right
+        leaf.parent = None
+
+        if grandparent is None:
+            self._root = sibling
+            sibling.parent = None
+        else:
+            if grandparent.left is parent:
+                grandparent.left = sibling
+            else:
+                grandparent.right = sibling
+            sibling.parent = grandparent
+            self._refit(grandparent)
+
+    def _refit(self, node):
+        '''Atualiza caixas e alturas de node até a raiz, balanceando a árvore
+        no caminho'''
+
+        while node is not None:
+            node = self._balance(node)
+            left, right = node.left, node.right
+            node.height = 1 + max(left.height, right.height)
+            node.set_union(left, right)
+            node = node.parent
+
+    def _replace_child(self, old, new):
+        '''Substitui old por new no nó pai de old (ou na raiz)'''
+
+        parent = new.parent = old.parent
+        if parent is None:
+            self._root = new
+        elif parent.left is old:
+            parent.left = new
+        else:
+            parent.right = new
+        old.parent = new
+
+    def _balance(self, A):
+        '''Executa uma rotação em A caso a árvore esteja desbalanceada e
+        retorna a nova raiz da sub-árvore'''
+
+        if A.left is None or A.height < 2:
+            return A
+
+        B, C = A.left, A.right
+        balance = C.height - B.height
+
+        # Promove C
+        if balance > 1:
+            F, G = C.left, C.right
+            self._replace_child(A, C)
+            C.left = A
+            if F.height > G.height:
+                C.right, A.right = F, G
+                G.parent = A
+            else:
+                C.right, A.right = G, F
+                F.parent = A
+            A.set_union(B, A.right)
+            A.height = 1 + max(B.height, A.right.height)
+            C.set_union(A, C.right)
+            C.height = 1 + max(A.height, C.right.height)
+            return C
+
+        # Promove B
+        if balance < -1:
+            D, E = B.left, B.right
+            self._replace_child(A, B)
+            B.left = A
+            if D.height > E.height:
+                B.right, A.left = D, E
+                E.parent = A
+            else:
+                B.right, A.left = E, D
+                D.parent = A
+            A.set_union(C, A.left)
+            A.height = 1 + max(C.height, A.left.height)
+            B.set_union(A, B.right)
+            B.height = 1 + max(A.height, B.right.height)
+            return B
+
+        return A
+
+
+class BroadPhaseSAP(BroadPhase):
+
+    '''Implementa a broad-phase pelo algoritmo "sort and sweep" persistente.
+
+    A lista de objetos e as respectivas caixas de contorno são mantidas
+    ordenadas entre frames e reordenadas por inserção. Como os objetos se
+    movem pouco de um frame para o outro, a ordenação custa praticamente O(N)
+    em vez dos O(N log N) de uma ordenação completa.
+
+    O eixo de varredura é escolhido automaticamente como aquele com a maior
+    variância das posições dos centros das caixas de contorno, a não ser que
+    seja fixado pelo parâmetro axis.
+
+    Além da lista de pares, a broad-phase registra as diferenças com relação
+    ao frame anterior nos atributos ``added`` e ``removed``. Os objetos de
+    contato são reaproveitados enquanto o par persistir.
+
+    Parameters
+    ----------
+
+    axis : 'x', 'y' ou None
+        Fixa o eixo de varredura. O padrão (None) escolhe o eixo
+        automaticamente em cada frame.
+
+    Example
+    -------
+
+    >>> from FGAme.physics import Circle
+    >>> A, B, C = Circle(10, (0, 0)), Circle(10, (0, 15)), Circle(10, (0, 50))
+    >>> bf = BroadPhaseSAP()
+    >>> [(p.A, p.B) for p in bf([A, B, C])] == [(A, B)]
+    True
+    >>> bf.axis
+    'y'
+
+    Quando C se aproxima de B, o novo par é registrado em ``added``
+
+    >>> C.move(0, -25)
+    >>> [(p.A, p.B) for p in bf([A, B, C]).added] == [(B, C)]
+    True
+    >>> len(bf), len(bf.removed)
+    (2, 0)
+    '''
+
+    __slots__ = ['axis', 'auto_axis', 'added', 'removed',
+                 '_objects', '_boxes', '_pairs', '_sorted_axis']
+
+    # Fator pelo qual a variância do outro eixo deve superar a do eixo atual
+    # para que o eixo de varredura seja trocado
+    AXIS_HYSTERESIS = 1.25
+
+    def __init__(self, data=[], world=None, axis=None):
+        super(BroadPhaseSAP, self).__init__(data, world)
+        if axis not in (None, 'x', 'y'):
+            raise ValueError('invalid axis: %r' % axis)
+        self.auto_axis = axis is None
+        self.axis = axis or 'x'
+        self.added = []
+        self.removed = []
+        self._objects = []
+        self._boxes = []
+        self._pairs = {}
+        self._sorted_axis = None
+
+    def add_object(self, obj):
+        self._objects.append(obj)
+        self._boxes.append(None)
+
+    def remove_object(self, obj):
+        try:
+            idx = self._objects.index(obj)
+        except ValueError:
+            pass
+        else:
+            del self._objects[idx]
+            del self._boxes[idx]
+
+    def update(self, L):
+        # Sincroniza caso a lista de objetos tenha sido modificada sem passar
+        # por add_object()/remove_object()
+        if len(L) != len(self._objects):
+            self._objects = list(L)
+            self._boxes = [None] * len(L)
+        objects = self._objects
+        boxes = self._boxes
+        N = len(objects)
+
+        # Atualiza as caixas de contorno e acumula as estatísticas para a
+        # escolha do eixo de varredura
+        sx = sy = sxx = syy = 0.0
+        for k in range(N):
+            obj = objects[k]
+            boxes[k] = box = (obj.xmin, obj.xmax, obj.ymin, obj.ymax)
+            x = box[0] + box[1]
+            y = box[2] + box[3]
+            sx += x
+            sy += y
+            sxx += x * x
+            syy += y * y
+
+        if self.auto_axis and N:
+            var_x = sxx - sx * sx / N
+            var_y = syy - sy * sy / N
+            if self.axis == 'x' and var_y > self.AXIS_HYSTERESIS * var_x:
+                self.axis = 'y'
+            elif self.axis == 'y' and var_x > self.AXIS_HYSTERESIS * var_y:
+                self.axis = 'x'
+
+        # Reordena as listas. Utiliza ordenação por inserção caso a lista já
+        # esteja ordenada no eixo correto desde o último frame.
+        a, b = (0, 2) if self.axis == 'x' else (2, 0)
+        if self._sorted_axis != self.axis:
+            order = sorted(range(N), key=lambda k: boxes[k][a])
+            objects[:] = [objects[k] for k in order]
+            boxes[:] = [boxes[k] for k in order]
+            self._sorted_axis = self.axis
+        else:
+            for i in range(1, N):
+                box = boxes[i]
+                key = box[a]
+                j = i - 1
+                if boxes[j][a] <= key:
+                    continue
+
+                obj = objects[i]
+                while j >= 0 and boxes[j][a] > key:
+                    boxes[j + 1] = boxes[j]
+                    objects[j + 1] = objects[j]
+                    j -= 1
+                boxes[j + 1] = box
+                objects[j + 1] = obj
+
+        # Varre a lista ordenada e reaproveita os contatos do frame anterior
+        old_pairs = self._pairs
+        pairs = self._pairs = {}
+        added = self.added = []
+        self._data[:] = []
+        data = self._data
+
+        for i in range(N):
+            A = objects[i]
+            box = boxes[i]
+            A_max = box[a + 1]
+            A_min_b, A_max_b = box[b], box[b + 1]
+            A_filter = A._col_filter
+
+            for j in range(i + 1, N):
+                other = boxes[j]
+
+                # Procura na lista enquanto o mínimo de B for menor que o
+                # máximo de A
+                if other[a] > A_max:
+                    break
+
+                # Testa a sobreposição no outro eixo
+                if other[b] > A_max_b or A_min_b > other[b + 1]:
+                    continue
+
+                # Filtros de layer, grupo e objetos estáticos/dormindo
+                B = objects[j]
+                if A_filter & B._col_mask:
+                    continue
+
+                # Adiciona à lista de colisões grosseiras
+                key = (id(A), id(B)) if id(A) < id(B) else (id(B), id(A))
+                contact = old_pairs.get(key)
+                if contact is None:
+                    contact = AABBContact(A, B)
+                    added.append(contact)
+                pairs[key] = contact
+                data.append(contact)
+
+        self.removed = [contact for (key, contact) in old_pairs.items()
+                        if key not in pairs]
+
+
+class _StaticIndex(object):
+
+    '''Árvore de volumes envolventes construída de cima para baixo para
+    indexar objetos estáticos.
+
+    Ao contrário de BroadPhaseBVH, a árvore não é atualizada incrementalmente:
+    ela é reconstruída por completo com build() sempre que o conjunto de
+    objetos estáticos muda.'''
+
+    __slots__ = ['_root', 'num_builds']
+
+    def __init__(self):
+        self._root = None
+        self.num_builds = 0
+
+    def build(self, objects):
+        '''Reconstrói a árvore a partir da lista de objetos'''
+
+        leaves = []
+        for obj in objects:
+            leaf = _BVHNode(obj)
+            aabb = obj.aabb
+            leaf.xmin, leaf.xmax = aabb.xmin, aabb.xmax
+            leaf.ymin, leaf.ymax = aabb.ymin, aabb.ymax
+            leaves.append(leaf)
+        self._root = self._build(leaves) if leaves else None
+        self.num_builds += 1
+
+    def _build(self, leaves):
+        '''Cria a sub-árvore com as folhas dadas dividindo-as pela mediana no
+        eixo de maior extensão'''
+
+        if len(leaves) == 1:
+            return leaves[0]
+
+        node = _BVHNode()
+        node.xmin = min(leaf.xmin for leaf in leaves)
+        node.xmax = max(leaf.xmax for leaf in leaves)
+        node.ymin = min(leaf.ymin for leaf in leaves)
+        node.ymax = max(leaf.ymax for leaf in leaves)
+
+        if node.xmax - node.xmin > node.ymax - node.ymin:
+            leaves.sort(key=lambda leaf: leaf.xmin + leaf.xmax)
+        else:
+            leaves.sort(key=lambda leaf: leaf.ymin + leaf.ymax)
+
+        mid = len(leaves) // 2
+        node.left = self._build(leaves[:mid])
+        node.right = self._build(leaves[mid:])
+        node.left.parent = node.right.parent = node
+        node.height = 1 + max(node.left.height, node.right.height)
+        return node
+
+    def query(self, xmin, xmax, ymin, ymax):
+        '''Itera sobre os objetos cujas caixas de contorno interceptam a caixa
+        dada'''
+
+        if self._root is not None:
+            for leaf in self._root.query(xmin, xmax, ymin, ymax):
+                yield leaf.obj
+
+
+class BroadPhaseStatic(BroadPhase):
+
+    '''Broad-phase que separa os objetos estáticos dos demais.
+
+    Os objetos estáticos (massa e inércia infinitas e velocidades nulas, como
+    as paredes criadas por World.add_bounds) são mantidos em um índice
+    espacial próprio, que só é reconstruído quando um objeto estático é
+    adicionado, removido ou movido (flag dirty_broadphase). Os demais objetos
+    são repassados para a broad-phase fornecida em `dynamic` e em seguida
+    consultam o índice estático. Deste modo, os objetos estáticos nunca
+    entram na varredura executada em cada frame.
+
+    Parameters
+    ----------
+
+    dynamic : BroadPhase
+        Broad-phase (ou classe de broad-phase) utilizada para os objetos não
+        estáticos. O padrão é BroadPhaseSAP.
+
+    Example
+    -------
+
+    >>> from FGAme.physics import Circle, AABB
+    >>> floor = AABB(bbox=(-100, 100, -20, 0), mass='inf')
+    >>> A, B = Circle(10, (0, 5)), Circle(10, (15, 30))
+    >>> bf = BroadPhaseStatic()
+    >>> [(p.A, p.B) for p in bf([floor, A, B])] == [(A, floor)]
+    True
+    >>> bf.num_static, bf.num_builds
+    (1, 1)
+
+    Mover um objeto estático reconstrói o índice, mesmo que a caixa de
+    contorno tenha sido lida antes da broad-phase
+
+    >>> floor.move(0, 30)
+    >>> floor.aabb.ymax
+    30.0
+    >>> [(p.A, p.B) for p in bf([floor, A, B])] == [(A, floor), (B, floor)]
+    True
+    >>> bf.num_builds
+    2
+    '''
+
+    __slots__ = ['dynamic', '_static', '_nonstatic', '_index', '_dirty']
+
+    def __init__(self, data=[], world=None, dynamic=None):
+        super(BroadPhaseStatic, self).__init__(data, world)
+        if dynamic is None:
+            dynamic = BroadPhaseSAP
+        if isinstance(dynamic, type):
+            dynamic = dynamic()
+        self.dynamic = dynamic
+        self._static = []
+        self._nonstatic = []
+        self._index = _StaticIndex()
+        self._dirty = True
+
+    @property
+    def num_static(self):
+        '''Número de objetos no índice estático'''
+
+        return len(self._static)
+
+    @property
+    def num_builds(self):
+        '''Número de vezes que o índice estático foi construído'''
+
+        return self._index.num_builds
+
+    def add_object(self, obj):
+        if obj.is_static():
+            self._static.append(obj)
+            self._dirty = True
+        else:
+            self._nonstatic.append(obj)
+            self.dynamic.add_object(obj)
+
+    def remove_object(self, obj):
+        for idx, other in enumerate(self._static):
+            if other is obj:
+                del self._static[idx]
+                self._dirty = True
+                return
+
+        for idx, other in enumerate(self._nonstatic):
+            if other is obj:
+                del self._nonstatic[idx]
+                self.dynamic.remove_object(obj)
+                return
+
+    def update(self, L):
+        DIRTY = BodyFlags.dirty_broadphase
+        NOT_DIRTY = BodyFlags.not_dirty_broadphase
+        INACTIVE = CollisionFilter.inactive
+        self.dynamic.world = self.world
+
+        # Sincroniza caso a lista de objetos tenha sido modificada sem passar
+        # por add_object()/remove_object()
+        if len(L) != len(self._static) + len(self._nonstatic):
+            self._static = []
+            self._nonstatic = []
+            for obj in L:
+                self.add_object(obj)
+            self._dirty = True
+
+        # Objetos estáticos que foram movidos ou deixaram de ser estáticos
+        # sujam o índice. Objetos que se tornaram estáticos são transferidos
+        # para o índice.
+        static = self._static
+        nonstatic = self._nonstatic
+        for obj in static:
+            if obj.flags & DIRTY or obj._invmass or obj._invinertia:
+                self._dirty = True
+                break
+        for obj in nonstatic:
+            if not (obj._invmass or obj._invinertia) and obj.is_static():
+                self._dirty = True
+                break
+
+        if self._dirty:
+            self._static = static = []
+            self._nonstatic = nonstatic = []
+            for obj in L:
+                (static if obj.is_static() else nonstatic).append(obj)
+            self._index.build(static)
+            for obj in static:
+                obj.flags &= NOT_DIRTY
+            self._dirty = False
+
+        # Pares entre objetos não-estáticos
+        self.dynamic.update(nonstatic)
+        self._data[:] = self.dynamic._data
+        data = self._data
+
+        # Pares com os objetos estáticos
+        query = self._index.query
+        for A in nonstatic:
+            A_filter = A._col_filter
+            if A_filter & INACTIVE:
+                continue
+
+            for B in query(A.xmin, A.xmax, A.ymin, A.ymax):
+                if A_filter & B._col_mask:
+                    continue
+                data.append(AABBContact(A, B))
+
+
+class BroadPhaseNumpy(BroadPhaseAABB):
+
+    '''Implementa a broad-phase de AABBs utilizando operações vetorizadas do
+    NumPy.
+
+    As caixas de contorno de todos os objetos são empacotadas em arrays
+    contíguos e os pares são encontrados por uma varredura vetorizada no eixo
+    x. As palavras de filtro de colisão (as mesmas regras de
+    Simulation.can_collide) são aplicadas como uma máscara sobre os arrays de
+    índices. Ideal para cenas com milhares de
+    objetos pequenos.
+
+    Os índices dos pares encontrados (com relação à lista de objetos passada
+    para update()) ficam disponíveis no atributo ``index_pairs`` como uma
+    tupla de dois arrays.
+
+    Caso o NumPy não esteja disponível, comporta-se exatamente como
+    BroadPhaseAABB e ``index_pairs`` é None.
+
+    Example
+    -------
+
+    >>> from FGAme.physics import Circle
+    >>> A, B, C = Circle(10, (0, 0)), Circle(10, (15, 0)), Circle(10, (50, 0))
+    >>> bf = BroadPhaseNumpy()
+    >>> [(p.A, p.B) for p in bf([A, B, C])] == [(A, B)]
+    True
+    >>> bf.index_pairs                                       # doctest: +SKIP
+    (array([0]), array([1]))
+    '''
+
+    __slots__ = ['index_pairs']
+
+    def __init__(self, data=[], world=None):
+        super(BroadPhaseNumpy, self).__init__(data, world)
+        self.index_pairs = ((), ())
+
+    def update(self, L):
+        if np is None:
+            super(BroadPhaseNumpy, self).update(L)
+            self.index_pairs = None
+            return
+
+        self.set_buffer(L, array('i'))
+        N = len(L)
+        if N < 2:
+            self.index_pairs = (np.zeros(0, int), np.zeros(0, int))
+            return
+
+        # Empacota as propriedades dos objetos em arrays
+        boxes = np.array([(obj.xmin, obj.xmax, obj.ymin, obj.ymax)
+                          for obj in L], dtype=float)
+        words = np.array([(obj._col_filter, obj._col_mask) for obj in L],
+                         dtype=np.uint64)
+        col_filter, col_mask = words.T
+
+        # Ordena no eixo x e encontra, para cada objeto, o intervalo de
+        # objetos seguintes cujo xmin é menor que seu xmax
+        order = np.argsort(boxes[:, 0], kind='mergesort')
+        xmin = boxes[order, 0]
+        xmax = boxes[order, 1]
+        ends = np.searchsorted(xmin, xmax, side='right')
+        counts = ends - np.arange(N) - 1
+        np.maximum(counts, 0, out=counts)
+        total = counts.sum()
+        if not total:
+            self.index_pairs = (np.zeros(0, int), np.zeros(0, int))
+            return
+
+        # Gera todos os pares candidatos (i, j) com i < j na ordem da varredura
+        I = np.repeat(np.arange(N), counts)
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts,
+                                               counts)
+        J = I + 1 + offsets
+        I = order[I]
+        J = order[J]
+
+        # Sobreposição no eixo y
+        mask = ((boxes[J, 2] <= boxes[I, 3]) & (boxes[I, 2] <= boxes[J, 3]))
+
+        # Filtros de layer, grupo e objetos estáticos/dormindo
+        mask &= (col_filter[I] & col_mask[J]) == 0
+
+        I = I[mask]
+        J = J[mask]
+        self.index_pairs = (I, J)
+
+        # Intercala os índices no buffer [i0, j0, i1, j1, ...]
+        pairs = np.empty(2 * len(I), dtype=np.intc)
+        pairs[0::2] = I
+        pairs[1::2] = J
+        buffer = array('i')
+        buffer.frombytes(pairs.tobytes())
+        self.set_buffer(L, buffer)
+
+
+class _StrategyStats(object):
+
+    '''Estatísticas de desempenho de uma estratégia de AdaptiveBroadPhase.
+
+    Os tempos são médias móveis exponenciais por frame e o custo inclui tanto
+    o tempo da broad-phase quanto o tempo da narrow-phase executada sobre os
+    pares candidatos.'''
+
+    __slots__ = ['frames', 'cost', 'broad_time', 'narrow_time', 'candidates',
+                 'hits']
+
+    def __init__(self):
+        self.frames = 0
+        self.cost = None
+        self.broad_time = self.narrow_time = 0.0
+        self.candidates = self.hits = 0.0
+
+    def add(self, broad_time, narrow_time, candidates, hits, smoothing):
+        if self.frames:
+            a, b = smoothing, 1 - smoothing
+            self.broad_time = a * broad_time + b * self.broad_time
+            self.narrow_time = a * narrow_time + b * self.narrow_time
+            self.candidates = a * candidates + b * self.candidates
+            self.hits = a * hits + b * self.hits
+        else:
+            self.broad_time = broad_time
+            self.narrow_time = narrow_time
+            self.candidates = candidates
+            self.hits = hits
+        self.cost = self.broad_time + self.narrow_time
+        self.frames += 1
+
+    @property
+    def hit_rate(self):
+        '''Fração dos pares candidatos confirmados pela narrow-phase'''
+
+        if self.candidates:
+            return self.hits / self.candidates
+        return 1.0
+
+    def as_dict(self):
+        return dict(frames=self.frames, cost=self.cost,
+                    broad_time=self.broad_time, narrow_time=self.narrow_time,
+                    candidates=self.candidates, hits=self.hits,
+                    hit_rate=self.hit_rate)
+
+
+class AdaptiveBroadPhase(BroadPhase):
+
+    '''Broad-phase que escolhe automaticamente a estratégia mais rápida.
+
+    Cada estratégia candidata é executada por alguns frames da própria
+    simulação (``trial_frames``, descartando o primeiro frame de cada
+    tentativa para aquecer estruturas persistentes). O custo de cada frame é o
+    tempo da broad-phase somado ao tempo da narrow-phase sobre os pares
+    candidatos, de modo que estratégias mais grosseiras pagam pelos falsos
+    positivos. A NarrowPhase informa este tempo e o número de colisões
+    confirmadas através do método narrow_feedback().
+
+    Depois da rodada de testes, a estratégia mais barata é utilizada por
+    ``period`` frames, quando as demais são testadas novamente. A troca só
+    acontece se a nova estratégia custar menos que ``hysteresis`` vezes o
+    custo da estratégia atual. Uma nova rodada também é iniciada caso o número
+    de objetos dobre ou caia pela metade.
+
+    Parameters
+    ----------
+
+    candidates : sequence
+        Lista de classes ou instâncias de BroadPhase. O padrão é
+        (BroadPhaseAABB, BroadPhaseCBB, BroadPhaseMixed).
+    trial_frames : int
+        Número de frames medidos por estratégia em cada rodada de testes.
+    period : int
+        Número de frames entre rodadas de testes.
+    hysteresis : float
+        Fração do custo atual que a melhor candidata deve atingir para que a
+        troca aconteça.
+    smoothing : float
+        Peso de cada nova medida nas médias móveis.
+
+    Example
+    -------
+
+    >>> from FGAme.physics import Circle
+    >>> objs = [Circle(10, (15 * i, 0)) for i in range(10)]
+    >>> bf = AdaptiveBroadPhase(trial_frames=2, period=10)
+    >>> for _ in range(20):
+    ...     pairs = bf(objs)
+    >>> len(pairs)
+    9
+    >>> bf.choice in ['BroadPhaseAABB', 'BroadPhaseCBB', 'BroadPhaseMixed']
+    True
+    >>> sorted(bf.stats())
+    ['BroadPhaseAABB', 'BroadPhaseCBB', 'BroadPhaseMixed']
+
+    Uma vez escolhida, a estratégia pode ser fixada com o método lock().
+    Neste caso, AdaptiveBroadPhase apenas repassa as chamadas para ela.
+
+    >>> bf.lock('BroadPhaseAABB')
+    >>> bf.choice, bf.is_locked
+    ('BroadPhaseAABB', True)
+    '''
+
+    __slots__ = ['strategies', 'current', 'trial_frames', 'period',
+                 'hysteresis', 'smoothing', 'num_switches', 'is_locked',
+                 '_stats', '_queue', '_active', '_trial', '_frame',
+                 '_exploring', '_num_objects', '_pending']
+
+    DEFAULT_CANDIDATES = ('BroadPhaseAABB', 'BroadPhaseCBB', 'BroadPhaseMixed')
+
+    def __init__(self, data=[], world=None, candidates=None, trial_frames=4,
+                 period=240, hysteresis=0.8, smoothing=0.2):
+        super(AdaptiveBroadPhase, self).__init__(data, world)
+        if candidates is None:
+            candidates = [globals()[name] for name in self.DEFAULT_CANDIDATES]
+
+        strategies = []
+        for bf in candidates:
+            if isinstance(bf, type):
+                bf = bf(world=world)
+            strategies.append(bf)
+        names = [type(bf).__name__ for bf in strategies]
+        if not strategies:
+            raise ValueError('at least one candidate is required')
+        if len(set(names)) != len(names):
+            raise ValueError('candidates must have different types')
+
+        self.strategies = strategies
+        self.trial_frames = int(trial_frames)
+        self.period = int(period)
+        self.hysteresis = float(hysteresis)
+        self.smoothing = float(smoothing)
+        self.num_switches = 0
+        self.is_locked = False
+        self._stats = [_StrategyStats() for _ in strategies]
+        self._active = 0
+        self.current = strategies[0]
+        self._pending = None
+        self._frame = self._num_objects = 0
+        self._queue = []
+        self._exploring = False
+        self.explore()
+
+    @property
+    def choice(self):
+        '''Nome da classe da estratégia atualmente escolhida'''
+
+        return type(self.current).__name__
+
+    def stats(self):
+        '''Retorna um dicionário que mapeia o nome de cada estratégia às suas
+        estatísticas: número de frames medidos, custo médio por frame (em
+        segundos), tempos médios da broad-phase e da narrow-phase, número
+        médio de pares candidatos e de colisões confirmadas e a taxa de acerto
+        da narrow-phase.'''
+
+        return dict((type(bf).__name__, st.as_dict())
+                    for (bf, st) in zip(self.strategies, self._stats))
+
+    def explore(self):
+        '''Inicia uma nova rodada de testes com as estratégias candidatas'''
+
+        current = self.strategies.index(self.current)
+        queue = [idx for idx, st in enumerate(self._stats)
+                 if idx != current or not st.frames]
+        queue.reverse()
+        self._queue = queue
+        self._trial = 0
+        self._exploring = True
+
+    def lock(self, strategy=None):
+        '''Fixa a estratégia atual ou a estratégia fornecida (nome, classe ou
+        instância de uma das candidatas) e desliga as medições'''
+
+        if strategy is not None:
+            for idx, bf in enumerate(self.strategies):
+                if (bf is strategy or type(bf) is strategy or
+                        type(bf).__name__ == strategy):
+                    break
+            else:
+                raise ValueError('not a candidate: %r' % strategy)
+            self._switch(idx)
+        self._active = self.strategies.index(self.current)
+        self._pending = None
+        self.is_locked = True
+
+    def unlock(self):
+        '''Volta a medir as estratégias e inicia uma nova rodada de testes'''
+
+        self.is_locked = False
+        self.explore()
+
+    def add_object(self, obj):
+        for bf in self.strategies:
+            bf.add_object(obj)
+
+    def remove_object(self, obj):
+        for bf in self.strategies:
+            bf.remove_object(obj)
+
+    def narrow_feedback(self, hits, narrow_time):
+        '''Chamado pela NarrowPhase com o número de colisões confirmadas e o
+        tempo gasto para testar os pares do último frame'''
+
+        pending = self._pending
+        if pending is not None:
+            idx, broad_time, candidates = pending
+            self._stats[idx].add(broad_time, narrow_time, candidates, hits,
+                                 self.smoothing)
+            self._pending = None
+
+    def update(self, L):
+        if self.is_locked:
+            self._run(self.current, L)
+            return
+
+        # Frame anterior não recebeu informações da narrow-phase
+        if self._pending is not None:
+            self.narrow_feedback(0, 0.0)
+
+        record = self._schedule(len(L))
+        bf = self.strategies[self._active]
+        t0 = clock()
+        self._run(bf, L)
+        broad_time = clock() - t0
+
+        if record:
+            if self.buffer is not None:
+                candidates = len(self.buffer) // 2
+            else:
+                candidates = len(self._pair_list)
+            self._pending = (self._active, broad_time, candidates)
+
+    def _run(self, bf, L):
+        bf.world = self.world
+        bf.update(L)
+        if bf.buffer is not None:
+            self.set_buffer(bf.table, bf.buffer)
+        else:
+            self._data = list(bf._data)
+
+    def _schedule(self, num_objects):
+        # Escolhe a estratégia executada neste frame e retorna True caso o
+        # frame deva ser medido
+        if not self._trial:
+            if self._queue:
+                self._active = self._queue.pop()
+                self._trial = self.trial_frames + 1
+            else:
+                if self._exploring:
+                    self._decide()
+                    self._exploring = False
+                    self._frame = 0
+                    self._num_objects = num_objects
+
+                self._frame += 1
+                n0 = self._num_objects
+                if (self._frame > self.period or num_objects > 2 * n0 or
+                        2 * num_objects < n0):
+                    self.explore()
+                    return self._schedule(num_objects)
+                self._active = self.strategies.index(self.current)
+                return True
+
+        self._trial -= 1
+        return self._trial < self.trial_frames
+
+    def _decide(self):
+        # Escolhe a estratégia mais barata respeitando a histerese
+        measured = [(st.cost, idx) for idx, st in enumerate(self._stats)
+                    if st.frames]
+        if not measured:
+            return
+        best_cost, best = min(measured)
+        current = self.strategies.index(self.current)
+        current_cost = self._stats[current].cost
+        if current_cost is None or best_cost < self.hysteresis * current_cost:
+            self._switch(best)
+
+    def _switch(self, idx):
+        bf = self.strategies[idx]
+        if bf is not self.current:
+            self.current = bf
+            self.num_switches += 1
+
+
 ###############################################################################
 #                               Narrow phase
 ###############################################################################
 class NarrowPhase(AbstractCollisionPhase):
 
-    '''Implementa a fase fina da detecção de colisão'''
+    '''Implementa a fase fina da detecção de colisão.
 
-    __slots__ = []
+    Por padrão, as colisões de cada frame são registradas em um ContactCache
+    (atributo ``cache``) para que os impulsos acumulados de pares que
+    continuam em contato sejam reaproveitados no frame seguinte. Passe
+    cache=None para desabilitar este comportamento.
+
+    Quando o NumPy está disponível e a broad-phase fornece um buffer de
+    índices com pelo menos BATCH_MIN_PAIRS pares, os pares círculo/círculo e
+    círculo/AABB são testados de uma só vez pelo kernel vetorizado de
+    FGAme.physics.collision_batch. Passe batch=False para desabilitar este
+    comportamento.
+
+    Example
+    -------
+
+    A broad-phase padrão da simulação (BroadPhaseCBB) fornece o buffer de
+    índices e, portanto, os contatos entre círculos utilizam o kernel
+
+    >>> from FGAme.physics import Simulation, Circle
+    >>> sim = Simulation()
+    >>> for i in range(40):
+    ...     sim.add(Circle(1, (1.9 * i, 0)))
+    >>> sim.update(0.01)
+    >>> len(sim.narrow_phase), {type(col).__name__ for col in sim.narrow_phase}
+    (39, {'BatchCollision'})
+    '''
+
+    __slots__ = ['cache', 'batch']
+
+    def __init__(self, data=[], world=None, cache=True, batch=True):
+        super(NarrowPhase, self).__init__(data, world)
+        if cache is True:
+            cache = ContactCache()
+        self.cache = cache
+        self.batch = batch and np is not None
 
     def update(self, broad_cols):
         '''Escaneia a lista de colisões grosseiras e detecta quais delas
@@ -260,51 +1684,71 @@ class NarrowPhase(AbstractCollisionPhase):
         # Detecta colisões e atualiza as listas internas de colisões de
         # cada objeto
         self._data = cols = []
+        cache = self.cache
+        if cache is not None:
+            cache.begin()
+        feedback = getattr(broad_cols, 'narrow_feedback', None)
+        if feedback is not None:
+            t0 = clock()
+
+        # Consome diretamente o buffer de índices, caso disponível
+        buffer = getattr(broad_cols, 'buffer', None)
+        if buffer is not None:
+            objects = broad_cols.table
+            table = objects.__getitem__
+            if self.batch and len(buffer) >= 2 * BATCH_MIN_PAIRS:
+                # Círculos e AABBs são testados pelo kernel vetorizado
+                idx = np.frombuffer(buffer, dtype=np.intc)
+                batch, I, J = batch_collisions(objects, idx[0::2], idx[1::2])
+                for col in batch:
+                    self._register(col, cols, cache)
+                pairs = zip(map(table, I.tolist()), map(table, J.tolist()))
+            else:
+                pairs = zip(map(table, buffer[::2]), map(table, buffer[1::2]))
+        else:
+            pairs = broad_cols
 
-        for A, B in broad_cols:
+        # Tabela de despacho indexada pelos identificadores de forma
+        dispatch = COLLISION_TABLE
+        for A, B in pairs:
             if A._invmass > B._invmass:
                 A, B = B, A
-            col = self.get_collision(A, B)
+            col = dispatch[(A._shape_id << SHAPE_ID_BITS) | B._shape_id](A, B)
 
             if col is not None:
-                A.add_contact(col)
-                B.add_contact(col)
-                col.world = self.world
-                cols.append(col)
+                self._register(col, cols, cache)
 
-    def get_collision(self, A, B):
-        '''Retorna a colisão entre os objetos A e B depois que a colisão AABB
-        foi detectada'''
+        # Informa o custo da narrow-phase para broad-phases adaptativas
+        if feedback is not None:
+            feedback(len(cols), clock() - t0)
 
-        try:
-            return get_collision(A, B)
-        except CollisionError:
-            pass
+    def remove_object(self, obj):
+        '''Notifica a narrow-phase que um objeto foi removido da simulação.
 
-        # Colisão não definida. Primeiro tenta a colisão simétrica e registra
-        # o resultado caso bem sucedido. Caso a colisão simétrica também não
-        # seja implementada, define a colisão como uma aabb
-        try:
-            col = get_collision(B, A)
-            if col is None:
-                return
-            col.normal *= -1
-        except CollisionError:
-            get_collision[type(A), type(B)] = get_collision_generic
-            get_collision[type(B), type(A)] = get_collision_generic
-            return get_collision_generic(A, B)
-        else:
-            direct = get_collision.get_implementation(type(B), type(A))
+        Descarta as informações guardadas entre frames para os pares que
+        contêm o objeto.'''
+
+        forget_separating_axes(obj)
+        forget_simplices(obj)
+
+    def _register(self, col, cols, cache):
+        # Registra uma colisão detectada nos objetos, na lista e no cache
+        col.A.add_contact(col)
+        col.B.add_contact(col)
+        col.world = self.world
+        cols.append(col)
+        if cache is not None:
+            cache.restore(col)
+
+    def get_collision(self, A, B):
+        '''Retorna a colisão entre os objetos A e B depois que a colisão AABB
+        foi detectada.
 
-            def inverse(A, B):
-                '''Automatically created collision for A, B from the supported
-                collision B, A'''
-                col = direct(B, A)
-                if col is not None:
-                    return col.swapped()
+        A função de colisão é obtida da tabela de despacho COLLISION_TABLE
+        pelos identificadores de forma dos dois objetos.'''
 
-            get_collision[type(A), type(B)] = inverse
-            return col
+        idx = (A._shape_id << SHAPE_ID_BITS) | B._shape_id
+        return COLLISION_TABLE[idx](A, B)
 
     def get_groups(self, cols=None):
         '''Retorna uma lista com todos os grupos de colisões fechados'''
@@ -1,7 +1,8 @@
 # -*- coding: utf8 -*-
 
-from FGAme.mathutils import pi, sqrt, nullvec2, Circle as _Circle
+from FGAme.mathutils import pi, sqrt, nullvec2, Vec2, Circle as _Circle
 from FGAme.physics import Body
+from FGAme.physics.flags import BodyFlags as flags
 
 __all__ = ['Circle']
 
@@ -25,6 +26,7 @@ class Circle(Body):
     '''
 
     __slots__ = []
+    _shape_id = 1
 
     def __init__(self, radius, pos=(0, 0), vel=(0, 0),
                  mass=None, density=None, **kwds):
@@ -41,6 +43,17 @@ class Circle(Body):
     @radius.setter
     def radius(self, value):
         self.cbb_radius = value
+        self.flags |= flags.dirty_bbox
+
+    def support(self, direction):
+        '''Retorna o ponto do círculo mais distante na direção fornecida
+        (ponto de suporte).
+
+        >>> Circle(2, (1, 1)).support((0, 1))
+        Vec2(1, 3)
+        '''
+
+        return self._pos + self.cbb_radius * Vec2(*direction).normalize()
 
     def rescale(self, scale, update_physics=False):
         self.cbb_radius *= scale
@@ -4,6 +4,11 @@ from FGAme.physics.flags import BodyFlags
 from FGAme.util import lazy
 from math import exp
 
+# Maior número de condição aceito para a matriz de massa efetiva de um
+# manifold com dois pontos. Acima deste valor os pontos são praticamente
+# redundantes e são resolvidos sequencialmente
+MAX_BLOCK_CONDITION = 1000.0
+
 
 ###############################################################################
 #                 Pontos de Contato/Manifolds
@@ -17,7 +22,7 @@ class ContactPoint(Vec2):
     __slots__ = ['depth']
 
     def __init__(self, x, y, depth):
-        super(Vec2, self).__init__(x, y)
+        super(ContactPoint, self).__init__(x, y)
         self.depth = depth
 
 
@@ -37,7 +42,7 @@ class ContactManifold(BaseContactManifold):
     __slots__ = ['normal', 'points']
 
     def __init__(self, normal, points):
-        self.normal = normal.normalized()
+        self.normal = Vec2(normal).normalize()
         self.points = list(points)
 
 
@@ -248,6 +253,7 @@ class Collision(Pair):
     -1.0
     '''
     min_vel_bias = 1.0
+    check_normal = True
 
     def __init__(self, A, B, world=None, pos=None, normal=None, delta=0.0):
         super(Collision, self).__init__(A, B)
@@ -262,11 +268,12 @@ class Collision(Pair):
         self.normal = Vec2(normal)
         self.delta = delta
         self.Jn = 0.0
+        self.Jt = 0.0
         self.vel_bias = 0.0
         self.init()
 
         # Certifica se normal foi bem escolhida
-        if (self.rA.dot(self.normal) < 0):
+        if self.check_normal and self.rA.dot(self.normal) < 0:
             self.__init__(self.A, self.B, world=world, pos=pos, normal=-normal,
                           delta=delta)
 
@@ -321,6 +328,7 @@ class Collision(Pair):
         deltaJ = -self.effmass * (vrel_normal - self.vel_bias)
         self.Jn += deltaJ
         self.apply_impulse(deltaJ)
+        return deltaJ
 
     def apply_impulse(self, J):
         # Aplica incremento no impulso
@@ -337,8 +345,15 @@ class Collision(Pair):
                     B.apply_aimpulse(-Jvec.cross(self.rB))
 
     def apply_tangent(self, J):
-        # Aplica incremento no impulso
+        # Impulso tangente acumulado (com sinal) na direção fixa (-n.y, n.x)
+        n = self.normal
+        t = Vec2(-n.y, n.x)
+
+        # Desfaz o impulso tangente herdado caso não haja impulso normal
         if J <= 0:
+            if self.Jt:
+                self._apply_vec(-self.Jt * t)
+                self.Jt = 0.0
             return
 
         A, B = self.A, self.B
@@ -360,7 +375,21 @@ class Collision(Pair):
         else:
             J = 0.0
 
-        Jvec = J * tangent
+        # Limita o impulso acumulado (incluindo o herdado do frame anterior)
+        # pelo cone de atrito
+        if tangent.dot(t) < 0:
+            J = -J
+        Jt = self.Jt + J
+        if Jt > Jtan_max:
+            Jt = Jtan_max
+        elif Jt < -Jtan_max:
+            Jt = -Jtan_max
+        J, self.Jt = Jt - self.Jt, Jt
+        self._apply_vec(J * t)
+
+    def _apply_vec(self, Jvec):
+        # Aplica um impulso vetorial em B e o impulso oposto em A
+        A, B = self.A, self.B
         if A._invmass:
             A.apply_impulse(-Jvec)
             if A._invinertia:
@@ -370,11 +399,46 @@ class Collision(Pair):
             if B._invinertia:
                 B.apply_aimpulse(-Jvec.cross(self.rB))
 
+    def warm_start(self):
+        '''Aplica os impulsos normal e tangente acumulados herdados de um
+        frame anterior (veja ContactCache). Deve ser chamado depois de
+        init().
+
+        Contatos que se aproximam rápido o suficiente para receber o viés de
+        restituição descartam os impulsos herdados: o ricochete já é
+        calculado a partir da velocidade de aproximação e somar o impulso do
+        frame anterior injetaria energia no sistema.'''
+
+        if self.vel_bias:
+            self.Jn = self.Jt = 0.0
+            return
+        if self.Jn:
+            self.apply_impulse(self.Jn)
+        if self.Jt:
+            n = self.normal
+            self._apply_vec(self.Jt * Vec2(-n.y, n.x))
+
+    def inherit(self, other, factor=1.0):
+        '''Copia os impulsos acumulados de uma colisão do mesmo par de
+        objetos em um frame anterior (veja ContactCache)'''
+
+        self.Jn = factor * other.Jn
+        self.Jt = factor * other.Jt
+
     def finalize(self):
         if self.Jn < 0:
             self.apply_impulse(-self.Jn)
+            self.Jn = 0.0
         self.apply_tangent(self.Jn)
 
+    def swapped(self):
+        '''Retorna uma colisão com o papel dos objetos A e B trocados (e a
+        normal invertida)'''
+
+        A, B = self.objects
+        return Collision(B, A, self.world, pos=self.pos, normal=-self.normal,
+                         delta=self.delta)
+
     def get_tangent(self):
         # Vetor unitário tangente à colisão
         n = self.normal
@@ -477,6 +541,196 @@ class Collision(Pair):
         return (self.A.dfriction * self.B.dfriction) ** 0.5
 
 
+class ManifoldCollision(Collision):
+
+    '''Colisão com vários pontos de contato que compartilham a mesma normal.
+
+    Recebe um ContactManifold e cria uma colisão para cada ponto (atributo
+    ``contacts``), com os seus próprios braços de alavanca, massa efetiva e
+    impulsos acumulados. Os impulsos de um manifold com dois pontos são
+    calculados simultaneamente (veja step()), o que impede que objetos
+    apoiados sobre uma aresta girem em torno de um único ponto de contato.
+
+    Os atributos pos, delta e Jn da colisão correspondem, respectivamente, ao
+    ponto médio, à maior penetração e à soma dos impulsos dos pontos.
+
+    Example
+    -------
+
+    >>> from FGAme.physics import AABB
+    >>> A = AABB(shape=(4, 2), pos=(0, 0), mass='inf')
+    >>> B = AABB(shape=(2, 2), pos=(0, 1.9), vel=(0, -1))
+    >>> manifold = ContactManifold(Vec2(0, 1), [ContactPoint(-1, 0.95, 0.1),
+    ...                                         ContactPoint(1, 0.95, 0.1)])
+    >>> col = ManifoldCollision(A, B, manifold)
+    >>> col.pos, len(col.contacts)
+    (Vec2(0, 0.95), 2)
+
+    Uma pilha de retângulos sobre o chão permanece em pé
+
+    >>> from FGAme.physics import Simulation, Rectangle
+    >>> sim = Simulation(gravity=500, restitution=0)
+    >>> sim.add(Rectangle(bbox=(-200, 200, -20, 0), mass='inf'))
+    >>> boxes = [Rectangle(bbox=(-10, 10, 20 * i, 20 * i + 20))
+    ...          for i in range(4)]
+    >>> for box in boxes:
+    ...     sim.add(box)
+    >>> for _ in range(240):
+    ...     sim.update(1 / 60.)
+    >>> [round(box.pos.y) for box in boxes]
+    [10, 30, 49, 69]
+    >>> max(abs(box.pos.x) + abs(box.theta) for box in boxes) < 1e-3
+    True
+    '''
+
+    check_normal = False
+
+    def __init__(self, A, B, manifold, world=None):
+        normal = manifold.normal
+        points = manifold.points
+        self.manifold = manifold
+        self.contacts = [
+            _ManifoldPoint(A, B, world, pos=pt, normal=normal, delta=pt.depth)
+            for pt in points]
+        N = len(points)
+        pos = Vec2(sum(pt.x for pt in points) / N,
+                   sum(pt.y for pt in points) / N)
+        delta = max(pt.depth for pt in points)
+        super(ManifoldCollision, self).__init__(A, B, world, pos=pos,
+                                                normal=normal, delta=delta)
+
+    def init(self):
+        super(ManifoldCollision, self).init()
+        for col in self.contacts:
+            col.init()
+        self._init_block()
+
+    def _init_block(self):
+        # Matriz de massa efetiva K dos dois pontos de contato. A inversa só é
+        # guardada se K for bem condicionada (pontos não muito próximos)
+        self._block = None
+        if len(self.contacts) != 2:
+            return
+        A, B = self.A, self.B
+        c1, c2 = self.contacts
+        n = self.normal
+        k11 = 1.0 / c1.effmass
+        k22 = 1.0 / c2.effmass
+        k12 = A._invmass + B._invmass
+        if A._invinertia:
+            k12 += c1.rA.cross(n) * c2.rA.cross(n) * A._invinertia
+        if B._invinertia:
+            k12 += c1.rB.cross(n) * c2.rB.cross(n) * B._invinertia
+        det = k11 * k22 - k12 * k12
+        if k11 * k11 < MAX_BLOCK_CONDITION * det:
+            self._block = (k11, k12, k22, det)
+
+    def step(self):
+        if self._block is not None:
+            return self._step_block()
+
+        # Retorna o incremento de maior módulo entre os pontos de contato
+        Jn = deltaJ = 0.0
+        for col in self.contacts:
+            delta = col.step()
+            if abs(delta) > abs(deltaJ):
+                deltaJ = delta
+            Jn += col.Jn
+        self.Jn = Jn
+        return deltaJ
+
+    def _step_block(self):
+        # Resolve os dois pontos simultaneamente como um problema de
+        # complementaridade linear 2x2: busca impulsos acumulados x1, x2 >= 0
+        # tais que as velocidades normais resultantes vn = K x + b sejam
+        # nulas nos pontos com impulso positivo e não-negativas nos demais.
+        k11, k12, k22, det = self._block
+        c1, c2 = self.contacts
+        A, B = self.A, self.B
+        n = self.normal
+        a1, a2 = c1.Jn, c2.Jn
+
+        # b = vn - viés - K a, onde a são os impulsos acumulados até então
+        vA, wA, vB, wB = A.vel, A.omega, B.vel, B.omega
+        c1.vrel = vrel1 = (vB + wB * c1.rB_ortho) - (vA + wA * c1.rA_ortho)
+        c2.vrel = vrel2 = (vB + wB * c2.rB_ortho) - (vA + wA * c2.rA_ortho)
+        b1 = vrel1.dot(n) - c1.vel_bias - (k11 * a1 + k12 * a2)
+        b2 = vrel2.dot(n) - c2.vel_bias - (k12 * a1 + k22 * a2)
+
+        # Testa os casos: ambos ativos, apenas o primeiro, apenas o segundo
+        # e nenhum ponto ativo
+        x1 = (k12 * b2 - k22 * b1) / det
+        x2 = (k12 * b1 - k11 * b2) / det
+        if x1 < 0 or x2 < 0:
+            x1, x2 = -b1 / k11, 0.0
+            if x1 < 0 or k12 * x1 + b2 < 0:
+                x1, x2 = 0.0, -b2 / k22
+                if x2 < 0 or k12 * x2 + b1 < 0:
+                    x1 = x2 = 0.0
+                    if b1 < 0 or b2 < 0:
+                        # Sem solução: mantém os impulsos atuais
+                        return 0.0
+
+        d1, d2 = x1 - a1, x2 - a2
+        c1.Jn, c2.Jn = x1, x2
+        c1.apply_impulse(d1)
+        c2.apply_impulse(d2)
+        self.Jn = x1 + x2
+        return d1 if abs(d1) > abs(d2) else d2
+
+    def warm_start(self):
+        for col in self.contacts:
+            col.warm_start()
+
+    def finalize(self):
+        Jn = Jt = 0.0
+        for col in self.contacts:
+            col.finalize()
+            Jn += col.Jn
+            Jt += col.Jt
+        self.Jn = Jn
+        self.Jt = Jt
+
+    def inherit(self, other, factor=1.0):
+        '''Copia os impulsos de cada ponto de contato do ponto mais próximo na
+        colisão anterior. Caso a colisão anterior tenha apenas um ponto, o seu
+        impulso é dividido igualmente entre os pontos.'''
+
+        contacts = self.contacts
+        old = getattr(other, 'contacts', None)
+        if not old:
+            factor /= len(contacts)
+            for col in contacts:
+                col.inherit(other, factor)
+        else:
+            for col in contacts:
+                pos = col.pos
+                nearest = min(old, key=lambda c: (c.pos - pos).norm_sqr())
+                col.inherit(nearest, factor)
+        self.Jn = sum(col.Jn for col in contacts)
+        self.Jt = sum(col.Jt for col in contacts)
+
+    def swapped(self):
+        A, B = self.objects
+        manifold = ContactManifold(-self.normal, self.manifold.points)
+        return ManifoldCollision(B, A, manifold, self.world)
+
+
+class _ManifoldPoint(Collision):
+
+    '''Ponto de contato de uma ManifoldCollision'''
+
+    check_normal = False
+
+    def finalize(self):
+        # O atrito dos pontos anteriores altera a velocidade relativa neste
+        # ponto: atualiza vrel antes de calcular o impulso tangente
+        A, B = self.A, self.B
+        self.vrel = ((B.vel + B.omega * self.rB_ortho)
+                     - (A.vel + A.omega * self.rA_ortho))
+        super(_ManifoldPoint, self).finalize()
+
+
 class ContactOrdered(Collision):
 
     '''Um objeto de contato em que o primeiro objeto é sempre mais pesado que
@@ -488,6 +742,96 @@ class ContactOrdered(Collision):
         super(ContactOrdered, self).__init__(A, B, world, pos, normal, **kwds)
 
 
+class ContactCache(object):
+
+    '''Guarda as colisões do último frame indexadas pelo par de objetos.
+
+    Enquanto um par de objetos permanece em contato, os impulsos acumulados
+    (normal e tangente) da colisão do frame anterior são copiados para a nova
+    colisão, que os aplica antes das iterações do solver (warm starting). As
+    entradas de pares que deixaram de colidir são descartadas a cada frame.
+
+    Os impulsos só são reaproveitados se os objetos aparecerem na mesma ordem
+    e o cosseno entre a normal antiga e a nova for maior que ``min_cos``. O
+    impulso herdado é multiplicado por ``factor``.
+
+    Example
+    -------
+
+    >>> from FGAme.physics import Circle
+    >>> A, B = Circle(1, (0, 0)), Circle(1, (1.5, 0))
+    >>> cache = ContactCache()
+    >>> cache.begin()
+    >>> col = Collision(A, B, pos=(0.75, 0), normal=(1, 0))
+    >>> cache.restore(col)
+    False
+    >>> col.Jn = 2.0
+
+    No frame seguinte, a nova colisão herda o impulso acumulado
+
+    >>> cache.begin()
+    >>> new = Collision(A, B, pos=(0.75, 0), normal=(1, 0))
+    >>> cache.restore(new), new.Jn
+    (True, 2.0)
+    '''
+
+    __slots__ = ['factor', 'min_cos', 'num_hits', '_contacts', '_old']
+
+    def __init__(self, factor=1.0, min_cos=0.9):
+        self.factor = float(factor)
+        self.min_cos = float(min_cos)
+        self.num_hits = 0
+        self._contacts = {}
+        self._old = {}
+
+    def __len__(self):
+        return len(self._contacts)
+
+    def __contains__(self, pair):
+        return self._key(*pair) in self._contacts
+
+    @staticmethod
+    def _key(A, B):
+        a, b = id(A), id(B)
+        return (a, b) if a < b else (b, a)
+
+    def get(self, A, B):
+        '''Retorna a colisão registrada para o par (A, B) ou None'''
+
+        return self._contacts.get(self._key(A, B))
+
+    def begin(self):
+        '''Inicia um novo frame. As colisões do frame anterior ficam
+        disponíveis para restore() e são descartadas no próximo begin()'''
+
+        self._old = self._contacts
+        self._contacts = {}
+        self.num_hits = 0
+
+    def restore(self, col):
+        '''Registra a colisão no frame atual e copia os impulsos acumulados da
+        colisão do mesmo par no frame anterior. Retorna True caso os impulsos
+        tenham sido reaproveitados.'''
+
+        A, B = col.A, col.B
+        key = self._key(A, B)
+        self._contacts[key] = col
+        old = self._old.get(key)
+        if (old is None or old.A is not A or
+                old.normal.dot(col.normal) < self.min_cos):
+            return False
+
+        col.inherit(old, self.factor)
+        self.num_hits += 1
+        return True
+
+    def clear(self):
+        '''Remove todas as entradas'''
+
+        self._contacts.clear()
+        self._old.clear()
+
+
 class CollisionGroup(object):
 
     def __init__(self, collisions):
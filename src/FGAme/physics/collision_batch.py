@@ -0,0 +1,238 @@
+# -*- coding: utf8 -*-
+'''
+Detecção vetorizada de colisões entre círculos e entre círculos e AABBs.
+
+Cenas com muitas partículas são dominadas por contatos círculo/círculo e
+círculo/AABB. Em vez de testar cada par com as funções de collision_pairs, as
+funções deste módulo recebem os arrays de índices produzidos pela
+broad-phase e calculam normais, penetrações e pontos de contato de todos os
+pares destes tipos em uma única passagem do NumPy. Objetos do tipo Collision
+só são criados para os pares que realmente se tocam.
+
+Os pares de outros tipos (e os casos degenerados, como círculos concêntricos
+ou com o centro dentro de uma AABB) são devolvidos para que sejam tratados
+pela tabela de despacho usual.
+
+Este módulo requer o NumPy.
+'''
+
+from FGAme.mathutils import Vec2, nullvec2
+from FGAme.physics.collision import Collision
+from FGAme.physics.circle import Circle
+from FGAme.physics.aabb import AABB
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+__all__ = ['batch_collisions', 'circle_circle_kernel', 'circle_aabb_kernel']
+
+# Número mínimo de pares candidatos para que a passagem vetorizada compense o
+# custo de empacotar os objetos em arrays
+BATCH_MIN_PAIRS = 32
+
+CIRCLE_ID = Circle._shape_id
+AABB_ID = AABB._shape_id
+
+
+class BatchCollision(Collision):
+
+    '''Colisão criada pelo kernel vetorizado.
+
+    A normal já aponta de A para B e não precisa ser verificada. As
+    propriedades derivadas (braços de alavanca, massa efetiva, etc) só são
+    calculadas quando o solver chama o método init().'''
+
+    check_normal = False
+
+    def __init__(self, A, B, world=None, pos=None, normal=None, delta=0.0):
+        self.A, self.B = self.objects = A, B
+        self.world = world
+        self.is_active = True
+        self.resolved = False
+        self.vrel = nullvec2
+        self.pos = Vec2(*pos)
+        self.normal = Vec2(*normal)
+        self.delta = delta
+        self.Jn = 0.0
+        self.Jt = 0.0
+        self.vel_bias = 0.0
+
+
+###############################################################################
+#                               Kernels
+###############################################################################
+def circle_circle_kernel(ax, ay, ar, bx, by, br):
+    '''Testa a colisão entre os círculos de centros (ax, ay), (bx, by) e raios
+    ar, br (todos arrays de mesmo tamanho).
+
+    Retorna uma tupla (hit, nx, ny, delta, px, py, degenerate), em que hit é
+    a máscara de pares que se tocam, (nx, ny) a normal de A para B, delta a
+    penetração e (px, py) o ponto de colisão. A máscara degenerate marca os
+    círculos concêntricos, cuja normal não está definida.
+
+    Example
+    -------
+
+    >>> x = np.array([0.0, 0.0]); r = np.array([1.0, 1.0])
+    >>> hit, nx, ny, delta, px, py, _ = circle_circle_kernel(
+    ...     x, x, r, np.array([1.5, 3.0]), x, r)
+    >>> hit.tolist(), delta[hit].tolist(), px[hit].tolist()
+    ([True, False], [0.5], [0.75])
+    '''
+
+    dx = bx - ax
+    dy = by - ay
+    dist = np.hypot(dx, dy)
+    margin = ar + br
+    degenerate = dist == 0
+    hit = (dist < margin) & ~degenerate
+
+    # Evita divisões por zero nos pares descartados
+    safe = np.where(hit, dist, 1.0)
+    nx = dx / safe
+    ny = dy / safe
+    delta = margin - dist
+    offset = ar - 0.5 * delta
+    px = ax + offset * nx
+    py = ay + offset * ny
+    return hit, nx, ny, delta, px, py, degenerate
+
+
+def circle_aabb_kernel(cx, cy, r, xmin, xmax, ymin, ymax):
+    '''Testa a colisão entre círculos de centro (cx, cy) e raio r e caixas
+    AABB (todos arrays de mesmo tamanho).
+
+    Retorna uma tupla (hit, nx, ny, delta, px, py, inside), em que a normal
+    (nx, ny) aponta da caixa para o círculo e (px, py) é o ponto médio entre
+    o ponto mais próximo da caixa e o ponto mais profundo do círculo. A
+    máscara inside marca os círculos com o centro dentro da caixa, que não
+    são tratados pelo kernel.
+
+    Example
+    -------
+
+    >>> one = np.array([1.0])
+    >>> hit, nx, ny, delta, px, py, inside = circle_aabb_kernel(
+    ...     3.5 * one, 0 * one, one, -one, 3 * one, -one, one)
+    >>> hit.tolist(), nx.tolist(), delta.tolist(), px.tolist()
+    ([True], [1.0], [0.5], [2.75])
+    '''
+
+    qx = np.clip(cx, xmin, xmax)
+    qy = np.clip(cy, ymin, ymax)
+    dx = cx - qx
+    dy = cy - qy
+    dist = np.hypot(dx, dy)
+    inside = dist == 0
+    hit = (dist < r) & ~inside
+
+    safe = np.where(hit, dist, 1.0)
+    nx = dx / safe
+    ny = dy / safe
+    delta = r - dist
+    px = qx + 0.5 * (dx - r * nx)
+    py = qy + 0.5 * (dy - r * ny)
+    return hit, nx, ny, delta, px, py, inside
+
+
+###############################################################################
+#                         Passagem vetorizada
+###############################################################################
+def batch_collisions(objects, I, J):
+    '''Calcula as colisões círculo/círculo e círculo/AABB entre os pares de
+    objects indicados pelos arrays de índices I e J.
+
+    Assim como na NarrowPhase, o objeto mais pesado de cada par é sempre o
+    primeiro objeto da colisão. Retorna uma tupla (cols, I_rest, J_rest) com a
+    lista de colisões encontradas e os índices dos pares que não foram
+    tratados pelo kernel.
+
+    Example
+    -------
+
+    >>> from FGAme.physics import Poly
+    >>> L = [Circle(1, (0, 0)), Circle(1, (1.5, 0)), AABB(shape=(2, 2),
+    ...      pos=(0, -2.5)), Poly([(0, 0), (1, 0), (0, 1)])]
+    >>> cols, I, J = batch_collisions(L, np.array([0, 0, 0]),
+    ...                               np.array([1, 2, 3]))
+    >>> [(L.index(c.A), L.index(c.B), c.normal) for c in cols]
+    [(0, 1, Vec2(1, 0))]
+    >>> I.tolist(), J.tolist()
+    ([0], [3])
+    '''
+
+    I = np.asarray(I, dtype=np.intp)
+    J = np.asarray(J, dtype=np.intp)
+    if not len(I):
+        return [], I, J
+
+    # Empacota apenas os objetos envolvidos nos pares
+    used = np.unique(np.concatenate([I, J]))
+    local = np.empty(int(used[-1]) + 1, dtype=np.intp)
+    local[used] = np.arange(len(used))
+    used_objs = [objects[i] for i in used.tolist()]
+    kind = np.fromiter((obj._shape_id for obj in used_objs), np.intp,
+                       len(used_objs))
+    invmass = np.fromiter((obj._invmass for obj in used_objs), float,
+                          len(used_objs))
+    I = local[I]
+    J = local[J]
+
+    # O objeto mais pesado vem primeiro
+    swap = invmass[I] > invmass[J]
+    I, J = np.where(swap, J, I), np.where(swap, I, J)
+
+    kI, kJ = kind[I], kind[J]
+    is_cc = (kI == CIRCLE_ID) & (kJ == CIRCLE_ID)
+    is_ca = (((kI == CIRCLE_ID) & (kJ == AABB_ID)) |
+             ((kI == AABB_ID) & (kJ == CIRCLE_ID)))
+    handled = is_cc | is_ca
+    if not handled.any():
+        return [], used[I], used[J]
+
+    # Propriedades geométricas dos objetos (caixas de contorno e raios)
+    geo = np.array([(obj._pos.x, obj._pos.y, obj.cbb_radius, obj.xmin,
+                     obj.xmax, obj.ymin, obj.ymax)
+                    if k == CIRCLE_ID or k == AABB_ID else (0.0,) * 7
+                    for obj, k in zip(used_objs, kind.tolist())], dtype=float)
+    x, y, radius, xmin, xmax, ymin, ymax = geo.T
+
+    cols = []
+    rest = ~handled
+
+    # Círculo com círculo
+    if is_cc.any():
+        A, B = I[is_cc], J[is_cc]
+        hit, nx, ny, delta, px, py, degenerate = circle_circle_kernel(
+            x[A], y[A], radius[A], x[B], y[B], radius[B])
+        rest[np.flatnonzero(is_cc)[degenerate]] = True
+        _make_collisions(cols, used_objs, A[hit], B[hit], nx[hit], ny[hit],
+                         delta[hit], px[hit], py[hit])
+
+    # Círculo com AABB: a normal calculada aponta da caixa para o círculo e
+    # deve ser invertida quando o círculo é o objeto A
+    if is_ca.any():
+        A, B = I[is_ca], J[is_ca]
+        circle_first = kind[A] == CIRCLE_ID
+        C = np.where(circle_first, A, B)
+        Q = np.where(circle_first, B, A)
+        hit, nx, ny, delta, px, py, inside = circle_aabb_kernel(
+            x[C], y[C], radius[C], xmin[Q], xmax[Q], ymin[Q], ymax[Q])
+        rest[np.flatnonzero(is_ca)[inside]] = True
+        sign = np.where(circle_first, -1.0, 1.0)
+        _make_collisions(cols, used_objs, A[hit], B[hit],
+                         (sign * nx)[hit], (sign * ny)[hit],
+                         delta[hit], px[hit], py[hit])
+
+    return cols, used[I[rest]], used[J[rest]]
+
+
+def _make_collisions(cols, objects, A, B, nx, ny, delta, px, py):
+    # Cria os objetos de colisão para os pares que se tocam
+    for a, b, nx, ny, delta, px, py in zip(A.tolist(), B.tolist(),
+                                           nx.tolist(), ny.tolist(),
+                                           delta.tolist(), px.tolist(),
+                                           py.tolist()):
+        cols.append(BatchCollision(objects[a], objects[b], pos=(px, py),
+                                   normal=(nx, ny), delta=delta))
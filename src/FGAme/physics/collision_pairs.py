@@ -3,14 +3,21 @@
 from FGAme.mathutils import Vec2, dot, area, center_of_mass, clip, pi
 from FGAme.mathutils import shadow_x, shadow_y
 
-from FGAme.physics.collision import Collision
-from FGAme.physics import Circle, AABB, Poly, Rectangle
+from FGAme.physics.collision import (Collision, ManifoldCollision,
+                                     ContactManifold, ContactPoint)
+from FGAme.physics import Body, Circle, AABB, Poly
+from FGAme.physics.gjk import collision_gjk
 from FGAme.util import multifunction
 
 u_x = Vec2(1, 0)
 DEFAULT_DIRECTIONS = [u_x.rotate(n * pi / 12) for n in
                       [0, 1, 2, 3, 4, 5, 7, 8, 9, 10, 11]]
 
+# Pares de polígonos com um número total de lados maior que este valor são
+# testados pelo GJK/EPA, cujo custo cresce com o custo das funções de suporte
+# e não com o produto do número de vértices
+GJK_MIN_SIDES = 12
+
 
 class CollisionError(Exception):
 
@@ -34,7 +41,24 @@ def get_collision_generic(A, B):
         return None
 
 
-@multifunction(None, None)
+class _CollisionFunction(multifunction):
+
+    '''Multifunction que também registra cada implementação para um par de
+    classes na tabela de despacho da narrow-phase (veja collision_pair)'''
+
+    def __setitem__(self, types, func):
+        super(_CollisionFunction, self).__setitem__(types, func)
+        if (isinstance(types, tuple) and len(types) == 2 and
+                all(isinstance(t, type) for t in types)):
+            _register_pair(types[0], types[1], func)
+
+    def __delitem__(self, types):
+        super(_CollisionFunction, self).__delitem__(types)
+        if _collision_pairs.pop(types, None) is not None:
+            _build_collision_table()
+
+
+@_CollisionFunction(None, None)
 def get_collision(A, B):
     '''Retorna um objeto de colisão caso ocorra uma colisão com o objeto
     other. Caso não haja colisão, retorna None.
@@ -42,18 +66,133 @@ def get_collision(A, B):
     Esta função é implementada por multidispatch. As classes derivadas de
     PhysicsObject devem registrar explicitamente a colisão entre todos os pares
     suportados (ex.: Circle com Circle, Circle com AABB, etc). Caso não tenha
-    nenhuma implementação registrada, então utiliza-se a lógica de AABB's.'''
+    nenhuma implementação registrada, então utiliza-se a lógica de AABB's.
+
+    As implementações registradas com @get_collision.dispatch(TypeA, TypeB)
+    também são utilizadas pela narrow-phase: o par é registrado na tabela de
+    despacho como em collision_pair() e as classes que ainda não possuem um
+    identificador de forma próprio recebem um (veja register_shape()).'''
 
     tA = type(A).__name__
     tB = type(B).__name__
     raise CollisionError('no collision defined for: (%s, %s)' % (tA, tB))
 
+
+###############################################################################
+#                    Tabela de despacho da narrow-phase
+###############################################################################
+#
+# Cada classe de objeto físico possui um identificador inteiro pequeno
+# (atributo de classe _shape_id) e a colisão entre A e B é obtida por um único
+# acesso a uma lista plana:
+#
+#     COLLISION_TABLE[(A._shape_id << SHAPE_ID_BITS) | B._shape_id](A, B)
+#
+# A tabela é recalculada sempre que uma nova forma ou um novo par é
+# registrado e já contém as entradas com a ordem dos argumentos trocada e os
+# pares sem implementação (que utilizam get_collision_generic). Subclasses
+# herdam o identificador da classe mãe, a menos que sejam registradas com
+# register_shape() ou apareçam em algum par registrado com collision_pair() ou
+# get_collision.dispatch().
+SHAPE_ID_BITS = 5
+MAX_SHAPES = 1 << SHAPE_ID_BITS
+SHAPE_TYPES = [Body, Circle, AABB, Poly]
+COLLISION_TABLE = [get_collision_generic] * (MAX_SHAPES * MAX_SHAPES)
+_collision_pairs = {}
+
+
+def register_shape(cls):
+    '''Atribui um identificador de forma próprio para a classe cls e retorna
+    este identificador. Não faz nada caso a classe já esteja registrada.'''
+
+    if cls in SHAPE_TYPES:
+        return cls._shape_id
+    if len(SHAPE_TYPES) == MAX_SHAPES:
+        raise ValueError('maximum number of shape types reached')
+    cls._shape_id = len(SHAPE_TYPES)
+    SHAPE_TYPES.append(cls)
+    _build_collision_table()
+    return cls._shape_id
+
+
+def collision_pair(typeA, typeB):
+    '''Decorador que registra a função de colisão entre objetos do tipo typeA
+    e typeB tanto em get_collision() quanto na tabela de despacho da
+    narrow-phase.
+
+    Equivale a @get_collision.dispatch(typeA, typeB). Subclasses registradas
+    recebem um identificador de forma próprio:
+
+    >>> class Ghost(Circle):
+    ...     pass
+    >>> @get_collision.dispatch(Ghost, Circle)
+    ... def ghost_circle(A, B):
+    ...     return None
+    >>> A, B = Ghost(1), Circle(1, (1, 0))
+    >>> COLLISION_TABLE[(A._shape_id << SHAPE_ID_BITS) | B._shape_id](A, B)
+    >>> del get_collision[Ghost, Circle]
+    >>> idx = (A._shape_id << SHAPE_ID_BITS) | B._shape_id
+    >>> COLLISION_TABLE[idx](A, B) is not None
+    True
+    '''
+
+    def decorator(func):
+        get_collision.dispatch(typeA, typeB)(func)
+        return func
+
+    return decorator
+
+
+def _register_pair(typeA, typeB, func):
+    # Registra o par na tabela de despacho, atribuindo identificadores de
+    # forma próprios às classes que ainda não os possuem
+    _collision_pairs[typeA, typeB] = func
+    for cls in (typeA, typeB):
+        if cls not in SHAPE_TYPES:
+            register_shape(cls)
+    _build_collision_table()
+
+
+def _find_collision(typeA, typeB):
+    # Procura a implementação mais específica seguindo a MRO dos dois tipos,
+    # primeiro na ordem direta e depois na ordem trocada
+    for tA in typeA.__mro__:
+        for tB in typeB.__mro__:
+            try:
+                return _collision_pairs[tA, tB]
+            except KeyError:
+                pass
+    for tB in typeB.__mro__:
+        for tA in typeA.__mro__:
+            try:
+                return _swapped_collision(_collision_pairs[tB, tA])
+            except KeyError:
+                pass
+    return get_collision_generic
+
+
+def _swapped_collision(func):
+    def swapped(A, B):
+        col = func(B, A)
+        if col is not None:
+            return col.swapped()
+    swapped.__name__ = func.__name__ + '_swapped'
+    return swapped
+
+
+def _build_collision_table():
+    for tA in SHAPE_TYPES:
+        row = tA._shape_id << SHAPE_ID_BITS
+        for tB in SHAPE_TYPES:
+            COLLISION_TABLE[row | tB._shape_id] = _find_collision(tA, tB)
+
+
 ###############################################################################
 #                      Colisões entre objetos do mesmo tipo
 ###############################################################################
 
 
-@get_collision.dispatch(AABB, AABB)
+@collision_pair(AABB, AABB)
 def collision_aabb(A, B):
     '''Retorna uma colisão com o objeto other considerando apenas a caixas
     de contorno alinhadas ao eixo.'''
@@ -81,7 +220,7 @@ def collision_aabb(A, B):
     return Collision(A, B, pos=pos_col, normal=n, delta=delta)
 
 
-@get_collision.dispatch(Circle, Circle)
+@collision_pair(Circle, Circle)
 def collision_circle(A, B):
     '''Testa a colisão pela distância dos centros'''
 
@@ -97,16 +236,212 @@ def collision_circle(A, B):
         return None
 
 
-@get_collision.dispatch(Poly, Poly)
+@collision_pair(Poly, Poly)
 def collision_poly(A, B, directions=None):
-    '''Implementa a colisão entre dois polígonos arbitrários'''
+    '''Implementa a colisão entre dois polígonos convexos arbitrários.
+
+    Utiliza o teorema dos eixos separadores testando as normais de todos os
+    lados de A e de B. Para cada normal, a separação é calculada com uma
+    única consulta ao ponto de suporte do outro polígono na direção oposta. O
+    último eixo separador encontrado para cada par é memorizado, de modo que
+    pares que continuam separados normalmente são descartados depois de uma
+    única consulta.
+
+    Caso uma lista de direções seja fornecida, utiliza a projeção completa
+    dos dois polígonos nestas direções. Polígonos com muitos lados (veja
+    GJK_MIN_SIDES) são testados por collision_gjk().'''
+
+    if directions is not None:
+        return _collision_poly_directions(A, B, directions)
+    if A.num_sides + B.num_sides > GJK_MIN_SIDES:
+        return collision_gjk(A, B)
+
+    # Testa primeiro o eixo que separou o par no último teste
+    key = (id(A), id(B))
+    hint = _separating_axes.get(key)
+    if hint is not None:
+        owner, idx, num_sides = hint
+        P, Q = (A, B) if owner == 0 else (B, A)
+
+        # A chave pode ter sido reaproveitada por outro par de objetos
+        if num_sides != P.num_sides or idx >= num_sides:
+            del _separating_axes[key]
+            hint = None
+        elif _face_separation(P, Q, idx) > 0:
+            return None
 
-    # Cria a lista de direções a partir das normais do polígono
-    if directions is None:
-        if A.num_normals + B.num_normals < 9:
-            directions = A.get_normals() + B.get_normals()
-        else:
-            directions = DEFAULT_DIRECTIONS
+    # Procura o eixo de menor penetração nas normais de A e de B
+    sepA, idxA = _max_face_separation(A, B)
+    if sepA > 0:
+        _remember_axis(key, 0, idxA, A.num_sides)
+        return None
+    sepB, idxB = _max_face_separation(B, A)
+    if sepB > 0:
+        _remember_axis(key, 1, idxB, B.num_sides)
+        return None
+    if hint is not None:
+        del _separating_axes[key]
+
+    # Escolhe a aresta de referência. A tolerância favorece as arestas de A
+    # e evita que a escolha oscile entre frames
+    if sepB > REFERENCE_TOLERANCE * sepA + REFERENCE_SLOP:
+        manifold = reference_face_manifold(B, A, idxB, flip=True)
+    else:
+        manifold = reference_face_manifold(A, B, idxA)
+
+    points = manifold.points
+    if not points:
+        return None
+    elif len(points) == 1:
+        pt = points[0]
+        return Collision(A, B, pos=pt, normal=manifold.normal,
+                         delta=pt.depth)
+    return ManifoldCollision(A, B, manifold)
+
+
+REFERENCE_TOLERANCE = 0.98
+REFERENCE_SLOP = 1e-3
+
+
+def reference_face_manifold(R, I, idx, flip=False):
+    '''Calcula o ContactManifold entre o polígono de referência R e o
+    polígono incidente I a partir da idx-ésima aresta de R.
+
+    A aresta incidente é a aresta de I cuja normal é mais oposta à normal da
+    aresta de referência. Ela é recortada pelas laterais da aresta de
+    referência e apenas os pontos que penetram R são mantidos (no máximo
+    dois). Cada ponto de contato fica a meio caminho entre o ponto incidente e
+    a aresta de referência.
+
+    A normal do manifold é a normal da aresta de referência, ou o seu oposto
+    caso flip=True.'''
+
+    # Aresta de referência em coordenadas globais
+    nx, ny = R._rnormals[idx]
+    rx, ry = R._pos
+    rvertices = R._rvertices
+    x1, y1 = rvertices[idx]
+    x2, y2 = rvertices[(idx + 1) % len(rvertices)]
+    x1, y1, x2, y2 = x1 + rx, y1 + ry, x2 + rx, y2 + ry
+
+    # Aresta incidente
+    best = None
+    for k, (mx, my) in enumerate(I._rnormals):
+        dot_n = mx * nx + my * ny
+        if best is None or dot_n < best:
+            best, inc = dot_n, k
+    ix, iy = I._pos
+    ivertices = I._rvertices
+    wx1, wy1 = ivertices[inc]
+    wx2, wy2 = ivertices[(inc + 1) % len(ivertices)]
+    segment = [(wx1 + ix, wy1 + iy), (wx2 + ix, wy2 + iy)]
+
+    # Recorta pelas laterais da aresta de referência
+    tx, ty = x2 - x1, y2 - y1
+    segment = _clip_segment(segment, tx, ty, tx * x1 + ty * y1, 1)
+    segment = _clip_segment(segment, tx, ty, tx * x2 + ty * y2, -1)
+
+    # Mantém os pontos abaixo da aresta de referência
+    offset = nx * x1 + ny * y1
+    points = []
+    for (px, py) in segment:
+        depth = offset - (nx * px + ny * py)
+        if depth >= 0:
+            points.append(ContactPoint(px + 0.5 * depth * nx,
+                                       py + 0.5 * depth * ny, depth))
+
+    if flip:
+        nx, ny = -nx, -ny
+    return ContactManifold(Vec2(nx, ny), points)
+
+
+def _clip_segment(segment, tx, ty, value, sign):
+    '''Recorta um segmento [(x1, y1), (x2, y2)] mantendo a parte em que
+    sign * ((tx, ty) . pt - value) >= 0'''
+
+    if len(segment) < 2:
+        return segment
+
+    (x1, y1), (x2, y2) = segment
+    d1 = sign * (tx * x1 + ty * y1 - value)
+    d2 = sign * (tx * x2 + ty * y2 - value)
+    if d1 >= 0 and d2 >= 0:
+        return segment
+    elif d1 < 0 and d2 < 0:
+        return []
+
+    t = d1 / (d1 - d2)
+    mid = (x1 + t * (x2 - x1), y1 + t * (y2 - y1))
+    return [(x1, y1), mid] if d1 >= 0 else [mid, (x2, y2)]
+
+
+# Último eixo separador de cada par de polígonos: (id(A), id(B)) -> (0 ou 1,
+# índice da normal em A ou B, número de lados deste polígono). É apenas uma
+# sugestão para acelerar o teste e, portanto, pode ser esvaziado a qualquer
+# momento. Como os ids podem ser reaproveitados por outros objetos, o número
+# de lados é conferido antes de utilizar a sugestão.
+_separating_axes = {}
+MAX_SEPARATING_AXES = 4096
+
+
+def _remember_axis(key, owner, idx, num_sides):
+    if len(_separating_axes) >= MAX_SEPARATING_AXES:
+        _separating_axes.clear()
+    _separating_axes[key] = (owner, idx, num_sides)
+
+
+def forget_separating_axes(obj):
+    '''Remove os eixos separadores memorizados para os pares que contêm o
+    objeto obj'''
+
+    ref = id(obj)
+    for key in [key for key in _separating_axes if ref in key]:
+        del _separating_axes[key]
+
+
+def _face_separation(P, Q, idx):
+    '''Distância com sinal entre o idx-ésimo lado de P e o ponto de suporte
+    de Q na direção oposta à normal deste lado'''
+
+    nx, ny = P._rnormals[idx]
+    px, py = P._pos
+    qx, qy = Q._pos
+    support = None
+    for (x, y) in Q._rvertices:
+        coord = x * nx + y * ny
+        if support is None or coord < support:
+            support = coord
+    return (support + (qx - px) * nx + (qy - py) * ny -
+            P._base_offsets[idx])
+
+
+def _max_face_separation(P, Q):
+    '''Retorna a maior separação entre os lados de P e o polígono Q e o
+    índice do lado correspondente. Retorna assim que encontra uma separação
+    positiva.'''
+
+    best, best_idx = None, 0
+    px, py = P._pos
+    qx, qy = Q._pos
+    dx, dy = qx - px, qy - py
+    offsets = P._base_offsets
+    rvertices = Q._rvertices
+    for idx, (nx, ny) in enumerate(P._rnormals):
+        support = None
+        for (x, y) in rvertices:
+            coord = x * nx + y * ny
+            if support is None or coord < support:
+                support = coord
+        sep = support + dx * nx + dy * ny - offsets[idx]
+        if best is None or sep > best:
+            best, best_idx = sep, idx
+            if sep > 0:
+                break
+    return best, best_idx
+
+
+def _collision_poly_directions(A, B, directions):
+    '''Teste de colisão entre polígonos por projeção nas direções dadas'''
 
     # Testa se há superposição de sombras em todas as direções consideradas
     # e calcula o menor valor para sombra e a direção normal
@@ -129,11 +464,8 @@ def collision_poly(A, B, directions=None):
     if dot(A._pos, norm) > dot(B._pos, norm):
         norm = -norm
 
-    # Computa o polígono de intersecção e usa o seu centro de massa como ponto
-    # de colisão
     try:
         clipped = clip(A.vertices, B.vertices)
-    # não houve superposição (talvez por usar normais aproximadas)
     except ValueError:
         return None
 
@@ -147,59 +479,133 @@ def collision_poly(A, B, directions=None):
 #                 Colisões entre objetos de tipos diferentes
 ###############################################################################
 
-@get_collision.dispatch(Circle, AABB)
+@collision_pair(Circle, AABB)
 def circle_aabb(A, B):
-    # TODO: implementar direito, está utilizando AABBs
-    r = A.cbb_radius
-    x, y = A._pos
-    Axmin, Axmax = x - r, x + r
-    Aymin, Aymax = y - r, y + r
-
-    x, y = B._pos
-    dx, dy = B._delta_x, B._delta_y
-    Bxmin, Bxmax = x - dx, x + dx
-    Bymin, Bymax = y - dy, y + dy
-
-    shadowx = min(Axmax, Bxmax) - max(Axmin, Bxmin)
-    shadowy = min(Aymax, Bymax) - max(Aymin, Bymin)
-    if shadowx < 0 or shadowy < 0:
-        return None
+    '''Implementa a colisão entre um círculo e uma caixa AABB pelo GJK'''
 
-    # Calcula ponto de colisão
-    x_col = max(A.xmin, B.xmin) + shadowx / 2.
-    y_col = max(A.ymin, B.ymin) + shadowy / 2.
-    pos_col = Vec2(x_col, y_col)
+    return collision_gjk(A, B)
 
-    # Define sinal dos vetores normais: colisões tipo PONG
-    if shadowx > shadowy:
-        n = Vec2(0, (1 if A.ymin < B.ymin else -1))
-    else:
-        n = Vec2((1 if A.xmin < B.xmin else -1), 0)
 
-    return Collision(A, B, pos=pos_col, normal=n)
+@collision_pair(AABB, Circle)
+def aabb_circle(A, B):
+    '''Implementa a colisão entre uma caixa AABB e um círculo pelo GJK'''
 
+    return collision_gjk(A, B)
 
-@get_collision.dispatch(AABB, Circle)
-def aabb_circle(A, B):
-    return circle_aabb(B, A)
 
+@collision_pair(Circle, Poly)
+def circle_poly(A, B):
+    '''Implementa a colisão entre um círculo e um polígono pelo GJK/EPA'''
 
-@get_collision.dispatch(Poly, AABB)
+    return collision_gjk(A, B)
+
+
+@collision_pair(Poly, Circle)
+def poly_circle(A, B):
+    '''Implementa a colisão entre um polígono e um círculo pelo GJK/EPA'''
+
+    return collision_gjk(A, B)
+
+
+@collision_pair(Poly, AABB)
 def poly_aabb(A, B):
     '''Implementa a colisão entre um polígono arbitrário e uma caixa AABB'''
 
-    return aabb_poly(B, A)
+    col = aabb_poly(B, A)
+    if col is not None:
+        return col.swapped()
 
 
-@get_collision.dispatch(AABB, Poly)
+@collision_pair(AABB, Poly)
 def aabb_poly(A, B):
-    '''Implementa a colisão entre um polígono arbitrário e uma caixa AABB'''
+    '''Implementa a colisão entre uma caixa AABB e um polígono arbitrário.
+
+    Utiliza o teorema dos eixos separadores com os eixos fixos x e y da AABB
+    e as normais do polígono. As sombras são calculadas diretamente a partir
+    das coordenadas, sem criar objetos intermediários.'''
+
+    # Eixos x e y: sombras obtidas das caixas de contorno
+    Axmin, Axmax, Aymin, Aymax = A.xmin, A.xmax, A.ymin, A.ymax
+    shadowx = min(Axmax, B.xmax) - max(Axmin, B.xmin)
+    if shadowx < 0:
+        return None
+    shadowy = min(Aymax, B.ymax) - max(Aymin, B.ymin)
+    if shadowy < 0:
+        return None
+    if shadowx < shadowy:
+        min_shadow, nx, ny = shadowx, 1.0, 0.0
+    else:
+        min_shadow, nx, ny = shadowy, 0.0, 1.0
+
+    # Normais do polígono: a sombra da AABB em uma direção u é dada pelo
+    # centro projetado +/- o raio projetado
+    cx, cy = A._pos
+    dx, dy = A._delta_x, A._delta_y
+    px, py = B._pos
+    rvertices = B._rvertices
+    for (ux, uy) in B.get_normals():
+        center = cx * ux + cy * uy
+        radius = dx * abs(ux) + dy * abs(uy)
+        offset = px * ux + py * uy
+        Bmin = Bmax = None
+        for (x, y) in rvertices:
+            coord = x * ux + y * uy
+            if Bmin is None or coord < Bmin:
+                Bmin = coord
+            if Bmax is None or coord > Bmax:
+                Bmax = coord
+        shadow = (min(center + radius, Bmax + offset) -
+                  max(center - radius, Bmin + offset))
+        if shadow < 0:
+            return None
+        elif shadow < min_shadow:
+            min_shadow, nx, ny = shadow, ux, uy
 
-    if shadow_x(A, B) < 0 or shadow_y(A, B) < 0:
+    # Determina o sentido da normal
+    if cx * nx + cy * ny > px * nx + py * ny:
+        nx, ny = -nx, -ny
+
+    # Recorta o polígono pela caixa e usa o centro de massa da intersecção
+    # como ponto de colisão
+    points = [(px + x, py + y) for (x, y) in rvertices]
+    points = _clip_halfplane(points, 0, Axmin, 1)
+    points = _clip_halfplane(points, 0, Axmax, -1)
+    points = _clip_halfplane(points, 1, Aymin, 1)
+    points = _clip_halfplane(points, 1, Aymax, -1)
+    if len(points) < 3:
         return None
 
-    A_poly = Rectangle(bbox=A.bbox)
-    col = collision_poly(A_poly, B)
-    if col is not None:
-        col.A = A
-        return col
+    area2 = cx = cy = 0.0
+    x0, y0 = points[-1]
+    for (x1, y1) in points:
+        cross = x0 * y1 - x1 * y0
+        area2 += cross
+        cx += (x0 + x1) * cross
+        cy += (y0 + y1) * cross
+        x0, y0 = x1, y1
+    if area2 == 0:
+        return None
+    col_pt = Vec2(cx / (3 * area2), cy / (3 * area2))
+    return Collision(A, B, pos=col_pt, normal=Vec2(nx, ny), delta=min_shadow)
+
+
+def _clip_halfplane(points, k, value, sign):
+    '''Recorta a lista de pontos (x, y) de um polígono mantendo a região em
+    que sign * (pt[k] - value) >= 0 (algoritmo de Sutherland-Hodgman)'''
+
+    out = []
+    if not points:
+        return out
+
+    prev = points[-1]
+    prev_in = sign * (prev[k] - value) >= 0
+    for pt in points:
+        pt_in = sign * (pt[k] - value) >= 0
+        if pt_in != prev_in:
+            t = (value - prev[k]) / (pt[k] - prev[k])
+            out.append((prev[0] + t * (pt[0] - prev[0]),
+                        prev[1] + t * (pt[1] - prev[1])))
+        if pt_in:
+            out.append(pt)
+        prev, prev_in = pt, pt_in
+    return out
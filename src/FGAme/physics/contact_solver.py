@@ -0,0 +1,372 @@
+# -*- coding: utf8 -*-
+'''
+Solvers alternativos para os impulsos normais dos contatos.
+
+O solver padrão da simulação chama Collision.step() para cada contato em cada
+iteração, o que cria vários objetos Vec2 temporários por passo.
+
+ScalarContactSolver
+-------------------
+
+Guarda as propriedades de cada contato (normal, braços de alavanca, massa
+efetiva, etc) como floats e as velocidades de cada objeto em uma lista
+[vx, vy, omega] atualizada no lugar. As iterações não criam nenhum Vec2 e as
+velocidades só são escritas de volta nos objetos ao final. Não depende do
+NumPy e é utilizado ilha por ilha, assim como o solver padrão.
+
+ArrayContactSolver
+------------------
+
+Empacota todos os contatos de um frame em
+arrays paralelos (índices dos objetos, braços de alavanca, normal, massa
+efetiva, viés de velocidade e impulso normal acumulado) e executa as
+iterações com operações do NumPy sobre as velocidades dos objetos, que só são
+escritas de volta nos objetos ao final.
+
+Dois modos estão disponíveis:
+
+'colored'
+    Os contatos são divididos em lotes (cores) de modo que nenhum objeto
+    dinâmico aparece em dois contatos do mesmo lote. Cada lote é resolvido de
+    uma só vez e o resultado é equivalente ao de Gauss-Seidel.
+'jacobi'
+    Todos os contatos são resolvidos simultaneamente a partir das velocidades
+    da iteração anterior. Os impulsos de cada contato são multiplicados por
+    ``relaxation`` ou, caso este seja None, divididos pelo maior número de
+    contatos de um dos dois objetos, o que evita oscilações em pilhas.
+
+Assim como no solver padrão, o atrito é aplicado uma única vez por
+Collision.finalize() depois das iterações.
+
+O ArrayContactSolver requer o NumPy.
+'''
+
+from FGAme.mathutils import Vec2
+from FGAme.physics.collision import ManifoldCollision
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+__all__ = ['ScalarContactSolver', 'ArrayContactSolver']
+
+
+def _expand(contacts):
+    '''Lista de pontos de contato, expandindo as colisões com vários
+    pontos'''
+
+    points = []
+    for col in contacts:
+        if isinstance(col, ManifoldCollision):
+            points.extend(col.contacts)
+        else:
+            points.append(col)
+    return points
+
+
+def _finish(contacts, points, Jns):
+    '''Guarda os impulsos acumulados e as velocidades relativas nos pontos de
+    contato (usadas pelo atrito em Collision.finalize()) e atualiza os
+    impulsos agregados das colisões com vários pontos'''
+
+    for col, Jn in zip(points, Jns):
+        col.Jn = Jn
+        A, B = col.A, col.B
+        col.vrel = ((B._vel + B._omega * col.rB_ortho)
+                    - (A._vel + A._omega * col.rA_ortho))
+
+    for col in contacts:
+        if isinstance(col, ManifoldCollision):
+            col.Jn = sum(pt.Jn for pt in col.contacts)
+
+
+###############################################################################
+#                           Solver escalar
+###############################################################################
+class ScalarContactSolver(object):
+
+    '''Resolve os impulsos normais de uma lista de contatos sem criar objetos
+    Vec2 nas iterações.
+
+    >>> from FGAme.physics import Simulation
+    >>> sim = Simulation(solver=ScalarContactSolver())
+    '''
+
+    __slots__ = []
+
+    # A simulação chama solve() para cada ilha de contatos
+    per_island = True
+
+    def solve(self, contacts, niter, tolerance=0.0):
+        '''Executa até niter iterações sobre a lista de contatos (que já
+        devem ter sido inicializados com init()) e retorna uma tupla com o
+        número de iterações realizadas e o resíduo da última iteração.'''
+
+        if not contacts:
+            return 0, 0.0
+        points = _expand(contacts)
+
+        # Estado de cada objeto: [vx, vy, omega, 1/massa, 1/inércia]. Assim
+        # como em Collision.apply_impulse(), objetos com massa infinita não
+        # giram
+        states = {}
+        bodies = []
+        rows = []
+        for col in points:
+            A, B = col.A, col.B
+            try:
+                sA = states[id(A)]
+            except KeyError:
+                sA = states[id(A)] = _body_state(A)
+                bodies.append((A, sA))
+            try:
+                sB = states[id(B)]
+            except KeyError:
+                sB = states[id(B)] = _body_state(B)
+                bodies.append((B, sB))
+            n, rA, rB = col.normal, col.rA, col.rB
+            nx, ny = n.x, n.y
+            rows.append([sA, sB, nx, ny,
+                         rA.x * ny - rA.y * nx, rB.x * ny - rB.y * nx,
+                         col.effmass, col.vel_bias, col.Jn])
+
+        # Iterações: apenas aritmética de floats e atualizações no lugar
+        residual = 0.0
+        iters = niter
+        for i in range(niter):
+            residual = 0.0
+            for row in rows:
+                sA, sB, nx, ny, cA, cB, effmass, bias, Jn = row
+                vrel = (nx * (sB[0] - sA[0]) + ny * (sB[1] - sA[1]) +
+                        sB[2] * cB - sA[2] * cA)
+                deltaJ = -effmass * (vrel - bias)
+                row[8] = Jn + deltaJ
+
+                invm = sA[3]
+                if invm:
+                    sA[0] -= deltaJ * nx * invm
+                    sA[1] -= deltaJ * ny * invm
+                    sA[2] -= deltaJ * cA * sA[4]
+                invm = sB[3]
+                if invm:
+                    sB[0] += deltaJ * nx * invm
+                    sB[1] += deltaJ * ny * invm
+                    sB[2] += deltaJ * cB * sB[4]
+
+                delta = abs(deltaJ) / effmass
+                if delta > residual:
+                    residual = delta
+            if residual < tolerance:
+                iters = i + 1
+                break
+
+        # Escreve os resultados de volta nos objetos e contatos
+        for obj, (vx, vy, omega, invm, invI) in bodies:
+            if invm:
+                obj._vel = Vec2(vx, vy)
+                if invI:
+                    obj._omega = omega
+        _finish(contacts, points, [row[8] for row in rows])
+        return iters, residual
+
+
+def _body_state(obj):
+    invm = obj._invmass
+    return [obj._vel.x, obj._vel.y, obj._omega, invm,
+            obj._invinertia if invm else 0.0]
+
+
+###############################################################################
+#                           Solver vetorizado
+###############################################################################
+class ArrayContactSolver(object):
+
+    '''Resolve os impulsos normais de uma lista de contatos utilizando arrays
+    do NumPy.
+
+    Pode ser passado para a simulação pelo argumento ``solver``:
+
+    >>> from FGAme.physics import Simulation
+    >>> sim = Simulation(solver=ArrayContactSolver('jacobi'))
+    >>> sim.solver.mode
+    'jacobi'
+    '''
+
+    __slots__ = ['mode', 'relaxation', 'num_colors']
+
+    # Todos os contatos do frame são resolvidos de uma só vez
+    per_island = False
+
+    def __init__(self, mode='colored', relaxation=None):
+        if np is None:
+            raise RuntimeError('ArrayContactSolver requires numpy')
+        if mode not in ('colored', 'jacobi'):
+            raise ValueError('invalid mode: %r' % mode)
+        self.mode = mode
+        self.relaxation = relaxation
+        self.num_colors = 0
+
+    def solve(self, contacts, niter, tolerance=0.0):
+        '''Executa até niter iterações sobre a lista de contatos (que já
+        devem ter sido inicializados com init()) e retorna uma tupla com o
+        número de iterações realizadas e o resíduo da última iteração.
+
+        O resíduo é o maior incremento de impulso de uma iteração dividido
+        pela massa efetiva do contato.'''
+
+        if not contacts:
+            return 0, 0.0
+
+        points = _expand(contacts)
+        data = _ContactArrays(points)
+        if self.mode == 'colored':
+            iters, residual = self._solve_colored(data, niter, tolerance)
+        else:
+            iters, residual = self._solve_jacobi(data, niter, tolerance)
+        data.write_back()
+        _finish(contacts, points, data.Jn.tolist())
+        return iters, residual
+
+    def _solve_colored(self, data, niter, tolerance):
+        batches = data.colors()
+        self.num_colors = len(batches)
+        vx, vy, w = data.vx, data.vy, data.w
+        residual = 0.0
+        for i in range(niter):
+            residual = 0.0
+            for k, a, b in batches:
+                deltaJ = data.delta_impulse(k, a, b)
+                data.Jn[k] += deltaJ
+                res = np.abs(deltaJ * data.invmass_eff[k]).max()
+                if res > residual:
+                    residual = res
+
+                # Nenhum objeto dinâmico se repete no mesmo lote
+                px, py = deltaJ * data.nx[k], deltaJ * data.ny[k]
+                vx[a] -= px * data.invm[a]
+                vy[a] -= py * data.invm[a]
+                w[a] -= deltaJ * data.crossA[k] * data.invI[a]
+                vx[b] += px * data.invm[b]
+                vy[b] += py * data.invm[b]
+                w[b] += deltaJ * data.crossB[k] * data.invI[b]
+            if residual < tolerance:
+                return i + 1, residual
+        return niter, residual
+
+    def _solve_jacobi(self, data, niter, tolerance):
+        a, b = data.a, data.b
+        k = slice(None)
+        N = len(data.vx)
+        invm, invI = data.invm, data.invI
+        if self.relaxation is None:
+            dynamic = (invm > 0) | (invI > 0)
+            degree = (np.bincount(a, dynamic[a], N) +
+                      np.bincount(b, dynamic[b], N))
+            scale = 1.0 / np.maximum(np.maximum(degree[a], degree[b]), 1)
+        else:
+            scale = self.relaxation
+
+        residual = 0.0
+        for i in range(niter):
+            deltaJ = data.delta_impulse(k, a, b) * scale
+            data.Jn += deltaJ
+            residual = np.abs(deltaJ * data.invmass_eff).max()
+
+            px, py = deltaJ * data.nx, deltaJ * data.ny
+            data.vx += (np.bincount(b, px, N) - np.bincount(a, px, N)) * invm
+            data.vy += (np.bincount(b, py, N) - np.bincount(a, py, N)) * invm
+            data.w += (np.bincount(b, deltaJ * data.crossB, N) -
+                       np.bincount(a, deltaJ * data.crossA, N)) * invI
+            if residual < tolerance:
+                return i + 1, residual
+        return niter, residual
+
+
+class _ContactArrays(object):
+
+    '''Arrays paralelos com as propriedades dos contatos e as velocidades dos
+    objetos envolvidos'''
+
+    def __init__(self, points):
+        bodies = []
+        index = {}
+
+        def body_index(obj):
+            try:
+                return index[id(obj)]
+            except KeyError:
+                index[id(obj)] = idx = len(bodies)
+                bodies.append(obj)
+                return idx
+
+        rows = []
+        for col in points:
+            A, B = col.A, col.B
+            rA, rB, n = col.rA, col.rB, col.normal
+            rows.append((body_index(A), body_index(B), n.x, n.y,
+                         rA.cross(n), rB.cross(n), col.effmass,
+                         col.vel_bias, col.Jn))
+        self.bodies = bodies
+
+        table = np.array(rows, dtype=float)
+        self.a = table[:, 0].astype(int)
+        self.b = table[:, 1].astype(int)
+        (self.nx, self.ny, self.crossA, self.crossB, self.effmass,
+         self.bias, self.Jn) = table[:, 2:].T.copy()
+        self.invmass_eff = 1.0 / self.effmass
+
+        # Velocidades e inversos da massa e do momento de inércia. Assim como
+        # em Collision.apply_impulse(), objetos com massa infinita não giram
+        state = np.array([(obj._vel.x, obj._vel.y, obj._omega, obj._invmass,
+                           obj._invinertia if obj._invmass else 0.0)
+                          for obj in bodies], dtype=float)
+        self.vx, self.vy, self.w, self.invm, self.invI = state.T.copy()
+
+    def delta_impulse(self, k, a, b):
+        '''Incremento de impulso normal dos contatos k (entre os objetos a e
+        b) calculado a partir das velocidades atuais'''
+
+        vx, vy, w = self.vx, self.vy, self.w
+        nx, ny = self.nx[k], self.ny[k]
+        vrel = (nx * (vx[b] - vx[a]) + ny * (vy[b] - vy[a]) +
+                w[b] * self.crossB[k] - w[a] * self.crossA[k])
+        return -self.effmass[k] * (vrel - self.bias[k])
+
+    def colors(self):
+        '''Divide os contatos em lotes em que nenhum objeto dinâmico se
+        repete. Retorna uma lista de tuplas (k, a, b) com os índices dos
+        contatos e dos objetos de cada lote.'''
+
+        dynamic = ((self.invm > 0) | (self.invI > 0)).tolist()
+        used = [set() for _ in self.bodies]
+        colors = []
+        for a, b in zip(self.a.tolist(), self.b.tolist()):
+            taken = set()
+            if dynamic[a]:
+                taken |= used[a]
+            if dynamic[b]:
+                taken |= used[b]
+            color = 0
+            while color in taken:
+                color += 1
+            used[a].add(color)
+            used[b].add(color)
+            colors.append(color)
+
+        colors = np.array(colors)
+        batches = []
+        for c in range(colors.max() + 1):
+            k = np.flatnonzero(colors == c)
+            batches.append((k, self.a[k], self.b[k]))
+        return batches
+
+    def write_back(self):
+        '''Escreve as velocidades de volta nos objetos'''
+
+        vx, vy, w = self.vx.tolist(), self.vy.tolist(), self.w.tolist()
+        for obj, x, y, omega, invm, invI in zip(self.bodies, vx, vy, w,
+                                                self.invm, self.invI):
+            if invm:
+                obj._vel = Vec2(x, y)
+                if invI:
+                    obj._omega = omega
@@ -1,8 +1,9 @@
 # -*- coding: utf8 -*-
 from FGAme.core import EventDispatcher, EventDispatcherMeta, signal
 from FGAme.mathutils import Vec2, sin, cos, sqrt, nullvec2, Circle
+from FGAme.mathutils import AABB as _AABB
 from FGAme.util import six
-from FGAme.physics.flags import BodyFlags as flags
+from FGAme.physics.flags import BodyFlags as flags, CollisionFilter
 
 
 __all__ = ['Body', 'LinearRigidBody']
@@ -212,10 +213,15 @@ class Body(object):
         'flags', 'cbb_radius', '_baseshape', '_shape', '_aabb',
         '_pos', '_vel', '_accel', '_theta', '_omega', '_alpha',
         '_invmass', '_invinertia', '_e_vel', '_e_omega', '_world',
-        '_col_layer', '_col_group_mask',
+        '_col_layer', '_col_group_mask', '_col_filter', '_col_mask',
+        '_sleep_time',
     ]
 
-    DEFAULT_FLAGS = 0 | flags.can_rotate | flags.dirty_shape | flags.dirty_aabb
+    DEFAULT_FLAGS = (0 | flags.can_rotate | flags.can_sleep | flags.dirty_any)
+
+    # Índice do tipo de forma na tabela de colisões da narrow-phase (veja
+    # FGAme.physics.collision_pairs.register_shape)
+    _shape_id = 0
 
     def __init__(self, pos=nullvec2, vel=nullvec2, theta=0.0, omega=0.0,
                  mass=None, density=None, inertia=None,
@@ -239,6 +245,7 @@ class Body(object):
         self._omega = float(omega)
         self._accel = nullvec2
         self._alpha = 0.0
+        self._sleep_time = 0.0
 
         # Harmoniza massa, inércia e densidade ################################
         self._baseshape = self._shape = baseshape
@@ -300,8 +307,13 @@ class Body(object):
 
         # Filtros de colisões #################################################
         # Colide se objetos estão em groupos diferentes (exceto os que estão
-        # no grupo 0) e no mesmo layer
-        self._col_layer = int(col_layer)
+        # no grupo 0) e no mesmo layer. Layers podem ser inteiros ou strings:
+        # o mundo mapeia os nomes para números quando o objeto é adicionado.
+        # As regras são pré-compiladas nas palavras _col_filter e _col_mask
+        # (veja CollisionFilter).
+        if not isinstance(col_layer, str):
+            col_layer = int(col_layer)
+        self._col_layer = col_layer
         if col_group:
             if isinstance(col_group, int):
                 self._col_group_mask = 1 << (col_group - 1)
@@ -312,11 +324,7 @@ class Body(object):
                 self._col_group_mask = mask
         else:
             self._col_group_mask = 0
-        # TODO: fundir col_layer com col_group_mask no mesmo inteiro?
-        # (talvez 50 bits para grupos e 10 ==> 1024 layers diferentes)
-        # Do jeito que está, podemos utilizar strings como identificadores
-        # de layers (mas não para grupos). A classe mundo poderia fazer um
-        # mapa entre strings > números nos dois casos.
+        self._update_col_filter()
 
         # Presença em mundo ###################################################
         if world is not None:
@@ -355,7 +363,7 @@ class Body(object):
         '''Caixa de contorno alinhada aos eixos que envolve o objeto'''
 
         if self.flags & flags.dirty_aabb:
-            self._aabb = self._shape.aabb()
+            self._aabb = _AABB(self.xmin, self.xmax, self.ymin, self.ymax)
             self.flags &= flags.not_dirty_aabb
         return self._aabb
 
@@ -364,7 +372,7 @@ class Body(object):
         '''Retorna um objeto que representa o formato geométrico do corpo
         físico, ex.: Circle, AABB, Poly, etc'''
 
-        if self.flags & flags.dirty_any:
+        if self.flags & flags.dirty_geometry:
             self._shape = self._shape_base.move(self.pos).rotate(self._theta)
             self.flags &= flags.not_dirty
         return self._shape
@@ -437,7 +445,7 @@ class Body(object):
         invmass = contact.A._invmass
         for i, C in enumerate(L):
             if invmass < C.A._invmass:
-                L.insert(i, C)
+                L.insert(i, contact)
                 break
         else:
             L.append(contact)
@@ -472,6 +480,8 @@ class Body(object):
             self.flags |= flag
         else:
             self.flags &= ~flag
+        if flag & flags.is_sleeping:
+            self._update_col_filter()
 
     def toggle_flag(self, flag):
         '''Inverte o valor da flag.
@@ -487,6 +497,8 @@ class Body(object):
             self.flags |= flag
         else:
             self.flags &= ~flag
+        if flag & flags.is_sleeping:
+            self._update_col_filter()
 
     def get_flag(self, flag):
         '''Retorna o valor da flag.
@@ -540,6 +552,8 @@ class Body(object):
 
     @omega.setter
     def omega(self, value):
+        if self.flags & flags.is_sleeping:
+            self.wake()
         if self.flags & flags.can_rotate:
             self._omega = value + 0.0
         elif value:
@@ -551,11 +565,114 @@ class Body(object):
 
     @theta.setter
     def theta(self, value):
+        if self.flags & flags.is_sleeping:
+            self.wake()
         if self.flags & flags.can_rotate:
             self._theta = value + 0.0
+            self.flags |= flags.dirty_any
         elif value:
             self._raise_cannot_rotate_error()
 
+    ###########################################################################
+    #                               Repouso
+    ###########################################################################
+    @property
+    def is_sleeping(self):
+        '''Verdadeiro se o objeto estiver dormindo.
+
+        Objetos dormindo não são integrados nem testados contra outros objetos
+        dormindo ou estáticos. A simulação coloca para dormir as ilhas de
+        objetos que permanecem em repouso (veja Simulation.sleep_time) e as
+        acorda quando algum objeto da ilha recebe um contato, um impulso ou é
+        deslocado.'''
+
+        return bool(self.flags & flags.is_sleeping)
+
+    def sleep(self):
+        '''Coloca o objeto para dormir, zerando as suas velocidades'''
+
+        if not self.flags & flags.is_sleeping:
+            self.flags |= flags.is_sleeping
+            self._vel = nullvec2
+            self._omega = 0.0
+            self._update_col_filter()
+
+    def wake(self):
+        '''Acorda o objeto e todos os objetos que dormem na mesma ilha'''
+
+        if self.flags & flags.is_sleeping:
+            world = self._world
+            if world is not None:
+                world.wake(self)
+            else:
+                self._wake()
+
+    def _wake(self):
+        # Acorda apenas este objeto
+        self.flags &= ~flags.is_sleeping
+        self._sleep_time = 0.0
+        self._update_col_filter()
+
+    ###########################################################################
+    #                    Detecção contínua de colisões
+    ###########################################################################
+    @property
+    def is_bullet(self):
+        '''Verdadeiro se o objeto utiliza detecção contínua de colisões.
+
+        Objetos rápidos e pequenos (ex.: projéteis) podem atravessar paredes
+        finas entre dois frames. A simulação calcula o instante de impacto
+        destes objetos ao longo do deslocamento de cada frame e interrompe o
+        movimento no primeiro contato (veja FGAme.physics.ccd).'''
+
+        return bool(self.flags & flags.is_bullet)
+
+    @is_bullet.setter
+    def is_bullet(self, value):
+        if value:
+            self.flags |= flags.is_bullet
+        else:
+            self.flags &= ~flags.is_bullet
+
+    ###########################################################################
+    #                         Filtros de colisão
+    ###########################################################################
+    @property
+    def col_layer(self):
+        '''Layer de colisão do objeto (um inteiro ou uma string)'''
+
+        return self._col_layer
+
+    @col_layer.setter
+    def col_layer(self, value):
+        self._col_layer = value if isinstance(value, str) else int(value)
+        self._update_col_filter()
+
+    @property
+    def col_group_mask(self):
+        '''Máscara de bits com os grupos de colisão do objeto'''
+
+        return self._col_group_mask
+
+    @col_group_mask.setter
+    def col_group_mask(self, value):
+        self._col_group_mask = int(value)
+        self._update_col_filter()
+
+    def _update_col_filter(self):
+        '''Recalcula as palavras _col_filter e _col_mask a partir do layer,
+        dos grupos e do estado (estático/dormindo) do objeto.
+
+        Deve ser chamado sempre que algum destes parâmetros mudar.'''
+
+        layer = self._col_layer
+        if isinstance(layer, str):
+            world = self._world
+            layer = 0 if world is None else world.get_col_layer(layer)
+        inactive = not self._invmass or self.flags & flags.is_sleeping
+        self._col_filter, self._col_mask = CollisionFilter.words(
+            layer, self._col_group_mask, inactive)
+
     ###########################################################################
     #                        Propriedades físicas
     ###########################################################################
@@ -582,6 +699,7 @@ class Body(object):
             self._invmass = 1.0 / value
         else:
             self._invmass = 0.0
+        self._update_col_filter()
 
     @property
     def inertia(self):
@@ -692,18 +810,29 @@ class Body(object):
     def move(self, delta_or_x, y=None):
         '''Move o objeto por vetor de deslocamento delta'''
 
+        # Deslocamentos nulos não sujam a caixa de contorno: isto permite que
+        # as broad-phases ignorem objetos parados
         if y is None:
             if delta_or_x is nullvec2:
                 return
+            x, y = delta_or_x
+            if x == 0.0 and y == 0.0:
+                return
             self._pos += delta_or_x
         else:
+            if delta_or_x == 0.0 and y == 0.0:
+                return
             self._pos += (delta_or_x, y)
 
+        if self.flags & flags.is_sleeping:
+            self.wake()
         self.flags |= flags.dirty_any
 
     def boost(self, delta_or_x, y=None):
         '''Adiciona um valor vetorial delta à velocidade linear'''
 
+        if self.flags & flags.is_sleeping:
+            self.wake()
         if y is None:
             self._vel += delta_or_x
         else:
@@ -810,9 +939,14 @@ class Body(object):
         energia tende a fornecer energia espúria ao sistema. Deste modo, a
         acurácia ficaria reduzida, mas a simulação ainda manteria alguma
         credibilidade.
+
+        Este método aplica um único passo com aceleração constante em um
+        objeto isolado. O algoritmo de Velocity-Verlet descrito acima é
+        implementado para todos os objetos da simulação pelo integrador
+        FGAme.physics.integrator.VelocityVerlet (veja
+        Simulation(integrator='verlet')).
         '''
 
-        # TODO: reimplementar algoritmo correto
         a = Vec2.from_seq(a)
         self.move(self._vel * dt + a * (dt ** 2 / 2.0))
         self.boost(a * dt)
@@ -833,11 +967,15 @@ class Body(object):
 
         self._theta += theta
         if theta != 0.0:
+            if self.flags & flags.is_sleeping:
+                self.wake()
             self.flags |= flags.dirty_any
 
     def aboost(self, delta):
         '''Adiciona um valor delta à velocidade ângular'''
 
+        if self.flags & flags.is_sleeping:
+            self.wake()
         self._omega += delta
 
     def vpoint(self, pos_or_x, y=None, relative=False):
@@ -1224,9 +1362,13 @@ class Body(object):
                          '`can_rotate` flag')
 
 
-def vec_property(slot):
+def vec_property(slot, dirty=0, wake=False):
     '''Fabrica um slot que força a conversão de uma variável para a classe
-    vetor.'''
+    vetor.
+
+    Se o argumento `dirty` for fornecido, as flags correspondentes são
+    ligadas no objeto sempre que o valor for modificado. Se `wake` for
+    verdadeiro, objetos dormindo são acordados quando o valor é modificado.'''
 
     getter = slot.__get__
     setter = slot.__set__
@@ -1238,6 +1380,10 @@ def vec_property(slot):
             if not isinstance(value, Vec2):
                 value = Vec2(value)
             setter(obj, value)
+            if dirty:
+                obj.flags |= dirty
+            if wake and obj.flags & flags.is_sleeping:
+                obj.wake()
 
         def __get__(self, obj, cls):
             if obj is None:
@@ -1247,8 +1393,8 @@ def vec_property(slot):
 
     return VecProperty()
 
-Body.pos = vec_property(Body._pos)
-Body.vel = vec_property(Body._vel)
+Body.pos = vec_property(Body._pos, flags.dirty_any, wake=True)
+Body.vel = vec_property(Body._vel, wake=True)
 Body.accel = vec_property(Body._accel)
 
 ###############################################################################
@@ -14,6 +14,7 @@ class _BodyFlagsBase:
     is_sleeping = 1 << next(N)
     can_rotate = 1 << next(N)
     can_sleep = 1 << next(N)
+    is_bullet = 1 << next(N)
 
     # Controle de forças
     owns_gravity = 1 << next(N)
@@ -31,9 +32,12 @@ class _BodyFlagsBase:
     has_external_torque = 1 << next(N)
     has_external_alpha = 1 << next(N)
 
-    # Estados temporários
+    # Estados temporários. A flag dirty_broadphase acompanha dirty_aabb, mas
+    # só é desligada pelas broad-phases que a consomem (a leitura de
+    # Body.aabb desliga apenas dirty_aabb).
     dirty_shape = 1 << next(N)
     dirty_aabb = 1 << next(N)
+    dirty_broadphase = 1 << next(N)
 
     # Controle do mundo
     has_visualization = 1 << next(N)
@@ -94,18 +98,73 @@ class BodyFlags(_BodyFlagsBase):
 # Estados temporários
     not_dirty_shape = f.full ^ f.dirty_shape
     not_dirty_aabb = f.full ^ f.dirty_aabb
+    not_dirty_broadphase = f.full ^ f.dirty_broadphase
 #
 # Controle do mundo
 #     has_world = 1 << next(N)
 #     has_visualization = 1 << next(N)
 
     # Flags compostas #########################################################
-    dirty_any = f.dirty_aabb | f.dirty_shape
-    not_dirty = f.full ^ dirty_any
+    dirty_bbox = f.dirty_aabb | f.dirty_broadphase
+    dirty_geometry = f.dirty_aabb | f.dirty_shape
+    dirty_any = dirty_geometry | f.dirty_broadphase
+    not_dirty = f.full ^ dirty_geometry
 
 
 del BodyFlags.f, count
 
+###############################################################################
+# Palavras de filtro de colisão
+###############################################################################
+class CollisionFilter:
+
+    '''Codifica os filtros de colisão de um objeto (layer, grupos e estado
+    estático/dormindo) em duas palavras de bits, "filter" e "mask", de modo
+    que dois objetos A e B podem colidir se e somente se
+
+        not (A._col_filter & B._col_mask)
+
+    A palavra filter possui o bit do layer do objeto, os bits de seus grupos e
+    o bit "inactive" caso o objeto seja estático ou esteja dormindo. A palavra
+    mask possui os bits de todos os *outros* layers, os mesmos bits de grupo e
+    o mesmo bit "inactive". A expressão acima rejeita portanto os objetos em
+    layers diferentes, que compartilham algum grupo ou que estão ambos
+    inativos.
+
+    >>> fA, mA = CollisionFilter.words(layer=1, group_mask=0b01)
+    >>> fB, mB = CollisionFilter.words(layer=1, group_mask=0b10)
+    >>> fC, mC = CollisionFilter.words(layer=2, group_mask=0b10)
+    >>> bool(fA & mB), bool(fB & mC), bool(fA & mC)
+    (False, True, True)
+    '''
+
+    inactive = 1
+    group_shift = 1
+    num_groups = 31
+    group_bits = ((1 << num_groups) - 1) << group_shift
+    layer_shift = group_shift + num_groups
+    num_layers = 32
+    layer_bits = ((1 << num_layers) - 1) << layer_shift
+
+    @classmethod
+    def words(cls, layer=0, group_mask=0, inactive=False):
+        '''Retorna a tupla (filter, mask) para o layer, máscara de grupos e
+        estado fornecidos'''
+
+        if not 0 <= layer < cls.num_layers:
+            raise ValueError('layer must be in range [0, %s), got %r' %
+                             (cls.num_layers, layer))
+        if group_mask >> cls.num_groups:
+            raise ValueError('groups must be in range [1, %s]' %
+                             cls.num_groups)
+
+        layer_bit = 1 << (cls.layer_shift + layer)
+        common = group_mask << cls.group_shift
+        if inactive:
+            common |= cls.inactive
+        return (layer_bit | common, (cls.layer_bits ^ layer_bit) | common)
+
+
 ###############################################################################
 # Código copy & paste para do BodyFlags._gencode()
 ###############################################################################
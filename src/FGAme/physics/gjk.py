@@ -0,0 +1,345 @@
+# -*- coding: utf8 -*-
+'''
+Detecção de colisões entre objetos convexos pelos algoritmos GJK
+(Gilbert-Johnson-Keerthi) e EPA (Expanding Polytope Algorithm).
+
+Ambos os algoritmos operam sobre a diferença de Minkowski A - B e utilizam
+apenas as funções de suporte dos objetos. O GJK calcula a distância (e os
+pontos mais próximos) entre dois objetos separados e o EPA calcula a
+profundidade e a direção de penetração quando os objetos se interceptam.
+
+Círculos são tratados como um ponto (o centro) com uma margem igual ao raio.
+Deste modo, o GJK continua exato para círculos e o EPA só é necessário quando
+os "núcleos" dos objetos se interceptam.
+
+O simplex final de cada par de objetos é guardado (na forma das direções de
+busca que geraram os seus vértices) e reutilizado como ponto de partida no
+próximo teste do mesmo par. Como os objetos se movem pouco de um frame para o
+outro, o GJK geralmente converge em uma ou duas iterações.
+'''
+
+from math import sqrt
+from FGAme.mathutils import Vec2
+from FGAme.physics.collision import Collision
+from FGAme.physics.circle import Circle
+
+__all__ = ['collision_gjk', 'distance', 'gjk', 'epa']
+
+GJK_MAX_ITER = 32
+GJK_TOLERANCE = 1e-9
+EPA_MAX_ITER = 32
+EPA_TOLERANCE = 1e-6
+MAX_CACHED_SIMPLICES = 4096
+
+# Cache de simplexes: (id(A), id(B)) -> lista de direções de busca. É apenas
+# uma sugestão para o ponto de partida e pode ser esvaziado a qualquer momento.
+# Os vértices são recalculados com as funções de suporte atuais, de modo que
+# uma entrada antiga (ou de um par cujos ids foram reaproveitados) apenas
+# atrasa a convergência.
+_simplex_cache = {}
+
+
+###############################################################################
+#                          Funções de suporte
+###############################################################################
+def core_support(obj):
+    '''Retorna uma tupla (support, radius) com a função de suporte do núcleo
+    do objeto e a margem que deve ser somada a ele.
+
+    A função support(dx, dy) retorna o ponto de suporte (x, y) na direção
+    (dx, dy). Círculos são reduzidos aos seus centros e possuem margem igual
+    ao raio. Os demais objetos devem implementar o método support().'''
+
+    if isinstance(obj, Circle):
+        center = tuple(obj._pos)
+        return (lambda dx, dy: center), obj.cbb_radius
+
+    support = obj.support
+
+    def core(dx, dy):
+        return tuple(support((dx, dy)))
+    return core, 0.0
+
+
+def _vertex(supA, supB, dx, dy):
+    # Vértice da diferença de Minkowski na direção (dx, dy). Guarda os pontos
+    # de suporte em A e B e a direção de busca.
+    ax, ay = supA(dx, dy)
+    bx, by = supB(-dx, -dy)
+    return (ax - bx, ay - by, ax, ay, bx, by, dx, dy)
+
+
+###############################################################################
+#                                 GJK
+###############################################################################
+def _closest_segment(P, Q):
+    # Ponto mais próximo da origem no segmento PQ. Retorna (vx, vy, simplex,
+    # pesos baricêntricos)
+    px, py = P[0], P[1]
+    ex, ey = Q[0] - px, Q[1] - py
+    norm_sqr = ex * ex + ey * ey
+    if norm_sqr == 0:
+        return px, py, [P], [1.0]
+    t = -(px * ex + py * ey) / norm_sqr
+    if t <= 0:
+        return px, py, [P], [1.0]
+    elif t >= 1:
+        return Q[0], Q[1], [Q], [1.0]
+    return px + t * ex, py + t * ey, [P, Q], [1 - t, t]
+
+
+def _closest(simplex):
+    # Ponto mais próximo da origem no simplex e o menor sub-simplex que o
+    # contém
+    if len(simplex) == 1:
+        P = simplex[0]
+        return P[0], P[1], simplex, [1.0]
+    elif len(simplex) == 2:
+        return _closest_segment(*simplex)
+
+    # Triângulo: verifica se a origem é interna. Triângulos degenerados
+    # (vértices repetidos ou colineares) são tratados como segmentos e a
+    # origem sobre uma aresta é tratada pelo teste da aresta.
+    P, Q, R = simplex
+    if _area2(P, Q, R) != 0:
+        c1 = (Q[0] - P[0]) * (-P[1]) - (Q[1] - P[1]) * (-P[0])
+        c2 = (R[0] - Q[0]) * (-Q[1]) - (R[1] - Q[1]) * (-Q[0])
+        c3 = (P[0] - R[0]) * (-R[1]) - (P[1] - R[1]) * (-R[0])
+        if (c1 > 0 and c2 > 0 and c3 > 0) or (c1 < 0 and c2 < 0 and c3 < 0):
+            return 0.0, 0.0, simplex, None
+
+    best = None
+    for (U, V) in [(P, Q), (Q, R), (R, P)]:
+        res = _closest_segment(U, V)
+        dist = res[0] * res[0] + res[1] * res[1]
+        if best is None or dist < best[0]:
+            best = (dist, res)
+    return best[1]
+
+
+def gjk(supA, supB, directions=()):
+    '''Calcula a distância entre dois conjuntos convexos definidos pelas
+    funções de suporte supA e supB (veja core_support).
+
+    As direções opcionais são utilizadas para construir o simplex inicial.
+
+    Retorna uma tupla (distance, pA, pB, simplex), em que pA e pB são os
+    pontos mais próximos em cada conjunto e simplex é a lista de vértices do
+    simplex final. Caso os conjuntos se interceptem, distance é zero, pA e pB
+    são None e simplex pode ser utilizado pela função epa().
+
+    >>> square = lambda x0: (lambda dx, dy: (x0 + (1 if dx >= 0 else -1),
+    ...                                      (1 if dy >= 0 else -1)))
+    >>> gjk(square(0), square(5))[:3]
+    (3.0, (1.0, 1.0), (4.0, 1.0))
+    >>> gjk(square(0), square(1))[0]
+    0.0
+
+    Simplexes iniciais degenerados não são confundidos com uma intersecção
+
+    >>> gjk(square(0), square(5), [(-1, 0), (-1, 0), (-1, 0)])[0]
+    3.0
+    '''
+
+    simplex = [_vertex(supA, supB, dx, dy) for (dx, dy) in directions]
+    if not simplex:
+        ax, ay = supA(1.0, 0.0)
+        bx, by = supB(-1.0, 0.0)
+        dx, dy = bx - ax, by - ay
+        if dx == 0 and dy == 0:
+            dx = 1.0
+        simplex.append(_vertex(supA, supB, dx, dy))
+
+    weights = [1.0]
+    for _ in range(GJK_MAX_ITER):
+        vx, vy, simplex, weights = _closest(simplex)
+        if weights is None:
+            return 0.0, None, None, simplex
+
+        vv = vx * vx + vy * vy
+        if vv <= GJK_TOLERANCE:
+            return 0.0, None, None, simplex
+
+        # Novo vértice na direção da origem. Termina caso não haja progresso
+        W = _vertex(supA, supB, -vx, -vy)
+        if vv - (vx * W[0] + vy * W[1]) <= GJK_TOLERANCE * vv:
+            break
+        if any(W[0] == P[0] and W[1] == P[1] for P in simplex):
+            break
+        simplex.append(W)
+    else:
+        vx, vy, simplex, weights = _closest(simplex)
+        if weights is None:
+            return 0.0, None, None, simplex
+
+    ax = sum(w * P[2] for (w, P) in zip(weights, simplex))
+    ay = sum(w * P[3] for (w, P) in zip(weights, simplex))
+    bx = sum(w * P[4] for (w, P) in zip(weights, simplex))
+    by = sum(w * P[5] for (w, P) in zip(weights, simplex))
+    return sqrt(vx * vx + vy * vy), (ax, ay), (bx, by), simplex
+
+
+###############################################################################
+#                                 EPA
+###############################################################################
+def epa(supA, supB, simplex):
+    '''Calcula a penetração entre dois conjuntos convexos que se interceptam a
+    partir do simplex retornado por gjk().
+
+    Retorna uma tupla (normal, depth, pA, pB) em que normal aponta de A para
+    B, depth é a distância que B deve ser deslocado ao longo da normal para
+    separar os conjuntos e pA e pB são os pontos de maior penetração em cada
+    conjunto. Retorna None se a diferença de Minkowski for degenerada.'''
+
+    poly = list(simplex)
+
+    # Completa o simplex até formar um triângulo
+    while len(poly) < 3:
+        if len(poly) == 2:
+            P, Q = poly
+            dx, dy = P[1] - Q[1], Q[0] - P[0]
+            directions = [(dx, dy), (-dx, -dy)]
+        else:
+            directions = [(1.0, 0.0), (-1.0, 0.0), (0.0, 1.0), (0.0, -1.0)]
+
+        for (dx, dy) in directions:
+            W = _vertex(supA, supB, dx, dy)
+            if len(poly) == 2:
+                if _area2(P, Q, W) != 0:
+                    break
+            elif (W[0], W[1]) != (poly[0][0], poly[0][1]):
+                break
+        else:
+            return None
+        poly.append(W)
+
+    # Garante a orientação anti-horária
+    if _area2(*poly) < 0:
+        poly.reverse()
+
+    for _ in range(EPA_MAX_ITER):
+        best = None
+        N = len(poly)
+        for i in range(N):
+            P, Q = poly[i], poly[(i + 1) % N]
+            ex, ey = Q[0] - P[0], Q[1] - P[1]
+            norm = sqrt(ex * ex + ey * ey)
+            if norm == 0:
+                continue
+            nx, ny = ey / norm, -ex / norm
+            dist = nx * P[0] + ny * P[1]
+            if best is None or dist < best[0]:
+                best = (dist, i, nx, ny)
+
+        if best is None:
+            return None
+        dist, i, nx, ny = best
+        W = _vertex(supA, supB, nx, ny)
+        if nx * W[0] + ny * W[1] - dist <= EPA_TOLERANCE:
+            break
+        poly.insert(i + 1, W)
+
+    # Projeta a origem na aresta mais próxima para obter os pontos de contato
+    P, Q = poly[i], poly[(i + 1) % len(poly)]
+    ex, ey = Q[0] - P[0], Q[1] - P[1]
+    t = -(P[0] * ex + P[1] * ey) / (ex * ex + ey * ey)
+    t = min(max(t, 0.0), 1.0)
+    pA = (P[2] + t * (Q[2] - P[2]), P[3] + t * (Q[3] - P[3]))
+    pB = (P[4] + t * (Q[4] - P[4]), P[5] + t * (Q[5] - P[5]))
+    return (nx, ny), dist, pA, pB
+
+
+def _area2(P, Q, R):
+    # Dobro da área com sinal do triângulo PQR
+    return ((Q[0] - P[0]) * (R[1] - P[1]) -
+            (Q[1] - P[1]) * (R[0] - P[0]))
+
+
+###############################################################################
+#                      Interface com os objetos físicos
+###############################################################################
+def _cached_gjk(A, B, supA, supB):
+    # Executa o GJK a partir do simplex guardado para o par e atualiza o cache
+    key = (id(A), id(B))
+    result = gjk(supA, supB, _simplex_cache.get(key, ()))
+    if len(_simplex_cache) >= MAX_CACHED_SIMPLICES:
+        _simplex_cache.clear()
+    _simplex_cache[key] = [(P[6], P[7]) for P in result[3]]
+    return result
+
+
+def forget_simplices(obj):
+    '''Remove os simplexes guardados para os pares que contêm o objeto
+    obj'''
+
+    ref = id(obj)
+    for key in [key for key in _simplex_cache if ref in key]:
+        del _simplex_cache[key]
+
+
+def distance(A, B):
+    '''Retorna uma tupla (distance, pA, pB) com a distância entre os objetos
+    convexos A e B e os pontos mais próximos de cada um deles. Caso os objetos
+    se interceptem, retorna (0.0, None, None).
+
+    >>> from FGAme.physics import AABB
+    >>> distance(Circle(1, (0, 0)), AABB(shape=(2, 2), pos=(4, 0)))
+    (2.0, Vec2(1, 0), Vec2(3, 0))
+    '''
+
+    supA, rA = core_support(A)
+    supB, rB = core_support(B)
+    dist, pA, pB, _ = _cached_gjk(A, B, supA, supB)
+    if dist <= rA + rB:
+        return 0.0, None, None
+
+    nx, ny = (pB[0] - pA[0]) / dist, (pB[1] - pA[1]) / dist
+    pA = Vec2(pA[0] + rA * nx, pA[1] + rA * ny)
+    pB = Vec2(pB[0] - rB * nx, pB[1] - rB * ny)
+    return dist - rA - rB, pA, pB
+
+
+def collision_gjk(A, B):
+    '''Retorna a colisão entre os objetos convexos A e B (círculos, AABBs ou
+    polígonos) calculada pelos algoritmos GJK/EPA ou None caso não exista
+    colisão.
+
+    O ponto de colisão é o ponto médio entre os pontos de maior penetração de
+    cada objeto.
+
+    >>> from FGAme.physics import RegularPoly
+    >>> col = collision_gjk(Circle(5, (0, 0)), RegularPoly(4, 10, (10, 0)))
+    >>> round(col.normal.x, 4), round(col.delta, 4)
+    (1.0, 2.0711)
+    '''
+
+    supA, rA = core_support(A)
+    supB, rB = core_support(B)
+    margin = rA + rB
+    dist, pA, pB, simplex = _cached_gjk(A, B, supA, supB)
+
+    # Núcleos separados: a colisão acontece apenas dentro das margens
+    if dist > 0:
+        if dist >= margin:
+            return None
+        nx, ny = (pB[0] - pA[0]) / dist, (pB[1] - pA[1]) / dist
+        delta = margin - dist
+
+    # Núcleos se interceptam: calcula a penetração com o EPA
+    else:
+        result = epa(supA, supB, simplex)
+        if result is None:
+            return None
+        (nx, ny), delta, pA, pB = result
+        delta += margin
+
+    # Pontos nas superfícies de A e B e ponto de colisão
+    ax, ay = pA[0] + rA * nx, pA[1] + rA * ny
+    bx, by = pB[0] - rB * nx, pB[1] - rB * ny
+    pos = Vec2((ax + bx) / 2, (ay + by) / 2)
+    return Collision(A, B, pos=pos, normal=Vec2(nx, ny), delta=delta)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
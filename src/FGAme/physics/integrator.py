@@ -1,46 +1,285 @@
-from collections import UserList
+# -*- coding: utf8 -*-
+'''
+Integradores numéricos para as equações de movimento dos objetos.
 
+Cada frame da simulação é dividido em três etapas: a integração das
+velocidades, a resolução dos vínculos e colisões (que alteram as velocidades)
+e a integração das posições. Um integrador implementa a primeira e a última
+etapa através dos métodos integrate_velocities(objects, t, dt) e
+integrate_positions(objects, t, dt), que operam sobre todos os objetos de uma
+vez utilizando os arrays de BodyArrays.
 
-class Integrator(UserList):
+Os integradores disponíveis são:
 
-    '''Classe se comporta como uma lista de objetos cuja dinâmica é resolvida
-    separadamente do loop principal da FGAme.
+SemiImplicitEuler ('euler')
+    Atualiza as velocidades e depois as posições com as novas velocidades.
+    É o método utilizado pelo loop padrão da simulação.
+VelocityVerlet ('verlet')
+    Divide o impulso de cada frame em duas metades, antes e depois da
+    integração das posições, e guarda a aceleração do final do frame
+    (atributos _accel e _alpha dos objetos) para o frame seguinte. É
+    simplético e possui boa conservação de energia em órbitas e sistemas de
+    molas.
+RungeKutta4 ('rk4')
+    Avalia as acelerações em quatro estados intermediários de cada passo. As
+    forças externas dos objetos são calculadas com os estados intermediários
+    escritos provisoriamente nos objetos. É o mais preciso, mas custa quatro
+    avaliações de forças por frame.
 
-    Objetos podem ser adicionados a um grupo do tipo Integrator caso o
-    algoritmo de Euler semi-implícito utilizado pela FGAme não possua a
-    acurácia necessária para resolução de forças (ex.: sistemas
-    autogravitantes)
-    '''
+Em todos os casos, as correções de velocidade feitas pelos vínculos e as
+velocidades de estabilização são somadas às posições como no Euler
+semi-implícito.
+
+Os integradores requerem o NumPy.
+'''
+
+from itertools import compress
+from FGAme.mathutils import Vec2, nullvec2
+from FGAme.physics.body_arrays import BodyArrays, _load
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+__all__ = ['Integrator', 'SemiImplicitEuler', 'VelocityVerlet', 'RungeKutta4',
+           'get_integrator']
+
+
+class Integrator(object):
+
+    '''Classe base para todos os integradores.
+
+    O atributo arrays guarda o estado dos objetos (veja BodyArrays) ao final
+    da última etapa de integração.'''
+
+    __slots__ = ['arrays']
+
+    name = None
 
     def __init__(self):
-        self._data = []
+        self.arrays = BodyArrays()
+
+    def __repr__(self):
+        return '%s()' % type(self).__name__
+
+    def integrate_velocities(self, objects, t, dt):
+        '''Atualiza as velocidades dos objetos no instante t'''
+
+        raise NotImplementedError
+
+    def integrate_positions(self, objects, t, dt):
+        '''Atualiza as posições dos objetos após a resolução dos vínculos. O
+        instante t corresponde ao início do frame.'''
 
-    def add(self, obj):
-        '''Adiciona um objeto à lista de objetos'''
+        raise NotImplementedError
 
-        self.append(obj)
 
-    @property
-    def data(self):
-        return self._data
+class SemiImplicitEuler(Integrator):
 
-    def update(self, dt):
-        '''Atualiza as posições e velocidades'''
+    '''Euler semi-implícito:
 
+        v(t + dt) = v(t) + a(t) * dt
+        x(t + dt) = x(t) + v(t + dt) * dt
 
-class GravityIntegrator(Integrator):
+    Example
+    -------
+
+    >>> from FGAme.physics import Simulation, Circle
+    >>> sim = Simulation(gravity=10, integrator='euler')
+    >>> sim.add(Circle(1))
+    >>> sim.update(0.5)
+    >>> sim.arrays.pos.tolist()
+    [[0.0, -2.5]]
+    '''
+
+    __slots__ = []
+
+    name = 'euler'
+
+    def integrate_velocities(self, objects, t, dt):
+        self.arrays.integrate_velocities(objects, t, dt)
+
+    def integrate_positions(self, objects, t, dt):
+        self.arrays.integrate_positions(objects, dt)
+
+
+class VelocityVerlet(Integrator):
+
+    '''Velocity-Verlet:
+
+        v(t + dt/2) = v(t) + a(t) * dt / 2
+        x(t + dt) = x(t) + v(t + dt/2) * dt
+        v(t + dt) = v(t + dt/2) + a(t + dt) * dt / 2
+
+    Os vínculos atuam sobre as velocidades intermediárias v(t + dt/2). A
+    aceleração a(t + dt) é calculada após a integração das posições e guardada
+    nos atributos _accel e _alpha de cada objeto para ser reaproveitada no
+    frame seguinte, de modo que as forças são avaliadas uma única vez por
+    frame.
+
+    Example
+    -------
+
+    >>> from FGAme.physics import Simulation, Circle
+    >>> sim = Simulation(gravity=10, integrator='verlet')
+    >>> sim.add(Circle(1))
+    >>> sim.update(0.5)
+    >>> sim.arrays.pos.tolist(), sim.arrays.vel.tolist()
+    ([[0.0, -1.25]], [[0.0, -5.0]])
+    '''
+
+    __slots__ = []
+
+    name = 'verlet'
+
+    def integrate_velocities(self, objects, t, dt):
+        arrays = self.arrays
+        arrays.load_velocities(objects)
+
+        # Acelerações calculadas no final do frame anterior. Objetos que
+        # acabaram de entrar na simulação ainda não possuem este valor.
+        data = _load(objects, [
+            (o._accel.x, o._accel.y, o._alpha, o._accel is nullvec2)
+            for o in objects])
+        accel, alpha = data[:, 0:2], data[:, 2]
+        first = data[:, 3] != 0
+        if first.any():
+            new_accel, new_alpha = arrays.accelerations(t)
+            accel[first] = new_accel[first]
+            alpha[first] = new_alpha[first]
+        accel[~arrays.linear] = 0.0
+        alpha[~arrays.angular] = 0.0
+
+        arrays.vel += accel * (dt / 2)
+        arrays.omega += alpha * (dt / 2)
+        arrays.store_velocities()
+
+    def integrate_positions(self, objects, t, dt):
+        arrays = self.arrays
+        e_vel, e_omega = arrays.load_positions(objects)
+        arrays.store_positions((arrays.vel + e_vel) * dt,
+                               (arrays.omega + e_omega) * dt)
+
+        # Segunda metade do impulso com as acelerações nas novas posições
+        arrays.load_velocities(objects)
+        accel, alpha = arrays.accelerations(t + dt)
+        arrays.vel += accel * (dt / 2)
+        arrays.omega += alpha * (dt / 2)
+        arrays.store_velocities()
+
+        linear, angular = arrays.linear, arrays.angular
+        new = accel[linear]
+        for obj, x, y in zip(compress(objects, linear.tolist()),
+                             new[:, 0].tolist(), new[:, 1].tolist()):
+            obj._accel = Vec2(x, y)
+        for obj, value in zip(compress(objects, angular.tolist()),
+                              alpha[angular].tolist()):
+            obj._alpha = value
+
+
+class RungeKutta4(Integrator):
+
+    '''Runge-Kutta de quarta ordem.
+
+    A integração das velocidades calcula o passo completo de RK4 para as
+    posições e velocidades e guarda a diferença entre o deslocamento de RK4
+    e v(t + dt) * dt. A integração das posições soma esta diferença ao
+    deslocamento calculado com as velocidades corrigidas pelos vínculos.
+
+    Example
+    -------
+
+    >>> from FGAme.physics import Simulation, Circle
+    >>> sim = Simulation(gravity=10, integrator='rk4')
+    >>> sim.add(Circle(1))
+    >>> sim.update(0.5)
+    >>> sim.arrays.pos.tolist()
+    [[0.0, -1.25]]
+    '''
+
+    __slots__ = ['_delta', '_dtheta']
+
+    name = 'rk4'
 
     def __init__(self):
-        super(GravityIntegrator, self).__init__()
-        #...
+        super(RungeKutta4, self).__init__()
+        self._delta = self._dtheta = None
+
+    def integrate_velocities(self, objects, t, dt):
+        arrays = self.arrays
+        arrays.load_velocities(objects)
+        arrays.load_positions(objects)
+        x0, v0 = arrays.pos.copy(), arrays.vel.copy()
+        theta0, omega0 = arrays.theta.copy(), arrays.omega.copy()
+
+        # Os estados intermediários só precisam ser escritos nos objetos se
+        # houver alguma força externa que dependa deles
+        forced = bool(arrays.forced)
+        half = dt / 2
+
+        a1, alpha1 = arrays.accelerations(t, v0, omega0)
+        v2, omega2 = v0 + a1 * half, omega0 + alpha1 * half
+        if forced:
+            arrays.set_state(x0 + v0 * half, v2,
+                             theta0 + omega0 * half, omega2)
+        a2, alpha2 = arrays.accelerations(t + half, v2, omega2)
+        v3, omega3 = v0 + a2 * half, omega0 + alpha2 * half
+        if forced:
+            arrays.set_state(x0 + v2 * half, v3,
+                             theta0 + omega2 * half, omega3)
+        a3, alpha3 = arrays.accelerations(t + half, v3, omega3)
+        v4, omega4 = v0 + a3 * dt, omega0 + alpha3 * dt
+        if forced:
+            arrays.set_state(x0 + v3 * dt, v4, theta0 + omega3 * dt, omega4)
+        a4, alpha4 = arrays.accelerations(t + dt, v4, omega4)
+        if forced:
+            arrays.set_state(x0, v0, theta0, omega0)
+
+        sixth = dt / 6
+        arrays.vel = v0 + (a1 + 2 * a2 + 2 * a3 + a4) * sixth
+        arrays.omega = omega0 + (alpha1 + 2 * alpha2 + 2 * alpha3 +
+                                 alpha4) * sixth
+        arrays.store_velocities()
 
-    def update_accelerations(self):
-        '''Retorna a lista de acelerações para cada objeto'''
+        # Parte do deslocamento que não é explicada pela velocidade final
+        delta = (v0 + 2 * v2 + 2 * v3 + v4) * sixth
+        dtheta = (omega0 + 2 * omega2 + 2 * omega3 + omega4) * sixth
+        self._delta = delta - arrays.vel * dt
+        self._dtheta = dtheta - arrays.omega * dt
 
-        #...
+    def integrate_positions(self, objects, t, dt):
+        arrays = self.arrays
+        e_vel, e_omega = arrays.load_positions(objects)
+        delta = (arrays.vel + e_vel) * dt
+        dtheta = (arrays.omega + e_omega) * dt
 
-    def update(self, dt):
-        '''Utiliza o método de Velocity Verlet para atualizar as posições e
-        velocidades'''
+        # A lista de objetos pode ter mudado durante a resolução dos vínculos
+        if self._delta is not None and len(self._delta) == len(objects):
+            delta += self._delta
+            dtheta += self._dtheta
+        self._delta = self._dtheta = None
+        arrays.store_positions(delta, dtheta)
+
+
+###############################################################################
+#                          Seleção de integradores
+###############################################################################
+INTEGRATORS = {cls.name: cls for cls in
+               [SemiImplicitEuler, VelocityVerlet, RungeKutta4]}
+
+
+def get_integrator(integrator):
+    '''Retorna uma instância de integrador a partir do nome ('euler',
+    'verlet' ou 'rk4') ou da própria instância.
+
+    >>> get_integrator('rk4')
+    RungeKutta4()
+    '''
 
-        #...
+    if isinstance(integrator, Integrator):
+        return integrator
+    try:
+        cls = INTEGRATORS[integrator]
+    except KeyError:
+        raise ValueError('invalid integrator: %r' % (integrator,))
+    return cls()
@@ -14,6 +14,7 @@ class Poly(Body):
     '''Define um polígono arbitrário de N lados.'''
 
     __slots__ = ['_vertices', 'num_sides', '_normals_idxs', 'num_normals']
+    _shape_id = 3
 
     def __init__(self,
                  vertices,
@@ -24,10 +25,12 @@ class Poly(Body):
         pos_cm = center_of_mass(vertices)
         vertices = [v - pos_cm for v in vertices]
         self._vertices = vertices
+        self._init_normals()
 
-        # Cache de vértices
+        # Cache de vértices e normais rotacionados
         self._cache_theta = None
         self._cache_rvertices_last = None
+        self._cache_rnormals_last = None
         self._cache_rbbox_last = None
         self.cbb_radius = max(v.norm() for v in vertices)
         super(Poly, self).__init__(pos_cm, vel, theta, omega,
@@ -49,6 +52,21 @@ class Poly(Body):
         if pos is not None:
             self._pos = Vec2(*pos)
 
+    def _init_normals(self):
+        '''Calcula as normais unitárias externas de cada lado no referencial
+        do polígono e a distância de cada lado ao centro de massa. Estes
+        valores não dependem da rotação e são calculados apenas uma vez.'''
+
+        vertices = self._vertices
+        N = len(vertices)
+        sign = 1 if area(vertices) >= 0 else -1
+        normals = []
+        for i in range(N):
+            x, y = vertices[(i + 1) % N] - vertices[i]
+            normals.append(sign * Vec2(y, -x).normalize())
+        self._base_normals = normals
+        self._base_offsets = [n.dot(v) for (n, v) in zip(normals, vertices)]
+
     def get_li_indexes(self):
         '''Retorna os índices referents às normais linearmente independentes
         entre si.
@@ -94,13 +112,28 @@ class Poly(Body):
     def get_normals(self):
         '''Retorna uma lista com as normais linearmente independentes.'''
 
+        normals = self._rnormals
         if self._normals_idxs is None:
-            N = self.num_sides
-            points = self.vertices
-            segmentos = (points[(i + 1) % N] - points[i] for i in range(N))
-            return [Vec2(y, -x).normalize() for (x, y) in segmentos]
+            return list(normals)
         else:
-            return [self.get_normal(i) for i in self._normals_idxs]
+            return [normals[i] for i in self._normals_idxs]
+
+    def support(self, direction):
+        '''Retorna o vértice do polígono mais distante na direção fornecida
+        (ponto de suporte).
+
+        >>> p = Rectangle(shape=(4, 2))
+        >>> p.support((1, 1))
+        Vec2(2, 1)
+        '''
+
+        ux, uy = direction
+        best = None
+        for v in self._rvertices:
+            coord = v.x * ux + v.y * uy
+            if best is None or coord > best:
+                best, vertex = coord, v
+        return vertex + self._pos
 
     def is_internal_point(self, pt):
         '''Retorna True se um ponto for interno ao polígono.'''
@@ -124,6 +157,7 @@ class Poly(Body):
         else:
             R = RotMat2(self._theta)
             vert = [R * v for v in self._vertices]
+            self._cache_rnormals_last = [R * n for n in self._base_normals]
             xmin = min(v.x for v in vert)
             xmax = max(v.x for v in vert)
             ymin = min(v.y for v in vert)
@@ -136,6 +170,17 @@ class Poly(Body):
 
             return vert
 
+    @property
+    def _rnormals(self):
+        '''Normais externas de todos os lados rotacionadas pelo ângulo
+        atual. São recalculadas junto com _rvertices.'''
+
+        if self._theta == self._cache_theta:
+            return self._cache_rnormals_last
+        else:
+            self._rvertices
+            return self._cache_rnormals_last
+
     @property
     def _rbbox(self):
         if self._theta == self._cache_theta:
@@ -146,6 +191,8 @@ class Poly(Body):
 
     def scale(self, scale, update_physics=False):
         self._vertices = [scale * v for v in self._vertices]
+        self._init_normals()
+        self._cache_theta = None
 
     def area(self):
         return area(self._vertices)
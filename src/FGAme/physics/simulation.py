@@ -3,6 +3,9 @@
 from collections import defaultdict
 from FGAme.mathutils import Vec2, nullvec2
 from FGAme.physics.flags import BodyFlags
+from FGAme.physics.body_arrays import has_custom_forces
+from FGAme.physics.integrator import get_integrator
+from FGAme.physics.ccd import swept_bbox, ccd_radius, time_of_impact
 from FGAme.core import EventDispatcher, signal
 from FGAme.physics.broadphase import BroadPhase, BroadPhaseCBB, NarrowPhase
 from FGAme.draw import Color
@@ -15,6 +18,29 @@ from FGAme.draw import Color
 ###############################################################################
 SLEEP_LINEAR_VELOCITY = 3
 SLEEP_ANGULAR_VELOCITY = 0.05
+SLEEP_TIME = 0.5
+
+# Orçamento de iterações usado por scaled_island_niter(): cada ilha de
+# colisões recebe ISLAND_MIN_ITER + ISLAND_ITER_PER_CONTACT * n iterações do
+# solver, em que n é o número de contatos da ilha. As iterações são
+# interrompidas quando o resíduo (o maior incremento de impulso |deltaJ| de
+# uma iteração, dividido pela massa efetiva do contato) é menor que
+# Simulation.tolerance.
+ISLAND_MIN_ITER = 4
+ISLAND_ITER_PER_CONTACT = 2
+SOLVER_TOLERANCE = 1e-3
+
+
+def scaled_island_niter(n):
+    '''Número de iterações do solver proporcional ao número n de contatos
+    de uma ilha. Pode ser passado como o argumento ``island_niter`` de
+    Simulation.
+
+    >>> scaled_island_niter(1), scaled_island_niter(10)
+    (6, 24)
+    '''
+
+    return ISLAND_MIN_ITER + ISLAND_ITER_PER_CONTACT * n
 
 
 class Simulation(EventDispatcher):
@@ -25,11 +51,46 @@ class Simulation(EventDispatcher):
     objetos e update(dt) para atualizar o estado da simulação. Verifique a
     documentação do método update() para uma descrição detalhada sobre como
     a física é resolvida em cada etapa de simulação.
+
+    Ilhas de objetos em contato cujas velocidades linear e angular
+    permanecem abaixo de SLEEP_LINEAR_VELOCITY e SLEEP_ANGULAR_VELOCITY por
+    pelo menos ``sleep_time`` segundos são colocadas para dormir (veja
+    Body.sleep()). Objetos sem nenhum contato nunca dormem. Passe
+    sleep_time=None para desabilitar este comportamento.
+
+    O solver de impulsos sequenciais executa no máximo ``niter`` iterações
+    em cada ilha de contatos e para assim que o maior incremento de impulso
+    de uma iteração (em unidades de velocidade, isto é, |deltaJ| dividido pela
+    massa efetiva do contato) for menor que ``tolerance``. Os atributos
+    solver_iterations e solver_residual guardam o número de iterações
+    utilizadas e o resíduo final do último frame. O argumento
+    ``island_niter`` é uma função opcional que recebe o número de contatos de
+    uma ilha e retorna o número máximo de iterações desta ilha (por exemplo,
+    scaled_island_niter), sempre limitado por ``niter``. Por padrão, todas
+    as ilhas recebem ``niter`` iterações e dependem apenas da tolerância
+    para terminar antes.
+
+    Um solver alternativo pode ser passado pelo argumento ``solver`` (veja
+    FGAme.physics.contact_solver). O método solver.solve(contacts, niter,
+    tolerance) é chamado para cada ilha de contatos caso solver.per_island
+    seja verdadeiro ou, caso contrário, uma única vez com todos os contatos
+    do frame.
+
+    O argumento ``integrator`` seleciona um integrador numérico ('euler',
+    'verlet', 'rk4' ou uma instância de FGAme.physics.integrator.Integrator).
+    Neste caso, a integração das velocidades e posições é feita com operações
+    do NumPy sobre arrays contíguos com o estado de todos os objetos (veja
+    FGAme.physics.body_arrays.BodyArrays), acessíveis pelo atributo
+    ``arrays``. Este modo é vantajoso em simulações com muitos objetos.
+    ``soa=True`` equivale a integrator='euler'. Por padrão, os objetos são
+    integrados um a um pelo Euler semi-implícito.
     '''
 
     def __init__(self, gravity=None, damping=0, adamping=0,
                  restitution=1, sfriction=0, dfriction=0, max_speed=None,
-                 bounds=None, broad_phase=None, niter=400, beta=0.0):
+                 bounds=None, broad_phase=None, niter=40, beta=0.0,
+                 tolerance=SOLVER_TOLERANCE, solver=None, island_niter=None,
+                 sleep_time=SLEEP_TIME, integrator=None, soa=False):
 
         super(Simulation, self).__init__()
 
@@ -38,10 +99,25 @@ class Simulation(EventDispatcher):
         self._constraints = []
         self._contacts = []
         self._inactive = []
+        self._col_layers = {}
+        self._sleeping = {}
+        self._saved_state = []
+        self.islands = []
+        if integrator is None and soa:
+            integrator = 'euler'
+        if integrator is not None:
+            integrator = get_integrator(integrator)
+        self.integrator = integrator
 
         # Parâmetros do solver
         self.niter = niter
+        self.tolerance = tolerance
+        self.island_niter = island_niter
+        self.solver = solver
         self.beta = beta
+        self.solver_iterations = 0
+        self.solver_residual = 0.0
+        self.sleep_time = sleep_time
 
         # Define algortimos
         self.broad_phase = normalize_broad_phase(broad_phase, self)
@@ -79,6 +155,15 @@ class Simulation(EventDispatcher):
     def __contains__(self, obj):
         return obj in self._objects
 
+    @property
+    def arrays(self):
+        '''Estado dos objetos em arrays (veja BodyArrays) ou None caso a
+        simulação não utilize um integrador'''
+
+        if self.integrator is None:
+            return None
+        return self.integrator.arrays
+
     ###########################################################################
     #                               Sinais
     ###########################################################################
@@ -112,6 +197,8 @@ class Simulation(EventDispatcher):
         for obj in self._objects:
             if not obj.flags & owns_prop:
                 obj._gravity = gravity
+        if gravity != old:
+            self.wake_all()
         self.trigger('gravity-change', old, self._gravity)
 
     @property
@@ -223,6 +310,9 @@ class Simulation(EventDispatcher):
                 obj._dfriction = self.dfriction
             if not oflags & flags.owns_sfriction:
                 obj._sfriction = self.sfriction
+            if isinstance(obj._col_layer, str):
+                obj._update_col_filter()
+            self.broad_phase.add_object(obj)
             self.trigger('object-add', obj)
 
     def remove(self, obj):
@@ -234,7 +324,12 @@ class Simulation(EventDispatcher):
         except IndexError:
             raise ValueError('object not present')
         else:
+            # Objetos apoiados no objeto removido devem voltar a se mover
+            obj.wake()
+            self._sleeping.pop(id(obj), None)
             del self._objects[idx]
+            self.broad_phase.remove_object(obj)
+            self.narrow_phase.remove_object(obj)
             self.trigger('object-remove', obj)
             obj.destroy()
 
@@ -260,10 +355,19 @@ class Simulation(EventDispatcher):
             self._init_energy0()
 
         # Loop genérico
-        self.accumulate_accelerations(dt)
-        self.resolve_velocities(dt)
+        integrator = self.integrator
+        if integrator is None:
+            self.accumulate_accelerations(dt)
+            self.resolve_velocities(dt)
+        else:
+            integrator.integrate_velocities(self._objects, self.time, dt)
         self.resolve_constraints(dt)  # Colisão é um tipo de vínculo!
-        self.resolve_positions(dt)
+        self.resolve_ccd(dt)
+        if integrator is None:
+            self.resolve_positions(dt)
+        else:
+            integrator.integrate_positions(self._objects, self.time, dt)
+        self.update_sleep(dt)
 
         # Incrementa tempo e contador
         self.time += dt
@@ -337,7 +441,28 @@ class Simulation(EventDispatcher):
 
     def resolve_constraints(self, dt):
         '''Resolve todos os vínculos utilizando o algoritmo de impulsos
-        sequenciais'''
+        sequenciais
+
+        Example
+        -------
+
+        Uma pilha de caixas com restituição positiva não ganha energia com os
+        impulsos herdados do frame anterior (veja ContactCache)
+
+        >>> from FGAme.physics import AABB
+        >>> sim = Simulation(gravity=500, restitution=0.5)
+        >>> sim.add(AABB(bbox=(-200, 200, -20, 0), mass='inf'))
+        >>> boxes = [AABB(bbox=(-10, 10, 20 * i, 20 * i + 20))
+        ...          for i in range(8)]
+        >>> for box in boxes:
+        ...     sim.add(box)
+        >>> heights = []
+        >>> for _ in range(300):
+        ...     sim.update(1 / 60.)
+        ...     heights.append(boxes[-1].pos.y)
+        >>> max(heights) < 155
+        True
+        '''
 
         broad_cols = self.broad_phase(self._objects)
         narrow_cols = self.narrow_phase(broad_cols)
@@ -345,20 +470,52 @@ class Simulation(EventDispatcher):
         simple = self._simple = []
 
         # TODO: emite sinal pré-collision
+        # Os impulsos herdados do frame anterior (veja ContactCache) só são
+        # aplicados depois que todos os contatos calcularam o viés de
+        # restituição a partir das velocidades do início do frame
+        IS_SLEEP = BodyFlags.is_sleeping
         for col in narrow_cols:
+            A, B = col.A, col.B
+            if (A.flags | B.flags) & IS_SLEEP:
+                A.wake()
+                B.wake()
+            col.init()
+        for col in narrow_cols:
+            col.warm_start()
             if col.is_simple():
-                col.init()
                 col.resolve()
                 simple.append(col)
             else:
-                col.init()
                 nonsimple.append(col)
 
-        for _ in range(self.niter):
-            for col in nonsimple:
-                col.step()
+        # Resolve cada ilha de contatos separadamente ou todos os contatos
+        # com o solver alternativo
+        niter = self.niter
+        solver = self.solver
+        if solver is not None and not solver.per_island:
+            self.islands = [nonsimple] if nonsimple else []
+            max_iter, max_residual = solver.solve(nonsimple, niter,
+                                                  self.tolerance)
+        else:
+            self.islands = islands = self.get_islands(nonsimple)
+            max_iter = 0
+            max_residual = 0.0
+            island_niter = self.island_niter
+            for island in islands:
+                budget = niter
+                if island_niter is not None:
+                    budget = min(niter, island_niter(len(island)))
+                iters, residual = self.solve_island(island, budget)
+                if iters > max_iter:
+                    max_iter = iters
+                if residual > max_residual:
+                    max_residual = residual
+        self.solver_iterations = max_iter
+        self.solver_residual = max_residual
         for col in nonsimple:
             col.finalize()
+            col.A.remove_contact(col)
+            col.B.remove_contact(col)
 
         # TODO: emite sinal pós-collision
 
@@ -367,37 +524,315 @@ class Simulation(EventDispatcher):
         for col in narrow_cols:
             col.baumgarte_adjust(beta)
 
+    def resolve_ccd(self, dt):
+        '''Detecção contínua de colisões para os objetos marcados como bullet
+        (veja Body.is_bullet e FGAme.physics.ccd).
+
+        Para cada objeto rápido, calcula o instante de impacto com os objetos
+        que interceptam a caixa de contorno varrida pelo deslocamento do frame
+        e reduz a velocidade de estabilização do objeto de modo que a
+        integração das posições o interrompa no primeiro contato. A velocidade
+        não é alterada: a colisão é resolvida pelo solver no próximo frame.
+
+        Exemplos
+        --------
+
+        Um projétil rápido não atravessa uma parede fina
+
+        >>> from FGAme.physics import Circle, AABB
+        >>> sim = Simulation()
+        >>> wall = AABB(bbox=(10, 11, -50, 50), mass='inf'); sim.add(wall)
+        >>> bullet = Circle(1, vel=(3000, 0)); sim.add(bullet)
+        >>> bullet.is_bullet = True
+        >>> sim.update(1 / 60.)
+        >>> bullet.pos.x < 10
+        True
+        '''
+
+        BULLET = BodyFlags.is_bullet
+        IS_SLEEP = BodyFlags.is_sleeping
+        objects = self._objects
+        for A in objects:
+            if not A.flags & BULLET or A.flags & IS_SLEEP:
+                continue
+
+            # Deslocamentos menores que o objeto não atravessam obstáculos
+            vel = A._vel + A._e_vel
+            delta = vel * dt
+            if delta.norm() <= ccd_radius(A):
+                continue
+
+            xmin, xmax, ymin, ymax = swept_bbox(A, delta)
+            toi = None
+            for B in objects:
+                if (B is A or B.xmax < xmin or B.xmin > xmax or
+                        B.ymax < ymin or B.ymin > ymax or
+                        not self.can_collide(A, B)):
+                    continue
+                t = time_of_impact(A, B, delta - (B._vel + B._e_vel) * dt)
+                if t is not None and (toi is None or t < toi):
+                    toi = t
+
+            if toi is not None and toi < 1:
+                A._e_vel = vel * toi - A._vel
+
     def get_islands(self, contacts):
         '''Retorna a lista de grupos de colisão fechados no gráfico de
-        colisões'''
+        colisões.
+
+        Os grupos são calculados por union-find sobre os objetos de cada
+        contato. Objetos estáticos (massa e momento de inércia infinitos) não
+        conectam ilhas: duas pilhas apoiadas no mesmo chão são resolvidas de
+        forma independente.
+
+        Exemplos
+        --------
+
+        >>> from FGAme.physics import Circle, Collision
+        >>> A, B, C = Circle(1), Circle(1, (1.5, 0)), Circle(1, (3, 0))
+        >>> D, E = Circle(1, (10, 0)), Circle(1, (11.5, 0))
+        >>> cols = [Collision(A, B, pos=(0.75, 0), normal=(1, 0)),
+        ...         Collision(B, C, pos=(2.25, 0), normal=(1, 0)),
+        ...         Collision(D, E, pos=(10.75, 0), normal=(1, 0))]
+        >>> sorted(len(island) for island in Simulation().get_islands(cols))
+        [1, 2]
+        '''
+
+        find, roots = _union_contacts(contacts)
+        groups = defaultdict(list)
+        for col, root in zip(contacts, roots):
+            groups[find(root)].append(col)
+        return list(groups.values())
+
+    def get_body_islands(self, contacts, objects=None):
+        '''Retorna a lista de grupos de objetos dinâmicos conectados pelos
+        contatos dados.
+
+        Objetos da lista objects (por padrão, todos os objetos da simulação)
+        que não participam de nenhum contato formam ilhas com um único objeto.
+        Objetos estáticos não fazem parte de nenhuma ilha.'''
 
-        contacts = set(contacts)
+        if objects is None:
+            objects = self._objects
+        find = _union_contacts(contacts)[0]
         groups = defaultdict(list)
-        while contacts:
-            A, B = C = contacts.pop()
-            gA = groups[A]
-            gB = groups[B]
-            if gA is not gB:
-                gA.extend(gB)
-                groups[B] = gA
-            gA.append(C)
+        for obj in objects:
+            if obj._invmass or obj._invinertia:
+                groups[find(id(obj))].append(obj)
         return list(groups.values())
 
+    def solve_island(self, island, niter):
+        '''Executa até niter iterações do solver de impulsos sequenciais na
+        lista de contatos dada e retorna uma tupla com o número de iterações
+        realizadas e o resíduo da última iteração.
+
+        As iterações terminam antes caso o resíduo seja menor que
+        Simulation.tolerance. Utiliza o solver alternativo da simulação,
+        caso definido.'''
+
+        tol = self.tolerance
+        if self.solver is not None:
+            return self.solver.solve(island, niter, tol)
+        residual = 0.0
+        for i in range(niter):
+            residual = 0.0
+            for col in island:
+                delta = abs(col.step()) / col.effmass
+                if delta > residual:
+                    residual = delta
+            if residual < tol:
+                return i + 1, residual
+        return niter, residual
+
+    @property
+    def island_sizes(self):
+        '''Lista com o número de contatos de cada ilha resolvida no último
+        frame'''
+
+        return [len(island) for island in self.islands]
+
+    @property
+    def num_islands(self):
+        '''Número de ilhas resolvidas no último frame'''
+
+        return len(self.islands)
+
+    ###########################################################################
+    #                               Repouso
+    ###########################################################################
+    def update_sleep(self, dt):
+        '''Atualiza o tempo em repouso de cada objeto e coloca para dormir as
+        ilhas em que todos os objetos estão em repouso há pelo menos
+        sleep_time segundos.
+
+        Apenas objetos que participam de algum contato no frame atual (com
+        outro objeto ou com um objeto estático) acumulam tempo em repouso.
+        Deste modo, objetos livres que se movem lentamente nunca dormem.
+        Objetos sem a flag can_sleep ou que definem uma força ou torque
+        externos impedem que a sua ilha durma.
+
+        Exemplos
+        --------
+
+        >>> from FGAme.physics import Circle
+        >>> sim = Simulation()
+        >>> obj = Circle(1, vel=(2, 0))
+        >>> sim.add(obj)
+        >>> for _ in range(120):
+        ...     sim.update(1 / 60.)
+        >>> obj.is_sleeping, round(obj.pos.x, 6)
+        (False, 4.0)
+        '''
+
+        sleep_time = self.sleep_time
+        if sleep_time is None:
+            return
+
+        # Acumula o tempo em repouso dos objetos acordados em contato
+        IS_SLEEP = BodyFlags.is_sleeping
+        max_lin = SLEEP_LINEAR_VELOCITY ** 2
+        max_ang = SLEEP_ANGULAR_VELOCITY
+        touching = set()
+        for col in self.narrow_phase:
+            touching.add(id(col.A))
+            touching.add(id(col.B))
+        has_candidates = False
+        for obj in self._objects:
+            if obj.flags & IS_SLEEP or not (obj._invmass or obj._invinertia):
+                continue
+            if id(obj) not in touching:
+                obj._sleep_time = 0.0
+            elif obj._vel.norm_sqr() < max_lin and abs(obj._omega) < max_ang:
+                obj._sleep_time += dt
+                if obj._sleep_time >= sleep_time:
+                    has_candidates = True
+            else:
+                obj._sleep_time = 0.0
+        if not has_candidates:
+            return
+
+        # Só dormem as ilhas em que todos os objetos podem dormir
+        awake = [obj for obj in self._objects if not obj.flags & IS_SLEEP]
+        for island in self.get_body_islands(self.narrow_phase, awake):
+            if all(_can_sleep(obj, sleep_time) for obj in island):
+                for obj in island:
+                    obj.sleep()
+                    self._sleeping[id(obj)] = island
+
+    def wake(self, obj):
+        '''Acorda o objeto e todos os objetos que foram colocados para dormir
+        na mesma ilha'''
+
+        sleeping = self._sleeping
+        island = sleeping.pop(id(obj), None) or [obj]
+        for other in island:
+            sleeping.pop(id(other), None)
+            other._wake()
+
+    def wake_all(self):
+        '''Acorda todos os objetos da simulação'''
+
+        self._sleeping.clear()
+        IS_SLEEP = BodyFlags.is_sleeping
+        for obj in self._objects:
+            if obj.flags & IS_SLEEP:
+                obj._wake()
+
+    @property
+    def num_sleeping(self):
+        '''Número de objetos dormindo'''
+
+        IS_SLEEP = BodyFlags.is_sleeping
+        return sum(1 for obj in self._objects if obj.flags & IS_SLEEP)
+
     def can_collide(self, A, B):
-        '''Retorna True se A e B podem colidir'''
+        '''Retorna True se A e B podem colidir.
 
-        flags = BodyFlags
+        As regras de layers, grupos e objetos estáticos/dormindo estão
+        pré-compiladas nas palavras de filtro de cada objeto (veja
+        CollisionFilter), de modo que o teste se reduz a uma única operação
+        de bits.'''
+
+        return not (A._col_filter & B._col_mask)
 
-        # TODO: talvez fazer uma única consulta ao A.flags e B.flags...
-        if ((not A._invmass or A.flags & flags.is_sleeping) and
-                (not B._invmass or B.flags & flags.is_sleeping)):
-            return False
-        elif A._col_layer != B._col_layer:
-            return False
-        elif A._col_group_mask & B._col_group_mask:
-            return False
+    def get_col_layer(self, name):
+        '''Retorna o número associado ao layer de colisão com o nome dado.
 
-        return True
+        Novos nomes recebem números sequenciais a partir de 1 (o layer 0 é o
+        layer padrão). Inteiros são retornados sem modificação.
+
+        Exemplos
+        --------
+
+        >>> sim = Simulation()
+        >>> sim.get_col_layer('player'), sim.get_col_layer('enemy')
+        (1, 2)
+        >>> sim.get_col_layer('player')
+        1
+        '''
+
+        if not isinstance(name, str):
+            return int(name)
+        try:
+            return self._col_layers[name]
+        except KeyError:
+            layers = self._col_layers
+            layer = layers[name] = len(layers) + 1
+            return layer
+
+    ###########################################################################
+    #                    Interpolação para renderização
+    ###########################################################################
+    def save_state(self):
+        '''Guarda as posições e ângulos de todos os objetos.
+
+        Deve ser chamado antes de cada passo de simulação para que
+        interpolate() possa calcular estados intermediários entre os dois
+        últimos passos.'''
+
+        self._saved_state = [(obj, obj._pos, obj._theta)
+                             for obj in self._objects]
+
+    def interpolate(self, alpha):
+        '''Move os objetos para o estado intermediário entre o estado salvo
+        por save_state() (alpha=0) e o estado atual (alpha=1).
+
+        Retorna uma lista com os estados atuais dos objetos modificados, que
+        deve ser passada para restore_state() depois da renderização.
+
+        Exemplos
+        --------
+
+        >>> from FGAme.physics import Circle
+        >>> sim = Simulation()
+        >>> obj = Circle(1, vel=(10, 0)); sim.add(obj)
+        >>> sim.save_state(); sim.update(0.1)
+        >>> saved = sim.interpolate(0.25); obj.pos
+        Vec2(0.25, 0)
+        >>> sim.restore_state(saved); obj.pos
+        Vec2(1, 0)
+        '''
+
+        DIRTY = BodyFlags.dirty_any
+        current = []
+        for obj, pos, theta in self._saved_state:
+            new_pos, new_theta = obj._pos, obj._theta
+            if new_pos is pos and new_theta == theta:
+                continue
+            current.append((obj, new_pos, new_theta))
+            obj._pos = pos + (new_pos - pos) * alpha
+            obj._theta = theta + (new_theta - theta) * alpha
+            obj.flags |= DIRTY
+        return current
+
+    def restore_state(self, state):
+        '''Restaura os estados retornados por interpolate()'''
+
+        DIRTY = BodyFlags.dirty_any
+        for obj, pos, theta in state:
+            obj._pos = pos
+            obj._theta = theta
+            obj.flags |= DIRTY
 
     # Cálculo de parâmetros físicos ###########################################
     def kineticE(self):
@@ -508,6 +943,47 @@ class Simulation(EventDispatcher):
 ###############################################################################
 #                              Funções auxiliares
 ###############################################################################
+def _union_contacts(contacts):
+    '''Une os objetos dinâmicos de cada contato por union-find.
+
+    Retorna uma função find(id(obj)) que retorna a raiz do grupo do objeto e
+    a lista com uma raiz para cada contato. Objetos estáticos (massa e
+    momento de inércia infinitos) não conectam grupos.'''
+
+    parent = {}
+
+    def find(x):
+        root = parent.setdefault(x, x)
+        while root != parent[root]:
+            parent[root] = parent[parent[root]]
+            root = parent[root]
+        return root
+
+    roots = []
+    for col in contacts:
+        A, B = col.A, col.B
+        if A._invmass or A._invinertia:
+            rA = find(id(A))
+            if B._invmass or B._invinertia:
+                rB = find(id(B))
+                if rA != rB:
+                    parent[rB] = rA
+        else:
+            rA = find(id(B))
+        roots.append(rA)
+    return find, roots
+
+
+def _can_sleep(obj, sleep_time):
+    '''Verdadeiro se o objeto pode dormir neste frame'''
+
+    if obj._sleep_time < sleep_time or not obj.flags & BodyFlags.can_sleep:
+        return False
+
+    # Forças e torques definidos pelo usuário
+    return not has_custom_forces(obj)
+
+
 def normalize_broad_phase(broad_phase, world):
     '''Escolhe o parâmetro correto na inicialização do broad-phase'''
 